@@ -1,9 +1,12 @@
 from .facet import AttrIntFacetFilter
 from .facet import AttrBoolFacetFilter
 from .facet import AttrRangeFacetFilter
+from .facet import AttrTaggedFacetFilter
+from .queryfilter import AttrQueryFilter
 from .simple import AttrBoolSimpleFilter
 from .simple import AttrRangeSimpleFilter
 from .simple import AttrIntSimpleFilter
+from .simple import AttrTaggedSimpleFilter
 
 
 __all__ = [
@@ -11,8 +14,11 @@ __all__ = [
     'AttrBoolFacetFilter',
     'AttrIntFacetFilter',
     'AttrIntSimpleFilter',
+    'AttrQueryFilter',
     'AttrRangeSimpleFilter',
     'AttrRangeFacetFilter',
+    'AttrTaggedFacetFilter',
+    'AttrTaggedSimpleFilter',
 ]
 
 __version__ = '0.0.0'
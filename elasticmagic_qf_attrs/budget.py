@@ -0,0 +1,107 @@
+import copy
+import typing as t
+
+from elasticmagic import agg
+from elasticmagic.expression import Params
+
+
+DEFAULT_TERMS_SIZE = 10
+
+
+def count_agg_buckets(agg_expr: agg.AggExpression) -> int:
+    if not isinstance(agg_expr, agg.BucketAgg):
+        return 0
+    if isinstance(agg_expr, agg.Terms):
+        num_buckets = agg_expr.params.get('size') or DEFAULT_TERMS_SIZE
+    elif isinstance(agg_expr, agg.Range):
+        num_buckets = len(agg_expr.params.get('ranges') or [])
+    elif isinstance(agg_expr, agg.MultiBucketAgg):
+        num_buckets = agg_expr.params.get('size') or 1
+    else:
+        num_buckets = 1
+    sub_buckets = sum(
+        count_agg_buckets(sub_agg)
+        for sub_agg in agg_expr._aggregations.values()
+    )
+    return num_buckets + num_buckets * sub_buckets
+
+
+def _shrink_agg(
+        agg_expr: agg.AggExpression, ratio: float
+) -> agg.AggExpression:
+    if not isinstance(agg_expr, agg.BucketAgg):
+        return agg_expr
+    new_agg = copy.copy(agg_expr)
+    if isinstance(agg_expr, agg.Terms):
+        size = agg_expr.params.get('size') or DEFAULT_TERMS_SIZE
+        new_agg.params = Params(
+            agg_expr.params, size=max(int(size * ratio), 1)
+        )
+    new_agg._aggregations = Params({
+        sub_agg_name: _shrink_agg(sub_agg, ratio)
+        for sub_agg_name, sub_agg in agg_expr._aggregations.items()
+    })
+    return new_agg
+
+
+# Limits the total number of buckets and aggregations requested by
+# the attribute filters of a query filter. Aggregations are granted in
+# the order of their priority: sizes of the terms aggregations are reduced
+# when the rest of the budget is not enough and the aggregations that
+# do not fit at all are dropped.
+class AggBudget:
+    def __init__(
+            self,
+            max_buckets: t.Optional[int] = None,
+            max_aggs: t.Optional[int] = None,
+            priorities: t.Optional[t.Dict[str, int]] = None,
+    ):
+        self.max_buckets = max_buckets
+        self.max_aggs = max_aggs
+        self.priorities = priorities or {}
+
+    def get_priority(self, filter_name: str, attr_id: t.Optional[int]) -> int:
+        return self.priorities.get(filter_name, 0)
+
+    def allocate(
+            self,
+            aggs: t.Sequence[
+                t.Tuple[str, agg.AggExpression, str, t.Optional[int]]
+            ],
+    ) -> t.Dict[str, agg.AggExpression]:
+        # main aggregations of a filter go before per attribute ones
+        ordered_aggs = sorted(
+            enumerate(aggs),
+            key=lambda ix_agg: (
+                -self.get_priority(ix_agg[1][2], ix_agg[1][3]),
+                ix_agg[1][3] is not None,
+                ix_agg[0],
+            )
+        )
+
+        remaining_buckets = self.max_buckets
+        allocated_aggs: t.Dict[str, agg.AggExpression] = {}
+        for _, (agg_name, agg_expr, _, _) in ordered_aggs:
+            if (
+                    self.max_aggs is not None
+                    and len(allocated_aggs) >= self.max_aggs
+            ):
+                break
+            if remaining_buckets is not None:
+                num_buckets = count_agg_buckets(agg_expr)
+                if num_buckets > remaining_buckets:
+                    agg_expr = _shrink_agg(
+                        agg_expr, remaining_buckets / num_buckets
+                    )
+                    num_buckets = count_agg_buckets(agg_expr)
+                    if num_buckets > remaining_buckets:
+                        continue
+                remaining_buckets -= num_buckets
+            allocated_aggs[agg_name] = agg_expr
+
+        # keeps the original order of the aggregations
+        return {
+            agg_name: allocated_aggs[agg_name]
+            for agg_name, _, _, _ in aggs
+            if agg_name in allocated_aggs
+        }
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+import json
+import threading
+import time
+import typing as t
+
+from elasticmagic import Bool
+from elasticmagic.compiler import Compiler_7_0
+from elasticmagic.expression import Expression
+
+
+K = t.TypeVar('K')
+V = t.TypeVar('V')
+
+
+# Cache keys do not depend on an Elasticsearch version so any compiler is fine
+_key_compiler = Compiler_7_0
+
+
+def expression_key(*exprs: t.Optional[Expression]) -> str:
+    return json.dumps(
+        [
+            _key_compiler.compiled_expression(expr).body
+            if expr is not None else None
+            for expr in exprs
+        ],
+        sort_keys=True,
+        default=str,
+    )
+
+
+# Results of the same query differ between indices and can be changed by
+# search parameters such as routing, preference or terminate_after
+def search_query_key(
+        search_query: t.Any, *exprs: t.Optional[Expression]
+) -> str:
+    ctx = search_query.get_context()
+    return json.dumps(
+        [
+            ctx.index.get_name() if ctx.index is not None else None,
+            dict(ctx.search_params.items()),
+            expression_key(ctx.q, Bool.must(*ctx.filters), *exprs),
+        ],
+        sort_keys=True,
+        default=str,
+    )
+
+
+class LRUCache(t.Generic[K, V]):
+    def __init__(
+            self,
+            maxsize: int = 1024,
+            ttl: t.Optional[float] = None,
+            timer: t.Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data: 'OrderedDict[K, t.Tuple[t.Optional[float], V]]' = \
+            OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K, default: t.Optional[V] = None) -> t.Optional[V]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= self._timer():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: K, value: V) -> None:
+        expires_at = None
+        if self.ttl is not None:
+            expires_at = self._timer() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: K) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
@@ -1,7 +1,14 @@
+import math
 import typing as t
 
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None  # type: ignore
+
 from elasticmagic import agg
 from elasticmagic import Bool
+from elasticmagic import MatchAll
 from elasticmagic import Range
 from elasticmagic import Script
 from elasticmagic import SearchQuery
@@ -10,19 +17,30 @@ from elasticmagic.expression import Expression
 from elasticmagic.expression import FieldOperators
 from elasticmagic.result import SearchResult
 
+from .cache import LRUCache
+from .cache import search_query_key
 from .facet_result import AttrFacetFilterResult, TMaxValue, TMinValue
+from .facet_result import THistogram
+from .facet_result import TQuantiles
+from .facet_result import compute_histogram_quantiles
 from .facet_result import AttrRangeFacet
 from .facet_result import AttrRangeFacetFilterResult
-from .facet_result import AttrFacetValue
+from .facet_result import _value_key
 from .simple import AttrBoolSimpleFilter
 from .simple import AttrRangeSimpleFilter
 from .simple import AttrIntSimpleFilter
+from .simple import AttrTaggedSimpleFilter
 from .simple import BaseAttrSimpleFilter
+from .simple import INT_MAX_VALUE
+from .simple import ParamValues
 from .simple import Params
+from .stream import ColumnarBuckets
+from .util import ATTR_TYPE_TAG_BOOL
 from .util import merge_attr_value_bool
-from .util import merge_attr_value_int
+from .util import merge_attr_value_float
 from .util import split_attr_value_bool
 from .util import split_attr_value_int
+from .util import split_attr_value_tagged
 
 
 T = t.TypeVar('T')
@@ -39,46 +57,139 @@ for (int i = 0; i < attrsLen; i++) {
 return attrIds;
 '''
 
+# Doc values and key ranges are both sorted so values of the requested
+# attributes are collected in a single pass.
+# Key ranges are passed as a flat list: [min_key, max_key, min_key, ...]
+ATTR_VALUES_SCRIPT = '''
+List values = doc[params.field];
+List keyRanges = params.key_ranges;
+int valuesLen = values.size();
+int rangesLen = keyRanges.size();
+long[] foundValues = new long[valuesLen];
+int found = 0;
+int r = 0;
+for (int i = 0; i < valuesLen && r < rangesLen; i++) {
+    long v = values[i];
+    while (r < rangesLen && v > (long) keyRanges[r + 1]) {
+        r += 2;
+    }
+    if (r < rangesLen && v >= (long) keyRanges[r]) {
+        foundValues[found++] = v;
+    }
+}
+long[] attrValues = new long[found];
+for (int i = 0; i < found; i++) {
+    attrValues[i] = foundValues[i];
+}
+return attrValues;
+'''
+
+# Doc values are sorted so the values of an attribute go in a row,
+# thus a state is looked up only once per attribute of a document
 RANGE_ATTR_MINMAX_MAP_SCRIPT = '''
-for (v in doc[params.field]) {
-    String attr_id = (v >>> 32).toString();
-    float float_val = Float.intBitsToFloat((int) v);
-    float[] min_max = state.get(attr_id);
-    if (min_max == null) {
-        state[attr_id] = new float[] {float_val, float_val};
+List values = doc[params.field];
+int valuesLen = values.size();
+int i = 0;
+while (i < valuesLen) {
+    long v = values[i];
+    long attrId = v >>> 32;
+    float minValue = Float.intBitsToFloat((int) v);
+    float maxValue = minValue;
+    i++;
+    while (i < valuesLen) {
+        v = values[i];
+        if ((v >>> 32) != attrId) {
+            break;
+        }
+        float floatValue = Float.intBitsToFloat((int) v);
+        if (floatValue < minValue) {
+            minValue = floatValue;
+        }
+        if (floatValue > maxValue) {
+            maxValue = floatValue;
+        }
+        i++;
+    }
+    float[] minMax = state.get(attrId);
+    if (minMax == null) {
+        state.put(attrId, new float[] {minValue, maxValue});
         continue;
     }
-    if (float_val < min_max[0]){
-        min_max[0] = float_val;
+    if (minValue < minMax[0]) {
+        minMax[0] = minValue;
     }
-    if (float_val > min_max[1]){
-        min_max[1] = float_val;
+    if (maxValue > minMax[1]) {
+        minMax[1] = maxValue;
     }
 }
 '''
 
+# Shard states are transferred as parallel arrays
+# because maps can be serialized only with string keys
+RANGE_ATTR_MINMAX_COMBINE_SCRIPT = '''
+int stateLen = state.size();
+long[] attrIds = new long[stateLen];
+float[] minValues = new float[stateLen];
+float[] maxValues = new float[stateLen];
+int i = 0;
+for (entry in state.entrySet()) {
+    float[] minMax = entry.getValue();
+    attrIds[i] = entry.getKey();
+    minValues[i] = minMax[0];
+    maxValues[i] = minMax[1];
+    i++;
+}
+return [attrIds, minValues, maxValues];
+'''
+
 RANGE_ATTR_MINMAX_REDUCE_SCRIPT = '''
 Map reduced = new HashMap();
 for (state in states) {
-    for (entry in state.entrySet()) {
-        String attr_id = entry.getKey();
-        float[] min_max = entry.getValue();
-        if (!reduced.containsKey(attr_id)) {
-            reduced[attr_id] = min_max;
+    if (state == null) {
+        continue;
+    }
+    long[] attrIds = state[0];
+    float[] minValues = state[1];
+    float[] maxValues = state[2];
+    for (int i = 0; i < attrIds.length; i++) {
+        float[] minMax = reduced.get(attrIds[i]);
+        if (minMax == null) {
+            reduced.put(attrIds[i], new float[] {minValues[i], maxValues[i]});
             continue;
         }
-        if (min_max[0] < reduced[attr_id][0]) {
-            reduced[attr_id][0] = min_max[0];
+        if (minValues[i] < minMax[0]) {
+            minMax[0] = minValues[i];
         }
-        if (min_max[1] > reduced[attr_id][1]) {
-            reduced[attr_id][1] = min_max[1];
+        if (maxValues[i] > minMax[1]) {
+            minMax[1] = maxValues[i];
         }
     }
 }
-return reduced;
+int reducedLen = reduced.size();
+long[] attrIds = new long[reducedLen];
+float[] minValues = new float[reducedLen];
+float[] maxValues = new float[reducedLen];
+int i = 0;
+for (entry in reduced.entrySet()) {
+    float[] minMax = entry.getValue();
+    attrIds[i] = entry.getKey();
+    minValues[i] = minMax[0];
+    maxValues[i] = minMax[1];
+    i++;
+}
+return ['attr_ids': attrIds, 'min': minValues, 'max': maxValues];
 '''
 
-RANGE_ATTR_MINMAX_COMBINE_SCRIPT = 'return state;'
+
+AttrsGetter = t.Callable[[Params], t.Optional[t.Iterable[int]]]
+
+TMinMax = t.Dict[int, t.Tuple[TMinValue, TMaxValue]]
+
+HistogramBoundsGetter = t.Callable[[Params], t.Dict[int, t.Iterable[float]]]
+
+# The range aggregation compares values as doubles, so packed values are exact
+# only while they fit into the 53 bits of a double mantissa
+MAX_HISTOGRAM_ATTR_ID = (1 << 21) - 1
 
 
 def _parse_attr_id_from_agg_name(agg_name: str) -> t.Optional[int]:
@@ -88,24 +199,198 @@ def _parse_attr_id_from_agg_name(agg_name: str) -> t.Optional[int]:
         return None
 
 
+def _histogram_ranges(
+        attr_id: int, bounds: t.List[float]
+) -> t.List[t.Dict[str, t.Any]]:
+    def negative(v: float) -> int:
+        return merge_attr_value_float(attr_id, v if v < 0.0 else -0.0)
+
+    ranges = []
+    for ix, (from_, to) in enumerate(zip(bounds, bounds[1:])):
+        key = f'{attr_id}:{ix}'
+        if from_ >= 0.0:
+            if from_ == 0.0:
+                # -0.0 is equal to 0.0 but is packed as a negative value
+                ranges.append({
+                    'key': key,
+                    'from': negative(-0.0),
+                    'to': negative(-0.0) + 1,
+                })
+            ranges.append({
+                'key': key,
+                'from': merge_attr_value_float(attr_id, abs(from_)),
+                'to': merge_attr_value_float(attr_id, to),
+            })
+        elif to <= 0.0:
+            # packed negative floats go in the reversed order
+            ranges.append({
+                'key': key,
+                'from': negative(to) + 1,
+                'to': negative(from_) + 1,
+            })
+        else:
+            ranges.append({
+                'key': key,
+                'from': negative(-0.0),
+                'to': negative(from_) + 1,
+            })
+            ranges.append({
+                'key': key,
+                'from': merge_attr_value_float(attr_id, 0.0),
+                'to': merge_attr_value_float(attr_id, to),
+            })
+    return ranges
+
+
+class DiversifiedSampler(agg.SingleBucketAgg):
+    __agg_name__ = 'diversified_sampler'
+
+    def __init__(
+            self, shard_size=None, field=None, script=None,
+            max_docs_per_value=None, execution_hint=None, **kwargs
+    ):
+        super().__init__(
+            shard_size=shard_size, field=field, script=script,
+            max_docs_per_value=max_docs_per_value,
+            execution_hint=execution_hint, **kwargs
+        )
+
+
+class RawTermsAggResult(agg.AggResult):
+    def __init__(self, agg_expr, raw_data):
+        super().__init__(agg_expr)
+        self.raw_buckets = raw_data.get('buckets', [])
+
+    @property
+    def buckets(self) -> t.List[agg.Bucket]:
+        return agg.MultiBucketAggResult(
+            self.expr, {'buckets': self.raw_buckets}, None, None, None
+        ).buckets
+
+
+# Terms aggregation which result keeps raw buckets without building
+# bucket objects
+class RawTerms(agg.Terms):
+    result_cls = RawTermsAggResult
+
+    def build_agg_result(
+            self, raw_data, doc_cls_map=None, mapper_registry=None
+    ):
+        return self.result_cls(self, raw_data)
+
+
+def _iter_keys_counts(
+        terms_agg: t.Union[agg.MultiBucketAggResult, RawTermsAggResult]
+) -> t.Iterator[t.Tuple[int, int]]:
+    if isinstance(terms_agg, RawTermsAggResult):
+        raw_buckets = terms_agg.raw_buckets
+        if isinstance(raw_buckets, ColumnarBuckets):
+            yield from zip(raw_buckets.keys, raw_buckets.counts)
+            return
+        for raw_bucket in raw_buckets:
+            yield raw_bucket['key'], raw_bucket['doc_count']
+    else:
+        for bucket in terms_agg.buckets:
+            yield bucket.key, bucket.doc_count
+
+
+def _get_keys_counts(
+        terms_agg: t.Union[agg.MultiBucketAggResult, RawTermsAggResult]
+) -> t.Tuple[t.Sequence[int], t.Sequence[int]]:
+    if (
+        isinstance(terms_agg, RawTermsAggResult)
+        and isinstance(terms_agg.raw_buckets, ColumnarBuckets)
+    ):
+        return terms_agg.raw_buckets.keys, terms_agg.raw_buckets.counts
+    keys_counts = list(_iter_keys_counts(terms_agg))
+    return (
+        [key for key, _ in keys_counts],
+        [doc_count for _, doc_count in keys_counts],
+    )
+
+
+# Fields of terms aggregations that are never read by the facet filters
+TERMS_UNUSED_FIELDS = ('doc_count_error_upper_bound', 'sum_other_doc_count')
+
+
+def _filter_path_exclusions(agg_names: t.Iterable[str]) -> t.List[str]:
+    # a dot is a path separator in the filter path
+    return [
+        f'-aggregations.**.{agg_name.replace(".", "*")}.{field}'
+        for agg_name in agg_names
+        for field in TERMS_UNUSED_FIELDS
+    ]
+
+
+def _check_vectorized(vectorized: bool) -> bool:
+    if vectorized and numpy is None:
+        raise ImportError('numpy is required for vectorized decoding')
+    return vectorized
+
+
+def _merge_key_ranges(
+        key_ranges: t.Iterable[t.Tuple[int, int]]
+) -> t.List[int]:
+    merged: t.List[int] = []
+    for min_key, max_key in sorted(key_ranges):
+        if merged and min_key <= merged[-1] + 1:
+            merged[-1] = max(merged[-1], max_key)
+        else:
+            merged.extend((min_key, max_key))
+    return merged
+
+
+def _get_facet_attr_ids(
+        attrs_getter: t.Optional[AttrsGetter], params: Params
+) -> t.Optional[t.Set[int]]:
+    if attrs_getter is None:
+        return None
+    attr_ids = attrs_getter(params)
+    if attr_ids is None:
+        return None
+    return set(attr_ids)
+
+
 class BaseAttrFacetFilter(BaseAttrSimpleFilter, t.Generic[T]):
     full_agg_size: int
     single_agg_size: int
 
     _result_cls: t.Type[AttrFacetFilterResult[T]]
 
-    _facet_value_cls: t.Type[AttrFacetValue[T]]
-
     _attr_id_meta_key: str
 
+    _attrs_getter: t.Optional[AttrsGetter] = None
+
+    sampler_shard_size: t.Optional[int] = None
+    sampler_diversify_field: t.Optional[FieldOperators] = None
+
+    # decode bucket keys with numpy
+    vectorized: bool = False
+    # read buckets from a raw response
+    raw_buckets: bool = False
+    _value_bits: int
+
     def _split_bucket_key(self, key: int) -> t.Tuple[int, T]:
         raise NotImplementedError  # pragma: no cover
 
+    def _decode_values(self, values: t.Any) -> t.List[T]:
+        raise NotImplementedError  # pragma: no cover
+
     def _include_attrs_values(
             self, attr_ids: t.Iterable[int]
     ) -> t.Dict[int, t.List[int]]:
         raise NotImplementedError  # pragma: no cover
 
+    def _get_selected_values_predicate(
+            self, values: ParamValues
+    ) -> t.Optional[t.Callable[[T], bool]]:
+        selected_values = {
+            _value_key(v) for v in self._parse_values(values, 'exact')
+        }
+        if not selected_values:
+            return None
+        return lambda v: _value_key(v) in selected_values
+
     def _apply_filter_expression(
             self, search_query: SearchQuery, expr: Expression, attr_id: int
     ) -> None:
@@ -117,6 +402,19 @@ class BaseAttrFacetFilter(BaseAttrSimpleFilter, t.Generic[T]):
             }
         )
 
+    def _include_facet_attrs_values(
+            self, facet_attr_ids: t.Set[int]
+    ) -> t.Optional[t.List[int]]:
+        include_attrs_values = self._include_attrs_values(
+            sorted(facet_attr_ids)
+        )
+        if not facet_attr_ids.issubset(include_attrs_values):
+            return None
+        return sorted(
+            v for attr_id in facet_attr_ids
+            for v in include_attrs_values[attr_id]
+        )
+
     @property
     def _agg_name(self) -> str:
         return f'{self.qf._name}.{self.name}'
@@ -125,6 +423,91 @@ class BaseAttrFacetFilter(BaseAttrSimpleFilter, t.Generic[T]):
     def _filter_agg_name(self) -> str:
         return f'{self.qf._name}.{self.name}.filter'
 
+    @property
+    def _sampler_agg_name(self) -> str:
+        return f'{self.qf._name}.{self.name}.sampler'
+
+    def _filter_path_exclusions(self) -> t.List[str]:
+        return _filter_path_exclusions([
+            self._agg_name, f'{self._agg_name}:*'
+        ])
+
+    @property
+    def _terms_agg_cls(self) -> t.Type[agg.Terms]:
+        return RawTerms if self.raw_buckets else agg.Terms
+
+    def _sampler_agg(self, aggs: t.Dict[str, agg.BucketAgg]) -> agg.BucketAgg:
+        if self.sampler_diversify_field is not None:
+            return DiversifiedSampler(
+                shard_size=self.sampler_shard_size,
+                field=self.sampler_diversify_field,
+                aggs=aggs,
+            )
+        return agg.Sampler(shard_size=self.sampler_shard_size, aggs=aggs)
+
+    def _wrap_terms_agg(
+            self,
+            terms_agg: agg.Terms,
+            filters: t.List[Expression],
+            suffix: str = '',
+    ) -> t.Dict[str, agg.BucketAgg]:
+        aggs: t.Dict[str, agg.BucketAgg] = {
+            f'{self._agg_name}{suffix}': terms_agg
+        }
+        if self.sampler_shard_size is not None:
+            aggs = {
+                f'{self._sampler_agg_name}{suffix}': self._sampler_agg(aggs)
+            }
+            # the filter aggregation counts documents the sample is taken from
+            if not filters:
+                filters = [MatchAll()]
+        if filters:
+            aggs = {
+                f'{self._filter_agg_name}{suffix}': agg.Filter(
+                    Bool.must(*filters), aggs=aggs
+                )
+            }
+        return aggs
+
+    def _get_terms_agg_result(
+            self, result: SearchResult, suffix: str = ''
+    ) -> t.Tuple[t.Optional[agg.MultiBucketAggResult], float]:
+        parent_agg = result.get_aggregation(f'{self._filter_agg_name}{suffix}')
+        if parent_agg is None:
+            return result.get_aggregation(f'{self._agg_name}{suffix}'), 1.0
+        sampler_agg = parent_agg.get_aggregation(
+            f'{self._sampler_agg_name}{suffix}'
+        )
+        if sampler_agg is None:
+            return parent_agg.get_aggregation(f'{self._agg_name}{suffix}'), 1.0
+        sample_ratio = 1.0
+        if sampler_agg.doc_count and parent_agg.doc_count:
+            sample_ratio = max(
+                parent_agg.doc_count / sampler_agg.doc_count, 1.0
+            )
+        return (
+            sampler_agg.get_aggregation(f'{self._agg_name}{suffix}'),
+            sample_ratio,
+        )
+
+    def _attr_values_agg(
+            self, attr_ids: t.Iterable[int], size: int
+    ) -> agg.Terms:
+        return self._terms_agg_cls(
+            script=Script(
+                ATTR_VALUES_SCRIPT,
+                lang='painless',
+                params={
+                    'field': self.field,
+                    'key_ranges': _merge_key_ranges(
+                        self._attr_key_range(attr_id) for attr_id in attr_ids
+                    ),
+                }
+            ),
+            value_type='long',
+            size=size,
+        )
+
     def _apply_agg(self, search_query: SearchQuery) -> SearchQuery:
         aggs = {}
 
@@ -134,16 +517,26 @@ class BaseAttrFacetFilter(BaseAttrSimpleFilter, t.Generic[T]):
             exclude_tags
         )
 
-        full_terms_agg = agg.Terms(
-            self.field, size=self.full_agg_size
+        include = None
+        facet_attr_ids = _get_facet_attr_ids(
+            self._attrs_getter, self.qf._params
         )
-        if filters:
-            aggs[self._filter_agg_name] = agg.Filter(
-                Bool.must(*filters),
-                aggs={self._agg_name: full_terms_agg}
-            )
-        else:
-            aggs[self._agg_name] = full_terms_agg
+        if facet_attr_ids:
+            include = self._include_facet_attrs_values(facet_attr_ids)
+
+        # an empty list of attributes means there are no facets to build
+        if facet_attr_ids is None or facet_attr_ids:
+            if facet_attr_ids and include is None:
+                # values of the attributes are not known, so other
+                # attributes are dropped on the shards by their key ranges
+                full_terms_agg = self._attr_values_agg(
+                    facet_attr_ids, self.full_agg_size
+                )
+            else:
+                full_terms_agg = self._terms_agg_cls(
+                    self.field, size=self.full_agg_size, include=include
+                )
+            aggs.update(self._wrap_terms_agg(full_terms_agg, filters))
 
         post_filters = list(
             search_query.get_context().iter_post_filters_with_meta()
@@ -158,78 +551,165 @@ class BaseAttrFacetFilter(BaseAttrSimpleFilter, t.Generic[T]):
             selected_attr_ids.append(attr_id)
         include_attrs_values = self._include_attrs_values(selected_attr_ids)
         for attr_id in selected_attr_ids:
-            attr_aggs = {
-                f'{self._agg_name}:{attr_id}': agg.Terms(
-                    self.field,
-                    size=self.single_agg_size,
-                    include=include_attrs_values.get(attr_id),
-                )
-            }
             filters = [
                 f for f, m in post_filters
                 if m.get(self._attr_id_meta_key) != attr_id
             ]
-            if filters:
-                aggs[f'{self._filter_agg_name}:{attr_id}'] = agg.Filter(
-                    Bool.must(*filters),
-                    aggs=attr_aggs
+            include = include_attrs_values.get(attr_id)
+            if include is not None:
+                attr_agg = self._terms_agg_cls(
+                    self.field,
+                    size=self.single_agg_size,
+                    include=include,
                 )
             else:
-                aggs.update(attr_aggs)
+                # without known values collect only values of the attribute
+                # from the documents that have it
+                min_key, max_key = self._attr_key_range(attr_id)
+                filters.append(Range(self.field, gte=min_key, lte=max_key))
+                attr_agg = self._attr_values_agg(
+                    [attr_id], self.single_agg_size
+                )
+            aggs.update(
+                self._wrap_terms_agg(attr_agg, filters, f':{attr_id}')
+            )
 
         return search_query.aggs(aggs)
 
+    def _add_buckets_vectorized(
+            self,
+            facet_result: AttrFacetFilterResult[T],
+            keys: t.Sequence[int],
+            counts: t.Sequence[int],
+            sample_ratio: float,
+            skip_attr_ids: t.Set[int],
+            facet_attr_ids: t.Optional[t.Set[int]],
+    ) -> None:
+        keys_arr = numpy.array(keys, dtype=numpy.int64)
+        counts_arr = numpy.array(counts, dtype=numpy.int64)
+        attr_ids_arr = keys_arr >> self._value_bits
+        values_arr = keys_arr & ((1 << self._value_bits) - 1)
+
+        mask = None
+        if skip_attr_ids:
+            mask = ~numpy.isin(attr_ids_arr, list(skip_attr_ids))
+        if facet_attr_ids is not None:
+            facet_mask = numpy.isin(attr_ids_arr, list(facet_attr_ids))
+            mask = facet_mask if mask is None else mask & facet_mask
+        if mask is not None:
+            attr_ids_arr = attr_ids_arr[mask]
+            values_arr = values_arr[mask]
+            counts_arr = counts_arr[mask]
+        if not len(attr_ids_arr):
+            return
+
+        if sample_ratio != 1.0:
+            facet_result.approximate = True
+            counts_arr = numpy.rint(counts_arr * sample_ratio) \
+                .astype(numpy.int64)
+
+        # stable sort keeps the order of values inside an attribute,
+        # attributes go in the order of their first appearance
+        order = numpy.argsort(attr_ids_arr, kind='stable')
+        sorted_attr_ids = attr_ids_arr[order]
+        group_starts = numpy.flatnonzero(
+            numpy.diff(sorted_attr_ids, prepend=-1)
+        )
+        group_ends = numpy.append(group_starts[1:], len(order))
+        for group_ix in numpy.argsort(order[group_starts], kind='stable'):
+            group_order = order[group_starts[group_ix]:group_ends[group_ix]]
+            group_len = len(group_order)
+            facet_result.add_attr_buckets(
+                int(sorted_attr_ids[group_starts[group_ix]]),
+                self._decode_values(values_arr[group_order]),
+                counts_arr[group_order].tolist(),
+                [False] * group_len,
+                [False] * group_len,
+            )
+
     def _process_result(
             self, result: SearchResult, params: Params
     ) -> AttrFacetFilterResult[T]:
         facet_result = self._result_cls(self.name, self.alias)
 
+        facet_attr_ids = _get_facet_attr_ids(self._attrs_getter, params)
+
         selected_attr_values = {}
+        # buckets of the filtered attributes in the main aggregation are
+        # narrowed by their own filters
+        filtered_attr_ids = set()
         for selected_attr_id, w in self._iter_attr_values(params):
-            selected_attr_values[selected_attr_id] = set(
-                self._parse_values(w, 'exact')
-            )
-
-        processed_attr_ids = set()
-        for agg_name, attr_agg in result.aggregations.items():
-            if agg_name.startswith(f'{self._filter_agg_name}:'):
+            selected_attr_values[selected_attr_id] = \
+                self._get_selected_values_predicate(w)
+            if self._get_attr_filter_expression(selected_attr_id, w):
+                filtered_attr_ids.add(selected_attr_id)
+
+        def scale_count(count: int, sample_ratio: float) -> int:
+            if sample_ratio == 1.0:
+                return count
+            facet_result.approximate = True
+            return int(round(count * sample_ratio))
+
+        attr_ids = []
+        for agg_name in result.aggregations:
+            if (
+                agg_name.startswith(f'{self._filter_agg_name}:')
+                or agg_name.startswith(f'{self._agg_name}:')
+            ):
                 attr_id = _parse_attr_id_from_agg_name(agg_name)
                 if attr_id is not None:
-                    agg_name = f'{self._agg_name}:{attr_id}'
-                    attr_agg = attr_agg.get_aggregation(agg_name)
-
-            if not agg_name.startswith(f'{self._agg_name}:'):
-                continue
+                    attr_ids.append(attr_id)
 
-            attr_id = _parse_attr_id_from_agg_name(agg_name)
-            if attr_id is None:
+        processed_attr_ids = set()
+        for attr_id in attr_ids:
+            attr_agg, sample_ratio = self._get_terms_agg_result(
+                result, f':{attr_id}'
+            )
+            if attr_agg is None:
                 continue
-            selected_values = selected_attr_values.get(attr_id) or set()
+            is_selected = selected_attr_values.get(attr_id)
             processed_attr_ids.add(attr_id)
-            for bucket in attr_agg.buckets:
-                found_attr_id, value_id = self._split_bucket_key(bucket.key)
+            for key, doc_count in _iter_keys_counts(attr_agg):
+                found_attr_id, value_id = self._split_bucket_key(key)
                 if found_attr_id != attr_id:
                     continue
-                fv = self._facet_value_cls(
+                facet_result.add_attr_bucket(
+                    attr_id,
                     value_id,
-                    bucket.doc_count,
-                    value_id in selected_values,
-                    bool(selected_values),
+                    scale_count(doc_count, sample_ratio),
+                    is_selected is not None and is_selected(value_id),
+                    is_selected is not None,
                 )
-                facet_result.add_attr_value(attr_id, fv)
 
-        main_agg = result.get_aggregation(self._agg_name)
+        main_agg, sample_ratio = self._get_terms_agg_result(result)
         if main_agg is None:
-            main_agg = result.get_aggregation(self._filter_agg_name) \
-                .get_aggregation(self._agg_name)
-        for bucket in main_agg.buckets:
-            attr_id, value_id = self._split_bucket_key(bucket.key)
-            if attr_id in processed_attr_ids:
+            return facet_result
+        # per attribute aggregations can be dropped by an aggregations budget
+        skip_attr_ids = processed_attr_ids | filtered_attr_ids
+        if self.vectorized:
+            keys, counts = _get_keys_counts(main_agg)
+            self._add_buckets_vectorized(
+                facet_result,
+                keys,
+                counts,
+                sample_ratio,
+                skip_attr_ids,
+                facet_attr_ids,
+            )
+            return facet_result
+        for key, doc_count in _iter_keys_counts(main_agg):
+            attr_id, value_id = self._split_bucket_key(key)
+            if attr_id in skip_attr_ids:
+                continue
+            if facet_attr_ids is not None and attr_id not in facet_attr_ids:
                 continue
-            fv = self._facet_value_cls(
-                value_id, bucket.doc_count, False, False
+            facet_result.add_attr_bucket(
+                attr_id,
+                value_id,
+                scale_count(doc_count, sample_ratio),
+                False,
+                False,
             )
-            facet_result.add_attr_value(attr_id, fv)
 
         return facet_result
 
@@ -239,25 +719,62 @@ AttrsValuesGetter = t.Callable[[t.Iterable[int]], t.Dict[int, t.List[int]]]
 
 class AttrIntFacetFilter(AttrIntSimpleFilter, BaseAttrFacetFilter[int]):
     _result_cls = AttrFacetFilterResult[int]
-    _facet_value_cls = AttrFacetValue[int]
 
     _attr_id_meta_key = 'int_attr_id'
 
+    _value_bits = 32
+
     def __init__(
             self, name: str, field: FieldOperators,
             alias: t.Optional[str] = None,
             full_agg_size: int = 10_000,
             single_agg_size: int = 100,
             attrs_values_getter: t.Optional[AttrsValuesGetter] = None,
+            attrs_getter: t.Optional[AttrsGetter] = None,
+            sampler_shard_size: t.Optional[int] = None,
+            sampler_diversify_field: t.Optional[FieldOperators] = None,
+            vectorized: bool = False,
+            raw_buckets: bool = False,
     ):
         super().__init__(name, field, alias=alias)
         self.full_agg_size = full_agg_size
         self.single_agg_size = single_agg_size
         self._attrs_values_getter = attrs_values_getter
+        self._attrs_getter = attrs_getter
+        self.sampler_shard_size = sampler_shard_size
+        self.sampler_diversify_field = sampler_diversify_field
+        self.vectorized = _check_vectorized(vectorized)
+        self.raw_buckets = raw_buckets
 
     def _split_bucket_key(self, key: int) -> t.Tuple[int, int]:
         return split_attr_value_int(key)
 
+    def _decode_values(self, values: t.Any) -> t.List[int]:
+        return values.tolist()
+
+    def _get_selected_values_predicate(
+            self, values: ParamValues
+    ) -> t.Optional[t.Callable[[int], bool]]:
+        value_range = self._parse_range(values)
+        if value_range is None:
+            return super()._get_selected_values_predicate(values)
+        gte, lte = value_range
+        selected_values = {
+            _value_key(v) for v in self._parse_values(values, 'exact')
+        }
+
+        def is_selected(value: int) -> bool:
+            if _value_key(value) in selected_values:
+                return True
+            # ranges are applied only to int values
+            if isinstance(value, bool):
+                return False
+            if value > INT_MAX_VALUE:
+                value -= 1 << 32
+            return gte <= value <= lte
+
+        return is_selected
+
     def _include_attrs_values(
             self, attr_ids: t.Iterable[int]
     ) -> t.Dict[int, t.List[int]]:
@@ -266,30 +783,64 @@ class AttrIntFacetFilter(AttrIntSimpleFilter, BaseAttrFacetFilter[int]):
         attrs_values = {}
         for attr_id, values in self._attrs_values_getter(attr_ids).items():
             attrs_values[attr_id] = [
-                merge_attr_value_int(attr_id, v) for v in values
+                self._merge_attr_value(attr_id, v) for v in values
             ]
         return attrs_values
 
 
+# Decodes int and bool attributes from a single terms aggregation
+class AttrTaggedFacetFilter(AttrTaggedSimpleFilter, AttrIntFacetFilter):
+    _result_cls = AttrFacetFilterResult[t.Union[int, bool]]
+
+    _attr_id_meta_key = 'tagged_attr_id'
+
+    _value_bits = 33
+
+    def _split_bucket_key(
+            self, key: int
+    ) -> t.Tuple[int, t.Union[int, bool]]:
+        return split_attr_value_tagged(key)
+
+    def _decode_values(self, values: t.Any) -> t.List[t.Union[int, bool]]:
+        return [
+            bool(v & 1) if v >> 32 == ATTR_TYPE_TAG_BOOL else v
+            for v in values.tolist()
+        ]
+
+
 class AttrBoolFacetFilter(AttrBoolSimpleFilter, BaseAttrFacetFilter[bool]):
     _result_cls = AttrFacetFilterResult[bool]
-    _facet_value_cls = AttrFacetValue[bool]
 
     _attr_id_meta_key = 'bool_attr_id'
 
+    _value_bits = 1
+
     def __init__(
             self, name: str, field: FieldOperators,
             alias: t.Optional[str] = None,
             full_agg_size: int = 100,
             single_agg_size: int = 2,
+            attrs_getter: t.Optional[AttrsGetter] = None,
+            sampler_shard_size: t.Optional[int] = None,
+            sampler_diversify_field: t.Optional[FieldOperators] = None,
+            vectorized: bool = False,
+            raw_buckets: bool = False,
     ):
         super().__init__(name, field, alias=alias)
         self.full_agg_size = full_agg_size
         self.single_agg_size = single_agg_size
+        self._attrs_getter = attrs_getter
+        self.sampler_shard_size = sampler_shard_size
+        self.sampler_diversify_field = sampler_diversify_field
+        self.vectorized = _check_vectorized(vectorized)
+        self.raw_buckets = raw_buckets
 
     def _split_bucket_key(self, key: int) -> t.Tuple[int, bool]:
         return split_attr_value_bool(key)
 
+    def _decode_values(self, values: t.Any) -> t.List[bool]:
+        return values.astype(bool).tolist()
+
     def _include_attrs_values(
             self, attr_ids: t.Iterable[int]
     ) -> t.Dict[int, t.List[int]]:
@@ -311,9 +862,19 @@ class AttrRangeFacetFilter(AttrRangeSimpleFilter):
             field: FieldOperators,
             alias: t.Optional[str] = None,
             compute_min_max: bool = False,
+            attrs_getter: t.Optional[AttrsGetter] = None,
+            histogram_bounds_getter: t.Optional[HistogramBoundsGetter] = None,
+            quantiles: t.Sequence[float] = (),
+            min_max_cache: t.Optional[LRUCache[str, TMinMax]] = None,
     ):
         super().__init__(name, field, alias=alias)
         self._compute_min_max = compute_min_max
+        self._attrs_getter = attrs_getter
+        self._histogram_bounds_getter = histogram_bounds_getter
+        self._quantiles = tuple(quantiles)
+        self._min_max_cache = min_max_cache
+        self._min_max_cache_key: t.Optional[str] = None
+        self._cached_min_max: t.Optional[TMinMax] = None
 
     def _apply_filter_expression(
             self, search_query: SearchQuery, expr: Expression, attr_id: int
@@ -341,23 +902,95 @@ class AttrRangeFacetFilter(AttrRangeSimpleFilter):
     def _filter_min_max_agg_name(self) -> str:
         return f'{self._min_max_agg_name()}.filter'
 
-    def _process_min_max_agg_result(
-            self,
-            attr_id: int,
-            min_max_agg: SingleValueMetricsAggResult,
-    ) -> t.Tuple[TMinValue, TMaxValue]:
+    def _histogram_agg_name(self) -> str:
+        return f'{self._agg_name()}.histogram'
 
-        min_ = None
-        max_ = None
+    def _filter_path_exclusions(self) -> t.List[str]:
+        return _filter_path_exclusions([self._agg_name()])
 
-        if (
-            self._compute_min_max
-            and min_max_agg.value
-            and str(attr_id) in min_max_agg.value
-        ):
-            min_, max_ = min_max_agg.value[str(attr_id)]
+    def _get_histogram_bounds(
+            self, params: Params
+    ) -> t.Dict[int, t.List[float]]:
+        if self._histogram_bounds_getter is None:
+            return {}
+        histogram_bounds = {}
+        for attr_id, bounds in self._histogram_bounds_getter(params).items():
+            if attr_id > MAX_HISTOGRAM_ATTR_ID:
+                continue
+            # adding zero turns a negative zero into a positive one
+            bounds = sorted(set(b + 0.0 for b in bounds if not math.isnan(b)))
+            if len(bounds) < 2:
+                continue
+            histogram_bounds[attr_id] = bounds
+        return histogram_bounds
+
+    def _histogram_agg(
+            self, histogram_bounds: t.Dict[int, t.List[float]]
+    ) -> agg.Range:
+        ranges = []
+        for attr_id, bounds in histogram_bounds.items():
+            ranges.extend(_histogram_ranges(attr_id, bounds))
+        return agg.Range(self.field, ranges=ranges)
+
+    @staticmethod
+    def _process_histogram_agg_result(
+            histogram_agg: t.Optional[agg.RangeAggResult],
+    ) -> t.Dict[int, t.Dict[int, int]]:
+        counts: t.Dict[int, t.Dict[int, int]] = {}
+        if histogram_agg is None:
+            return counts
+        for bucket in histogram_agg.buckets:
+            attr_id, _, ix = bucket.key.partition(':')
+            attr_counts = counts.setdefault(int(attr_id), {})
+            attr_counts[int(ix)] = attr_counts.get(int(ix), 0) \
+                + bucket.doc_count
+        return counts
+
+    @staticmethod
+    def _build_histogram(
+            bounds: t.Optional[t.List[float]],
+            counts: t.Optional[t.Dict[int, int]],
+    ) -> t.Optional[THistogram]:
+        if bounds is None:
+            return None
+        counts = counts or {}
+        return [
+            (from_, to, counts.get(ix, 0))
+            for ix, (from_, to) in enumerate(zip(bounds, bounds[1:]))
+        ]
+
+    def _compute_quantiles(
+            self,
+            histogram: t.Optional[THistogram],
+            min_: TMinValue,
+            max_: TMaxValue,
+    ) -> t.Optional[TQuantiles]:
+        if not self._quantiles or histogram is None:
+            return None
+        return compute_histogram_quantiles(
+            histogram, self._quantiles, min_=min_, max_=max_
+        )
 
-        return min_, max_
+    @staticmethod
+    def _process_min_max_agg_result(
+            min_max_agg: t.Optional[SingleValueMetricsAggResult],
+    ) -> TMinMax:
+        min_max: TMinMax = {}
+        if min_max_agg is None or not min_max_agg.value:
+            return min_max
+        value = min_max_agg.value
+        for attr_id, min_, max_ in zip(
+                value['attr_ids'], value['min'], value['max']
+        ):
+            min_max[attr_id] = (min_, max_)
+        return min_max
+
+    def _get_min_max_cache_key(
+            self, search_query: SearchQuery, filters: t.List[Expression]
+    ) -> str:
+        return search_query_key(
+            search_query, self.field, Bool.must(*filters)
+        )
 
     def _apply_agg(self, search_query: SearchQuery) -> SearchQuery:
         aggs = {}
@@ -371,23 +1004,51 @@ class AttrRangeFacetFilter(AttrRangeSimpleFilter):
             exclude_tags,
         )
 
-        full_terms_agg = agg.Terms(
-            script=Script(
-                RANGE_ATTR_SCRIPT,
-                lang='painless',
-                params={
-                    'field': self.field,
-                }
-            ),
-            size=100
+        main_aggs = {}
+        facet_attr_ids = _get_facet_attr_ids(
+            self._attrs_getter, self.qf._params
         )
-        if agg_filters:
+        # an empty list of attributes means there are no facets to build
+        if facet_attr_ids is None or facet_attr_ids:
+            main_aggs[self._agg_name()] = agg.Terms(
+                script=Script(
+                    RANGE_ATTR_SCRIPT,
+                    lang='painless',
+                    params={
+                        'field': self.field,
+                    }
+                ),
+                size=100,
+                include=sorted(facet_attr_ids) if facet_attr_ids else None,
+            )
+
+        selected_attr_ids = set()
+        for filt, meta in post_filters_with_meta:
+            if not meta:
+                continue
+            selected_attr_id = meta.get(self._attr_id_meta_key)
+            if selected_attr_id is not None:
+                selected_attr_ids.add(selected_attr_id)
+
+        histogram_bounds = self._get_histogram_bounds(self.qf._params)
+        main_histogram_bounds = {
+            attr_id: bounds for attr_id, bounds in histogram_bounds.items()
+            if attr_id not in selected_attr_ids and (
+                facet_attr_ids is None or attr_id in facet_attr_ids
+            )
+        }
+        if main_histogram_bounds:
+            main_aggs[self._histogram_agg_name()] = self._histogram_agg(
+                main_histogram_bounds
+            )
+
+        if main_aggs and agg_filters:
             aggs[self._filter_agg_name()] = agg.Filter(
                 Bool.must(*agg_filters),
-                aggs={self._agg_name(): full_terms_agg}
+                aggs=main_aggs
             )
         else:
-            aggs[self._agg_name()] = full_terms_agg
+            aggs.update(main_aggs)
 
         for filt, meta in post_filters_with_meta:
             if not meta:
@@ -400,18 +1061,36 @@ class AttrRangeFacetFilter(AttrRangeSimpleFilter):
                 f for f, m in post_filters_with_meta
                 if m.get(self._attr_id_meta_key) != selected_attr_id
             ]
-            filters.append(
-                Range(
-                    self.field,
-                    gte=merge_attr_value_int(selected_attr_id, 0),
-                    lte=merge_attr_value_int(selected_attr_id, 0xffff_ffff)
-                )
-            )
+            min_key, max_key = self._attr_key_range(selected_attr_id)
+            filters.append(Range(self.field, gte=min_key, lte=max_key))
+            selected_aggs = {}
+            if selected_attr_id in histogram_bounds:
+                selected_aggs[self._histogram_agg_name()] = \
+                    self._histogram_agg(
+                        {selected_attr_id: histogram_bounds[selected_attr_id]}
+                    )
             aggs[self._agg_name(selected_attr_id)] = agg.Filter(
-                Bool.must(*filters)
+                Bool.must(*filters),
+                aggs=selected_aggs,
             )
 
+        self._min_max_cache_key = None
+        self._cached_min_max = None
         if self._compute_min_max:
+            min_max_filters = [
+                f for f, m in post_filters_with_meta
+                if m.get(self._attr_id_meta_key) is None
+                and not m.get('tags', set()).intersection(exclude_tags)
+            ]
+            if self._min_max_cache is not None:
+                self._min_max_cache_key = self._get_min_max_cache_key(
+                    search_query, min_max_filters
+                )
+                self._cached_min_max = self._min_max_cache.get(
+                    self._min_max_cache_key
+                )
+
+        if self._compute_min_max and self._cached_min_max is None:
             min_max_agg = agg.ScriptedMetric(
                 map_script=RANGE_ATTR_MINMAX_MAP_SCRIPT,
                 reduce_script=RANGE_ATTR_MINMAX_REDUCE_SCRIPT,
@@ -420,11 +1099,6 @@ class AttrRangeFacetFilter(AttrRangeSimpleFilter):
                     'field': self.field,
                 },
             )
-            min_max_filters = [
-                f for f, m in post_filters_with_meta
-                if m.get(self._attr_id_meta_key) is None
-                and not m.get('tags', set()).intersection(exclude_tags)
-            ]
             if min_max_filters:
                 aggs[self._filter_min_max_agg_name()] = agg.Filter(
                     Bool.must(*min_max_filters),
@@ -440,33 +1114,62 @@ class AttrRangeFacetFilter(AttrRangeSimpleFilter):
     ) -> AttrRangeFacetFilterResult:
         facet_result = AttrRangeFacetFilterResult(self.name, self.alias)
 
+        facet_attr_ids = _get_facet_attr_ids(self._attrs_getter, params)
+
         selected_attr_ids = set()
         for selected_attr_id, w in self._iter_attr_values(params):
             if (
                 self._parse_last_value(w, 'gte') is not None or
-                self._parse_last_value(w, 'lte') is not None
+                self._parse_last_value(w, 'lte') is not None or
+                self._parse_exists(w) is not None
             ):
                 selected_attr_ids.add(selected_attr_id)
 
+        # aggregations can be dropped by an aggregations budget
         main_agg = result.get_aggregation(self._agg_name())
-        if main_agg is None:
-            main_agg = result.get_aggregation(self._filter_agg_name()) \
-                .get_aggregation(self._agg_name())
+        histogram_agg = result.get_aggregation(self._histogram_agg_name())
+        main_filter_agg = result.get_aggregation(self._filter_agg_name())
+        if main_agg is None and main_filter_agg is not None:
+            main_agg = main_filter_agg.get_aggregation(self._agg_name())
+            histogram_agg = main_filter_agg.get_aggregation(
+                self._histogram_agg_name()
+            )
 
-        min_max_agg = None
-        if self._compute_min_max:
+        histogram_bounds = self._get_histogram_bounds(params)
+        histogram_counts = self._process_histogram_agg_result(histogram_agg)
+
+        min_max: TMinMax = {}
+        if self._compute_min_max and self._cached_min_max is not None:
+            min_max = self._cached_min_max
+        elif self._compute_min_max:
             min_max_agg = result.get_aggregation(self._min_max_agg_name())
-            if not min_max_agg:
-                min_max_agg = (
-                    result
-                    .get_aggregation(self._filter_min_max_agg_name())
-                    .get_aggregation(self._min_max_agg_name())
+            min_max_filter_agg = result.get_aggregation(
+                self._filter_min_max_agg_name()
+            )
+            if not min_max_agg and min_max_filter_agg is not None:
+                min_max_agg = min_max_filter_agg.get_aggregation(
+                    self._min_max_agg_name()
                 )
+            min_max = self._process_min_max_agg_result(min_max_agg)
+            if (
+                min_max_agg is not None
+                and self._min_max_cache is not None
+                and self._min_max_cache_key is not None
+            ):
+                self._min_max_cache.set(self._min_max_cache_key, min_max)
 
-        for bucket in main_agg.buckets:
+        main_buckets = main_agg.buckets if main_agg is not None else []
+        for bucket in main_buckets:
             attr_id = int(bucket.key)
-            min_, max_ = self._process_min_max_agg_result(
-                attr_id, min_max_agg
+            if facet_attr_ids is not None and attr_id not in facet_attr_ids:
+                continue
+            # a selected attribute is counted by its own aggregation
+            if attr_id in selected_attr_ids:
+                continue
+            min_, max_ = min_max.get(attr_id, (None, None))
+            histogram = self._build_histogram(
+                histogram_bounds.get(attr_id),
+                histogram_counts.get(attr_id),
             )
             facet_result.add_facet(
                 AttrRangeFacet(
@@ -475,6 +1178,8 @@ class AttrRangeFacetFilter(AttrRangeSimpleFilter):
                     selected=attr_id in selected_attr_ids,
                     min_=min_,
                     max_=max_,
+                    histogram=histogram,
+                    quantiles=self._compute_quantiles(histogram, min_, max_),
                 )
             )
 
@@ -482,8 +1187,15 @@ class AttrRangeFacetFilter(AttrRangeSimpleFilter):
             selected_agg = result.get_aggregation(
                 self._agg_name(selected_attr_id)
             )
-            min_, max_ = self._process_min_max_agg_result(
-                selected_attr_id, min_max_agg
+            if selected_agg is None:
+                continue
+            min_, max_ = min_max.get(selected_attr_id, (None, None))
+            selected_histogram_counts = self._process_histogram_agg_result(
+                selected_agg.get_aggregation(self._histogram_agg_name())
+            )
+            histogram = self._build_histogram(
+                histogram_bounds.get(selected_attr_id),
+                selected_histogram_counts.get(selected_attr_id),
             )
             facet_result.add_facet(
                 AttrRangeFacet(
@@ -492,6 +1204,8 @@ class AttrRangeFacetFilter(AttrRangeSimpleFilter):
                     selected=True,
                     min_=min_,
                     max_=max_,
+                    histogram=histogram,
+                    quantiles=self._compute_quantiles(histogram, min_, max_),
                 )
             )
 
@@ -1,3 +1,7 @@
+from array import array
+import math
+import struct
+import sys
 import typing as t
 
 from elasticmagic.ext.queryfilter.queryfilter import BaseFilterResult
@@ -6,6 +10,52 @@ from elasticmagic.ext.queryfilter.queryfilter import BaseFilterResult
 T = t.TypeVar('T')
 TMinValue = t.Union[int, float, None]
 TMaxValue = t.Union[int, float, None]
+THistogram = t.List[t.Tuple[float, float, int]]
+TQuantiles = t.Dict[float, float]
+
+
+# Approximates quantiles interpolating linearly inside histogram buckets,
+# known minimum and maximum values are used to bound unlimited buckets
+def compute_histogram_quantiles(
+        histogram: THistogram,
+        quantiles: t.Iterable[float],
+        min_: TMinValue = None,
+        max_: TMaxValue = None,
+) -> TQuantiles:
+    total = sum(count for _, _, count in histogram)
+    if not total:
+        return {}
+
+    res = {}
+    for q in quantiles:
+        target = q * total
+        acc = 0
+        value = None
+        for from_, to, count in histogram:
+            if not count:
+                continue
+            if acc + count >= target:
+                if min_ is not None:
+                    from_ = max(from_, min_)
+                if max_ is not None:
+                    to = min(to, max_)
+                if math.isinf(from_):
+                    value = to
+                elif math.isinf(to):
+                    value = from_
+                else:
+                    value = from_ + (to - from_) * (target - acc) / count
+                break
+            acc += count
+        if value is not None:
+            res[q] = value
+    return res
+
+
+# True == 1 in Python, so int and bool values of the same attribute are told
+# apart by their types
+def _value_key(value: t.Any) -> t.Tuple[bool, t.Any]:
+    return isinstance(value, bool), value
 
 
 class AttrFacetValue(t.Generic[T]):
@@ -31,7 +81,9 @@ class AttrFacet(t.Generic[T]):
         self.values: t.List[AttrFacetValue[T]] = []
         self.selected_values: t.List[AttrFacetValue[T]] = []
         self.all_values: t.List[AttrFacetValue[T]] = []
-        self._values_map: t.Dict[T, AttrFacetValue[T]] = {}
+        self._values_map: t.Dict[
+            t.Tuple[bool, T], AttrFacetValue[T]
+        ] = {}
 
     def add_value(self, facet_value: AttrFacetValue[T]) -> None:
         if facet_value.selected:
@@ -39,29 +91,401 @@ class AttrFacet(t.Generic[T]):
         else:
             self.values.append(facet_value)
         self.all_values.append(facet_value)
-        self._values_map[facet_value.value] = facet_value
+        self._values_map[_value_key(facet_value.value)] = facet_value
 
     def get_value(self, value: T) -> t.Optional[AttrFacetValue[T]]:
-        return self._values_map.get(value)
+        return self._values_map.get(_value_key(value))
+
+
+class AttrBuckets(t.Generic[T]):
+    def __init__(self) -> None:
+        self.values: t.List[T] = []
+        self.counts: t.List[int] = []
+        self.selected: t.List[bool] = []
+        self.has_selected: t.List[bool] = []
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self) -> t.Iterator[t.Tuple[T, int, bool, bool]]:
+        return zip(self.values, self.counts, self.selected, self.has_selected)
+
+    def add(
+            self, value: T, count: int, selected: bool, has_selected: bool
+    ) -> None:
+        self.values.append(value)
+        self.counts.append(count)
+        self.selected.append(selected)
+        self.has_selected.append(has_selected)
+
+    def extend(
+            self,
+            values: t.Iterable[T],
+            counts: t.Iterable[int],
+            selected: t.Iterable[bool],
+            has_selected: t.Iterable[bool],
+    ) -> None:
+        self.values.extend(values)
+        self.counts.extend(counts)
+        self.selected.extend(selected)
+        self.has_selected.extend(has_selected)
+
+
+_SELECTED_FLAG = 0b001
+_HAS_SELECTED_FLAG = 0b010
+# marks bool values when int and bool values are mixed
+_BOOL_VALUE_FLAG = 0b100
+
+
+class _PackedAttrBuckets(t.Generic[T]):
+    def __init__(
+            self,
+            values: t.Sequence[int],
+            counts: t.Sequence[int],
+            flags: t.Sequence[int],
+            value_type: t.Optional[t.Callable[[int], T]],
+    ):
+        self._values = values
+        self._counts = counts
+        self._flags = flags
+        self._value_type = value_type
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __iter__(self) -> t.Iterator[t.Tuple[T, int, bool, bool]]:
+        value_type = self._value_type
+        for value, count, flags in zip(
+                self._values, self._counts, self._flags
+        ):
+            decoded_value: t.Any = value
+            if value_type is not None:
+                decoded_value = value_type(value)
+            elif flags & _BOOL_VALUE_FLAG:
+                decoded_value = bool(value)
+            yield (
+                decoded_value,
+                count,
+                bool(flags & _SELECTED_FLAG),
+                bool(flags & _HAS_SELECTED_FLAG),
+            )
+
+
+# Fixed width arrays are stored in little endian byte order
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def _pad(size: int) -> int:
+    return -size % 8
+
+
+class _PackedWriter:
+    def __init__(self) -> None:
+        self._parts: t.List[bytes] = []
+        self._size = 0
+
+    def write(self, data: bytes) -> None:
+        self._parts.append(data)
+        self._size += len(data)
+
+    def write_str(self, value: str) -> None:
+        data = value.encode('utf-8')
+        self.write(struct.pack('<I', len(data)))
+        self.write(data)
+        self.write(b'\0' * _pad(self._size))
+
+    def write_array(self, typecode: str, values: t.Iterable[t.Any]) -> None:
+        arr = array(typecode, values)
+        if not _LITTLE_ENDIAN:
+            arr.byteswap()  # pragma: no cover
+        self.write(arr.tobytes())
+        self.write(b'\0' * _pad(self._size))
+
+    def getvalue(self) -> bytes:
+        return b''.join(self._parts)
+
+
+class _PackedReader:
+    def __init__(self, data: t.Union[bytes, bytearray, memoryview]):
+        self._view = memoryview(data).cast('B')
+        self._pos = 0
+
+    def read(self, size: int) -> t.Any:
+        if self._pos + size > len(self._view):
+            raise ValueError('Truncated data')
+        view = self._view[self._pos:self._pos + size]
+        self._pos += size
+        return view
+
+    def read_str(self) -> str:
+        size, = struct.unpack('<I', self.read(4))
+        value = bytes(self.read(size)).decode('utf-8')
+        self.read(_pad(self._pos))
+        return value
+
+    def read_array(self, typecode: str, length: int) -> t.Sequence[t.Any]:
+        itemsize = array(typecode).itemsize
+        view = self.read(length * itemsize)
+        self.read(_pad(self._pos))
+        if _LITTLE_ENDIAN:
+            # zero-copy view over the data
+            return view.cast(typecode)
+        arr = array(typecode, view.tobytes())  # pragma: no cover
+        arr.byteswap()  # pragma: no cover
+        return arr  # pragma: no cover
+
+
+_FACET_RESULT_MAGIC = b'QFA1'
+_RANGE_FACET_RESULT_MAGIC = b'QFR1'
+_MIXED_VALUE_TYPE = 2
+_VALUE_TYPES: t.Dict[int, t.Optional[t.Callable[[int], t.Any]]] = {
+    0: int, 1: bool, _MIXED_VALUE_TYPE: None,
+}
+
+
+V = t.TypeVar('V')
+
+
+class _LazyFacets(t.Mapping[int, V]):
+    def __init__(self, facet_result: t.Any):
+        self._facet_result = facet_result
 
+    def __getitem__(self, attr_id: int) -> V:
+        return self._facet_result._materialize_facet(attr_id)
 
+    def __iter__(self) -> t.Iterator[int]:
+        return iter(self._facet_result._attr_ids)
+
+    def __len__(self) -> int:
+        return len(self._facet_result._attr_ids)
+
+    def __contains__(self, attr_id: object) -> bool:
+        return attr_id in self._facet_result._attr_ids
+
+
+# Buckets are kept grouped by attribute and facet objects are only built
+# when a facet is accessed
 class AttrFacetFilterResult(BaseFilterResult, t.Generic[T]):
-    def __init__(self, name: str, alias: str):
+    def __init__(self, name: str, alias: str, approximate: bool = False):
         super().__init__(name, alias)
-        self.facets: t.Dict[int, AttrFacet[T]] = {}
+        self.approximate = approximate
+        self._attr_ids: t.Dict[int, None] = {}
+        self._attrs_buckets: t.Dict[
+            int, t.Union[AttrBuckets[T], _PackedAttrBuckets[T]]
+        ] = {}
+        self._facets: t.Dict[int, AttrFacet[T]] = {}
+
+    @property
+    def facets(self) -> t.Mapping[int, AttrFacet[T]]:
+        return _LazyFacets(self)
+
+    def _materialize_facet(self, attr_id: int) -> AttrFacet[T]:
+        facet = self._facets.get(attr_id)
+        if facet is not None:
+            return facet
+        if attr_id not in self._attr_ids:
+            raise KeyError(attr_id)
+        # results can be shared between threads: buckets are dropped only
+        # after a facet is published and the first published facet wins
+        buckets = self._attrs_buckets.get(attr_id)
+        facet = AttrFacet(attr_id)
+        if buckets is not None:
+            for value, count, selected, has_selected in buckets:
+                facet.add_value(
+                    AttrFacetValue(value, count, selected, has_selected)
+                )
+        facet = self._facets.setdefault(attr_id, facet)
+        self._attrs_buckets.pop(attr_id, None)
+        return facet
+
+    def _get_attr_buckets(self, attr_id: int) -> t.Optional[AttrBuckets[T]]:
+        self._attr_ids[attr_id] = None
+        if attr_id in self._facets:
+            return None
+        buckets = self._attrs_buckets.get(attr_id)
+        if isinstance(buckets, AttrBuckets):
+            return buckets
+        new_buckets: AttrBuckets[T] = AttrBuckets()
+        if buckets is not None:
+            for value, count, selected, has_selected in buckets:
+                new_buckets.add(value, count, selected, has_selected)
+        self._attrs_buckets[attr_id] = new_buckets
+        return new_buckets
 
     def add_attr_value(
             self, attr_id: int, facet_value: AttrFacetValue[T]
     ) -> None:
-        facet = self.facets.get(attr_id)
-        if facet is None:
-            facet = AttrFacet(attr_id)
-            self.facets[attr_id] = facet
-        facet.add_value(facet_value)
+        self._attr_ids[attr_id] = None
+        self._materialize_facet(attr_id).add_value(facet_value)
+
+    def add_attr_bucket(
+            self,
+            attr_id: int,
+            value: T,
+            count: int,
+            selected: bool,
+            has_selected: bool,
+    ) -> None:
+        buckets = self._get_attr_buckets(attr_id)
+        if buckets is None:
+            self._facets[attr_id].add_value(
+                AttrFacetValue(value, count, selected, has_selected)
+            )
+        else:
+            buckets.add(value, count, selected, has_selected)
+
+    def add_attr_buckets(
+            self,
+            attr_id: int,
+            values: t.Sequence[T],
+            counts: t.Sequence[int],
+            selected: t.Sequence[bool],
+            has_selected: t.Sequence[bool],
+    ) -> None:
+        buckets = self._get_attr_buckets(attr_id)
+        if buckets is None:
+            for value, count, sel, has_sel in zip(
+                    values, counts, selected, has_selected
+            ):
+                self.add_attr_bucket(attr_id, value, count, sel, has_sel)
+        else:
+            buckets.extend(values, counts, selected, has_selected)
 
     def get_facet(self, attr_id: int) -> t.Optional[AttrFacet[T]]:
         return self.facets.get(attr_id)
 
+    def _iter_attrs_buckets(
+            self
+    ) -> t.Iterator[t.Tuple[int, t.Iterable[t.Tuple[T, int, bool, bool]]]]:
+        for attr_id in self._attr_ids:
+            facet = self._facets.get(attr_id)
+            if facet is not None:
+                yield attr_id, [
+                    (
+                        v.value,
+                        v.count,
+                        v.selected,
+                        v._facet_has_selected_values,
+                    )
+                    for v in facet.all_values
+                ]
+            else:
+                yield attr_id, self._attrs_buckets.get(attr_id) or []
+
+    # Sums counts of the same attribute values, values are reordered
+    # by their merged counts
+    def merge(
+            self, *others: 'AttrFacetFilterResult[T]'
+    ) -> 'AttrFacetFilterResult[T]':
+        facet_results = (self,) + others
+        merged: AttrFacetFilterResult[T] = type(self)(
+            self.name,
+            self.alias,
+            approximate=any(fr.approximate for fr in facet_results),
+        )
+        attrs_values: t.Dict[
+            int, t.Dict[t.Tuple[bool, T], t.List[t.Any]]
+        ] = {}
+        for facet_result in facet_results:
+            for attr_id, buckets in facet_result._iter_attrs_buckets():
+                values = attrs_values.setdefault(attr_id, {})
+                for value, count, selected, has_selected in buckets:
+                    bucket = values.get(_value_key(value))
+                    if bucket is None:
+                        values[_value_key(value)] = \
+                            [value, count, selected, has_selected]
+                    else:
+                        bucket[1] += count
+                        bucket[2] = bucket[2] or selected
+                        bucket[3] = bucket[3] or has_selected
+
+        for attr_id, values in attrs_values.items():
+            merged_buckets = merged._get_attr_buckets(attr_id)
+            assert merged_buckets is not None
+            has_selected = any(
+                selected or facet_has_selected
+                for _, _, selected, facet_has_selected in values.values()
+            )
+            for value, count, selected, _ in sorted(
+                    values.values(), key=lambda bucket: -bucket[1]
+            ):
+                merged_buckets.add(value, count, selected, has_selected)
+        return merged
+
+    def to_bytes(self) -> bytes:
+        attr_ids = []
+        offsets = [0]
+        values: t.List[t.Any] = []
+        counts = []
+        flags = []
+        has_bool_values = has_int_values = False
+        for attr_id, buckets in self._iter_attrs_buckets():
+            attr_ids.append(attr_id)
+            for value, count, selected, has_selected in buckets:
+                is_bool = isinstance(value, bool)
+                has_bool_values |= is_bool
+                has_int_values |= not is_bool
+                values.append(value)
+                counts.append(count)
+                flags.append(
+                    (_SELECTED_FLAG if selected else 0)
+                    | (_HAS_SELECTED_FLAG if has_selected else 0)
+                    | (_BOOL_VALUE_FLAG if is_bool else 0)
+                )
+            offsets.append(len(values))
+        if has_bool_values and has_int_values:
+            value_type = _MIXED_VALUE_TYPE
+        else:
+            value_type = int(has_bool_values)
+
+        writer = _PackedWriter()
+        writer.write(
+            struct.pack(
+                '<4sBBHII',
+                _FACET_RESULT_MAGIC, value_type, self.approximate, 0,
+                len(attr_ids), len(values),
+            )
+        )
+        writer.write_str(self.name)
+        writer.write_str(self.alias)
+        writer.write_array('q', attr_ids)
+        writer.write_array('q', offsets)
+        writer.write_array('q', values)
+        writer.write_array('q', counts)
+        writer.write_array('B', flags)
+        return writer.getvalue()
+
+    @classmethod
+    def from_bytes(
+            cls, data: t.Union[bytes, bytearray, memoryview]
+    ) -> 'AttrFacetFilterResult[t.Any]':
+        reader = _PackedReader(data)
+        magic, value_type, approximate, _, attrs_len, values_len = \
+            struct.unpack('<4sBBHII', reader.read(16))
+        if magic != _FACET_RESULT_MAGIC or value_type not in _VALUE_TYPES:
+            raise ValueError('Invalid facet result data')
+        name = reader.read_str()
+        alias = reader.read_str()
+        attr_ids = reader.read_array('q', attrs_len)
+        offsets = reader.read_array('q', attrs_len + 1)
+        values = reader.read_array('q', values_len)
+        counts = reader.read_array('q', values_len)
+        flags = reader.read_array('B', values_len)
+
+        facet_result: AttrFacetFilterResult[t.Any] = cls(
+            name, alias, approximate=bool(approximate)
+        )
+        for ix, attr_id in enumerate(attr_ids):
+            start, end = offsets[ix], offsets[ix + 1]
+            facet_result._attr_ids[attr_id] = None
+            facet_result._attrs_buckets[attr_id] = _PackedAttrBuckets(
+                values[start:end],
+                counts[start:end],
+                flags[start:end],
+                _VALUE_TYPES[value_type],
+            )
+        return facet_result
+
 
 class AttrRangeFacet:
     def __init__(
@@ -71,21 +495,269 @@ class AttrRangeFacet:
         selected: bool,
         min_: TMinValue = None,
         max_: TMaxValue = None,
+        histogram: t.Optional[THistogram] = None,
+        quantiles: t.Optional[TQuantiles] = None,
     ):
         self.attr_id = attr_id
         self.count = count
         self.selected = selected
         self.min = min_
         self.max = max_
+        self.histogram = histogram
+        self.quantiles = quantiles
+
+
+_RANGE_HAS_MIN_FLAG = 0b0001
+_RANGE_HAS_MAX_FLAG = 0b0010
+_RANGE_HAS_HISTOGRAM_FLAG = 0b0100
+_RANGE_HAS_QUANTILES_FLAG = 0b1000
+
+
+class _PackedRangeFacets:
+    def __init__(
+            self,
+            counts: t.Sequence[int],
+            mins: t.Sequence[float],
+            maxs: t.Sequence[float],
+            histogram_offsets: t.Sequence[int],
+            histogram_from: t.Sequence[float],
+            histogram_to: t.Sequence[float],
+            histogram_counts: t.Sequence[int],
+            quantile_offsets: t.Sequence[int],
+            quantile_keys: t.Sequence[float],
+            quantile_values: t.Sequence[float],
+            selected: t.Sequence[int],
+            flags: t.Sequence[int],
+    ):
+        self.counts = counts
+        self.mins = mins
+        self.maxs = maxs
+        self.histogram_offsets = histogram_offsets
+        self.histogram_from = histogram_from
+        self.histogram_to = histogram_to
+        self.histogram_counts = histogram_counts
+        self.quantile_offsets = quantile_offsets
+        self.quantile_keys = quantile_keys
+        self.quantile_values = quantile_values
+        self.selected = selected
+        self.flags = flags
+
+    def build_facet(self, attr_id: int, ix: int) -> 'AttrRangeFacet':
+        flags = self.flags[ix]
+        histogram = None
+        if flags & _RANGE_HAS_HISTOGRAM_FLAG:
+            start = self.histogram_offsets[ix]
+            end = self.histogram_offsets[ix + 1]
+            histogram = list(zip(
+                self.histogram_from[start:end],
+                self.histogram_to[start:end],
+                self.histogram_counts[start:end],
+            ))
+        quantiles = None
+        if flags & _RANGE_HAS_QUANTILES_FLAG:
+            start = self.quantile_offsets[ix]
+            end = self.quantile_offsets[ix + 1]
+            quantiles = dict(zip(
+                self.quantile_keys[start:end],
+                self.quantile_values[start:end],
+            ))
+        return AttrRangeFacet(
+            attr_id,
+            self.counts[ix],
+            bool(self.selected[ix]),
+            min_=self.mins[ix] if flags & _RANGE_HAS_MIN_FLAG else None,
+            max_=self.maxs[ix] if flags & _RANGE_HAS_MAX_FLAG else None,
+            histogram=histogram,
+            quantiles=quantiles,
+        )
+
+
+def _merge_histograms(
+        histograms: t.Sequence[t.Optional[THistogram]]
+) -> t.Optional[THistogram]:
+    first = histograms[0]
+    if first is None:
+        return None
+    bounds = [(from_, to) for from_, to, _ in first]
+    counts = [0] * len(bounds)
+    for histogram in histograms:
+        # histograms with different buckets cannot be combined
+        if (
+                histogram is None
+                or [(from_, to) for from_, to, _ in histogram] != bounds
+        ):
+            return None
+        for ix, (_, _, count) in enumerate(histogram):
+            counts[ix] += count
+    return [
+        (from_, to, count) for (from_, to), count in zip(bounds, counts)
+    ]
+
+
+def merge_range_facets(facets: t.Sequence[AttrRangeFacet]) -> AttrRangeFacet:
+    if len(facets) == 1:
+        return facets[0]
+    mins = [f.min for f in facets if f.min is not None]
+    maxs = [f.max for f in facets if f.max is not None]
+    min_ = min(mins) if mins else None
+    max_ = max(maxs) if maxs else None
+    histogram = _merge_histograms([f.histogram for f in facets])
+    quantiles = None
+    quantile_keys = {
+        q for f in facets if f.quantiles is not None for q in f.quantiles
+    }
+    if histogram is not None and quantile_keys:
+        # quantiles of the parts are not additive, so they are approximated
+        # again using the merged histogram
+        quantiles = compute_histogram_quantiles(
+            histogram, sorted(quantile_keys), min_=min_, max_=max_
+        )
+    return AttrRangeFacet(
+        facets[0].attr_id,
+        sum(f.count for f in facets),
+        any(f.selected for f in facets),
+        min_=min_,
+        max_=max_,
+        histogram=histogram,
+        quantiles=quantiles,
+    )
 
 
 class AttrRangeFacetFilterResult(BaseFilterResult):
     def __init__(self, name: str, alias: str):
         super().__init__(name, alias)
-        self.facets: t.Dict[int, AttrRangeFacet] = {}
+        self._attr_ids: t.Dict[int, None] = {}
+        self._facets: t.Dict[int, AttrRangeFacet] = {}
+        self._packed_facets: t.Optional[_PackedRangeFacets] = None
+        self._packed_facet_ixs: t.Dict[int, int] = {}
+
+    @property
+    def facets(self) -> t.Mapping[int, 'AttrRangeFacet']:
+        return _LazyFacets(self)
+
+    def _materialize_facet(self, attr_id: int) -> 'AttrRangeFacet':
+        facet = self._facets.get(attr_id)
+        if facet is not None:
+            return facet
+        ix = self._packed_facet_ixs.get(attr_id)
+        if ix is None or self._packed_facets is None:
+            # the facet could be published by another thread meanwhile
+            facet = self._facets.get(attr_id)
+            if facet is None:
+                raise KeyError(attr_id)
+            return facet
+        facet = self._facets.setdefault(
+            attr_id, self._packed_facets.build_facet(attr_id, ix)
+        )
+        self._packed_facet_ixs.pop(attr_id, None)
+        return facet
 
     def add_facet(self, facet: AttrRangeFacet) -> None:
-        self.facets[facet.attr_id] = facet
+        self._attr_ids[facet.attr_id] = None
+        self._packed_facet_ixs.pop(facet.attr_id, None)
+        self._facets[facet.attr_id] = facet
 
     def get_facet(self, attr_id: int) -> t.Optional[AttrRangeFacet]:
         return self.facets.get(attr_id)
+
+    def merge(
+            self, *others: 'AttrRangeFacetFilterResult'
+    ) -> 'AttrRangeFacetFilterResult':
+        attrs_facets: t.Dict[int, t.List[AttrRangeFacet]] = {}
+        for facet_result in (self,) + others:
+            for attr_id, facet in facet_result.facets.items():
+                attrs_facets.setdefault(attr_id, []).append(facet)
+        merged = type(self)(self.name, self.alias)
+        for facets in attrs_facets.values():
+            merged.add_facet(merge_range_facets(facets))
+        return merged
+
+    def to_bytes(self) -> bytes:
+        facets = list(self.facets.values())
+        histogram_offsets = [0]
+        histogram: THistogram = []
+        quantile_offsets = [0]
+        quantiles: t.List[t.Tuple[float, float]] = []
+        flags = []
+        for facet in facets:
+            if facet.histogram is not None:
+                histogram.extend(facet.histogram)
+            histogram_offsets.append(len(histogram))
+            if facet.quantiles is not None:
+                quantiles.extend(facet.quantiles.items())
+            quantile_offsets.append(len(quantiles))
+            flags.append(
+                (_RANGE_HAS_MIN_FLAG if facet.min is not None else 0)
+                | (_RANGE_HAS_MAX_FLAG if facet.max is not None else 0)
+                | (
+                    _RANGE_HAS_HISTOGRAM_FLAG
+                    if facet.histogram is not None else 0
+                )
+                | (
+                    _RANGE_HAS_QUANTILES_FLAG
+                    if facet.quantiles is not None else 0
+                )
+            )
+
+        writer = _PackedWriter()
+        writer.write(
+            struct.pack(
+                '<4sIII',
+                _RANGE_FACET_RESULT_MAGIC,
+                len(facets), len(histogram), len(quantiles),
+            )
+        )
+        writer.write_str(self.name)
+        writer.write_str(self.alias)
+        writer.write_array('q', (f.attr_id for f in facets))
+        writer.write_array('q', (f.count for f in facets))
+        writer.write_array(
+            'd', (f.min if f.min is not None else 0.0 for f in facets)
+        )
+        writer.write_array(
+            'd', (f.max if f.max is not None else 0.0 for f in facets)
+        )
+        writer.write_array('q', histogram_offsets)
+        writer.write_array('d', (from_ for from_, _, _ in histogram))
+        writer.write_array('d', (to for _, to, _ in histogram))
+        writer.write_array('q', (count for _, _, count in histogram))
+        writer.write_array('q', quantile_offsets)
+        writer.write_array('d', (q for q, _ in quantiles))
+        writer.write_array('d', (v for _, v in quantiles))
+        writer.write_array('B', (f.selected for f in facets))
+        writer.write_array('B', flags)
+        return writer.getvalue()
+
+    @classmethod
+    def from_bytes(
+            cls, data: t.Union[bytes, bytearray, memoryview]
+    ) -> 'AttrRangeFacetFilterResult':
+        reader = _PackedReader(data)
+        magic, facets_len, histogram_len, quantiles_len = \
+            struct.unpack('<4sIII', reader.read(16))
+        if magic != _RANGE_FACET_RESULT_MAGIC:
+            raise ValueError('Invalid range facet result data')
+        name = reader.read_str()
+        alias = reader.read_str()
+        attr_ids = reader.read_array('q', facets_len)
+        packed_facets = _PackedRangeFacets(
+            counts=reader.read_array('q', facets_len),
+            mins=reader.read_array('d', facets_len),
+            maxs=reader.read_array('d', facets_len),
+            histogram_offsets=reader.read_array('q', facets_len + 1),
+            histogram_from=reader.read_array('d', histogram_len),
+            histogram_to=reader.read_array('d', histogram_len),
+            histogram_counts=reader.read_array('q', histogram_len),
+            quantile_offsets=reader.read_array('q', facets_len + 1),
+            quantile_keys=reader.read_array('d', quantiles_len),
+            quantile_values=reader.read_array('d', quantiles_len),
+            selected=reader.read_array('B', facets_len),
+            flags=reader.read_array('B', facets_len),
+        )
+
+        facet_result = cls(name, alias)
+        facet_result._packed_facets = packed_facets
+        for ix, attr_id in enumerate(attr_ids):
+            facet_result._attr_ids[attr_id] = None
+            facet_result._packed_facet_ixs[attr_id] = ix
+        return facet_result
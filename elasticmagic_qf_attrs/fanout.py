@@ -0,0 +1,56 @@
+import asyncio
+import typing as t
+
+from elasticmagic.ext.queryfilter import QueryFilter
+from elasticmagic.ext.queryfilter.queryfilter import QueryFilterResult
+
+
+def merge_query_filter_results(
+        qf_results: t.Sequence[QueryFilterResult]
+) -> QueryFilterResult:
+    filter_results: t.Dict[str, t.Any] = {}
+    for filter_name, filter_result in qf_results[0].filters.items():
+        others = [
+            qf_res.get_filter(filter_name) for qf_res in qf_results[1:]
+        ]
+        merge = getattr(filter_result, 'merge', None)
+        if merge is not None and all(o is not None for o in others):
+            filter_results[filter_name] = merge(*others)
+        else:
+            # only attribute filter results know how to merge themselves
+            filter_results[filter_name] = filter_result
+    return QueryFilterResult(filter_results)
+
+
+# Applies a query filter to every search query, for instance one per
+# index or cluster, and executes them concurrently. Results are merged
+# as soon as responses arrive. Every query gets its own query filter
+# instance because query filters keep the state between applying and
+# processing a result.
+async def search_and_merge(
+        qf_factory: t.Callable[[], QueryFilter],
+        search_queries: t.Iterable[t.Any],
+        params: t.Any,
+) -> QueryFilterResult:
+    search_queries = list(search_queries)
+    if not search_queries:
+        raise ValueError('At least one search query is required')
+
+    async def _search(search_query: t.Any) -> QueryFilterResult:
+        qf = qf_factory()
+        search_query = qf.apply(search_query, params)
+        return qf.process_result(await search_query.get_result())
+
+    qf_result: t.Optional[QueryFilterResult] = None
+    for next_result in asyncio.as_completed(
+            [_search(sq) for sq in search_queries]
+    ):
+        next_qf_result = await next_result
+        if qf_result is None:
+            qf_result = next_qf_result
+        else:
+            qf_result = merge_query_filter_results(
+                [qf_result, next_qf_result]
+            )
+    assert qf_result is not None
+    return qf_result
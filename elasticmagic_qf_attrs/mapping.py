@@ -0,0 +1,120 @@
+import typing as t
+
+from elasticmagic.compiler import Compiler_7_0
+from elasticmagic.ext.queryfilter import QueryFilter
+
+from .facet import AttrRangeFacetFilter
+from .facet import BaseAttrFacetFilter
+from .simple import BaseAttrSimpleFilter
+
+
+class _FieldRequirements:
+    def __init__(self) -> None:
+        # terms aggregations and scripts of the facet filters read doc values
+        self.doc_values = False
+        self.filter_names: t.List[str] = []
+
+
+def _get_field_name(field: t.Any) -> str:
+    return Compiler_7_0.compiled_expression(field).body
+
+
+def _collect_field_requirements(
+        qf: QueryFilter
+) -> t.Dict[str, _FieldRequirements]:
+    fields: t.Dict[str, _FieldRequirements] = {}
+    for filt in qf.filters:
+        if not isinstance(filt, BaseAttrSimpleFilter):
+            continue
+        field_name = _get_field_name(filt.field)
+        requirements = fields.get(field_name)
+        if requirements is None:
+            requirements = fields[field_name] = _FieldRequirements()
+        requirements.filter_names.append(filt.name)
+        if isinstance(filt, (BaseAttrFacetFilter, AttrRangeFacetFilter)):
+            requirements.doc_values = True
+    return fields
+
+
+# Packed attribute fields are numeric, so eager_global_ordinals does not
+# apply to them. Doc values are disabled for the fields that are only
+# used for filtering.
+def attr_fields_mapping(qf: QueryFilter) -> t.Dict[str, t.Any]:
+    mapping: t.Dict[str, t.Any] = {'properties': {}}
+    for field_name, requirements in _collect_field_requirements(qf).items():
+        properties = mapping['properties']
+        *parent_names, name = field_name.split('.')
+        for parent_name in parent_names:
+            properties = properties.setdefault(
+                parent_name, {'properties': {}}
+            )['properties']
+        field_mapping: t.Dict[str, t.Any] = {'type': 'long'}
+        if not requirements.doc_values:
+            field_mapping['doc_values'] = False
+        properties[name] = field_mapping
+    return mapping
+
+
+def _find_field_mapping(
+        mapping: t.Dict[str, t.Any], field_name: str
+) -> t.Optional[t.Dict[str, t.Any]]:
+    field_mapping: t.Optional[t.Dict[str, t.Any]] = mapping
+    for name in field_name.split('.'):
+        if field_mapping is None:
+            return None
+        field_mapping = field_mapping.get('properties', {}).get(name)
+    return field_mapping
+
+
+def _is_disabled(value: t.Any) -> bool:
+    return value is False or value == 'false'
+
+
+# Returns a list of problems of an existing mapping, for example:
+# client.indices.get_mapping(index=name)[name]['mappings']
+def validate_attr_fields_mapping(
+        qf: QueryFilter,
+        mapping: t.Dict[str, t.Any],
+        settings: t.Optional[t.Dict[str, t.Any]] = None,
+) -> t.List[str]:
+    errors = []
+    for field_name, requirements in _collect_field_requirements(qf).items():
+        filter_names = ', '.join(requirements.filter_names)
+        field_mapping = _find_field_mapping(mapping, field_name)
+        if field_mapping is None:
+            errors.append(
+                f'{field_name}: field is missing, used by {filter_names}'
+            )
+            continue
+        field_type = field_mapping.get('type')
+        if field_type != 'long':
+            errors.append(
+                f'{field_name}: expected long type but was {field_type}'
+            )
+        # term, terms and range queries use the points index
+        if _is_disabled(field_mapping.get('index')):
+            errors.append(
+                f'{field_name}: field must be indexed for filtering '
+                f'by {filter_names}'
+            )
+        if (
+                requirements.doc_values
+                and _is_disabled(field_mapping.get('doc_values'))
+        ):
+            errors.append(
+                f'{field_name}: doc values are required for facets '
+                f'of {filter_names}'
+            )
+
+    # facet requests usually do not fetch documents, so their results can be
+    # served by the shard request cache, which is enabled by default
+    if settings is not None:
+        requests_cache = (
+            settings.get('index', {}).get('requests', {}).get('cache', {})
+            .get('enable')
+        )
+        if requests_cache is None:
+            requests_cache = settings.get('index.requests.cache.enable')
+        if _is_disabled(requests_cache):
+            errors.append('index.requests.cache.enable: cache is disabled')
+    return errors
@@ -0,0 +1,135 @@
+import typing as t
+
+from elasticmagic import SearchQuery
+from elasticmagic.ext.queryfilter import QueryFilter
+
+from .facet import _parse_attr_id_from_agg_name
+from .facet import AttrRangeFacetFilter
+from .facet import BaseAttrFacetFilter
+
+
+class AggProfile:
+    def __init__(
+            self,
+            agg_name: str,
+            agg_type: str,
+            filter_name: t.Optional[str],
+            attr_id: t.Optional[int],
+            time_in_nanos: int,
+            self_time_in_nanos: int,
+    ):
+        self.agg_name = agg_name
+        self.agg_type = agg_type
+        self.filter_name = filter_name
+        self.attr_id = attr_id
+        self.time_in_nanos = time_in_nanos
+        self.self_time_in_nanos = self_time_in_nanos
+
+
+class FilterProfile:
+    def __init__(self, name: str):
+        self.name = name
+        self.time_in_nanos = 0
+        # aggregations that are not bound to a single attribute, for example
+        # the main terms aggregation, are accounted under the None key
+        self.attrs: t.Dict[t.Optional[int], int] = {}
+
+    def add_time(self, attr_id: t.Optional[int], time_in_nanos: int) -> None:
+        self.time_in_nanos += time_in_nanos
+        self.attrs[attr_id] = self.attrs.get(attr_id, 0) + time_in_nanos
+
+
+class QueryFilterProfile:
+    def __init__(self) -> None:
+        self.filters: t.Dict[str, FilterProfile] = {}
+        self.aggs: t.List[AggProfile] = []
+        # aggregations that do not belong to any filter, for instance
+        # shared filter aggregations
+        self.other_time_in_nanos = 0
+
+    def get_filter(self, name: str) -> t.Optional[FilterProfile]:
+        return self.filters.get(name)
+
+    def add_agg(self, agg_profile: AggProfile) -> None:
+        self.aggs.append(agg_profile)
+        if agg_profile.filter_name is None:
+            self.other_time_in_nanos += agg_profile.self_time_in_nanos
+            return
+        filter_profile = self.filters.get(agg_profile.filter_name)
+        if filter_profile is None:
+            filter_profile = self.filters[agg_profile.filter_name] = \
+                FilterProfile(agg_profile.filter_name)
+        filter_profile.add_time(
+            agg_profile.attr_id, agg_profile.self_time_in_nanos
+        )
+
+
+def profile_search_body(
+        search_query: SearchQuery, compiler: t.Any
+) -> t.Dict[str, t.Any]:
+    # profiling is not supported by the search query so it is enabled
+    # directly in the request body
+    body = dict(compiler.compiled_query(search_query).body or {})
+    body['profile'] = True
+    return body
+
+
+def _match_agg_name(
+        qf: QueryFilter, agg_name: str
+) -> t.Tuple[t.Optional[str], t.Optional[int]]:
+    for filt in qf._filters:
+        prefix = f'{qf._name}.{filt.name}'
+        if agg_name != prefix and not agg_name.startswith(
+                (f'{prefix}.', f'{prefix}:')
+        ):
+            continue
+        attr_id = None
+        if isinstance(filt, (BaseAttrFacetFilter, AttrRangeFacetFilter)):
+            attr_id = _parse_attr_id_from_agg_name(agg_name)
+        return filt.name, attr_id
+    return None, None
+
+
+def _iter_agg_profiles(
+        qf: QueryFilter,
+        raw_aggs: t.List[t.Dict[str, t.Any]],
+        parent_filter_name: t.Optional[str],
+        parent_attr_id: t.Optional[int],
+) -> t.Iterator[AggProfile]:
+    for raw_agg in raw_aggs:
+        agg_name = raw_agg.get('description', '')
+        time_in_nanos = raw_agg.get('time_in_nanos', 0)
+        children = raw_agg.get('children') or []
+
+        filter_name, attr_id = _match_agg_name(qf, agg_name)
+        if filter_name is None:
+            filter_name = parent_filter_name
+        if attr_id is None and filter_name == parent_filter_name:
+            # nested aggregations of a per attribute aggregation
+            attr_id = parent_attr_id
+
+        # time of an aggregation includes the time of its children
+        children_time = sum(c.get('time_in_nanos', 0) for c in children)
+        yield AggProfile(
+            agg_name,
+            raw_agg.get('type', ''),
+            filter_name,
+            attr_id,
+            time_in_nanos,
+            max(time_in_nanos - children_time, 0),
+        )
+        yield from _iter_agg_profiles(qf, children, filter_name, attr_id)
+
+
+# Maps the aggregations profile back to the query filter's filters and
+# attributes using the aggregation names. Timings of all shards are summed.
+def parse_aggs_profile(
+        qf: QueryFilter, raw_result: t.Dict[str, t.Any]
+) -> QueryFilterProfile:
+    qf_profile = QueryFilterProfile()
+    for shard in (raw_result.get('profile') or {}).get('shards', []):
+        for agg_profile in _iter_agg_profiles(
+                qf, shard.get('aggregations') or [], None, None
+        ):
+            qf_profile.add_agg(agg_profile)
+    return qf_profile
@@ -0,0 +1,288 @@
+import typing as t
+
+from elasticmagic import agg
+from elasticmagic import SearchQuery
+from elasticmagic.agg import AggResult
+from elasticmagic.ext.queryfilter import QueryFilter
+from elasticmagic.ext.queryfilter.queryfilter import BaseFilter
+from elasticmagic.ext.queryfilter.queryfilter import QueryFilterResult
+from elasticmagic.result import SearchResult
+
+from .budget import AggBudget
+from .cache import LRUCache
+from .cache import expression_key
+from .cache import search_query_key
+from .facet import _parse_attr_id_from_agg_name
+from .facet import AttrRangeFacetFilter
+from .facet import BaseAttrFacetFilter
+from .stream import parse_search_result
+from .stream import StreamingResponseParser
+
+
+class _FilterAggResultView(AggResult):
+    def __init__(
+            self,
+            agg_expr: agg.Filter,
+            doc_count: t.Optional[int],
+            aggregations: t.Dict[str, AggResult],
+    ):
+        super().__init__(agg_expr)
+        self.doc_count = doc_count
+        self.aggregations = aggregations
+
+    def get_aggregation(self, name: str) -> t.Optional[AggResult]:
+        return self.aggregations.get(name)
+
+
+def _is_attr_facet_filter(filt: BaseFilter) -> bool:
+    return isinstance(filt, (BaseAttrFacetFilter, AttrRangeFacetFilter))
+
+
+def _split_filter_path(filter_path: t.Any) -> t.List[str]:
+    if isinstance(filter_path, str):
+        filter_path = filter_path.split(',')
+    return [p.strip() for p in filter_path if p.strip()]
+
+
+# Filter aggregations of the attribute facet filters with the same filter
+# expression are merged into a single filter aggregation, so the filter is
+# evaluated only once. Results are split back before processing by filters.
+#
+# When an aggregations cache is passed every top level aggregation of the
+# attribute filters is memoized separately, so after changing a filter only
+# the aggregations depending on it are sent to Elasticsearch.
+class AttrQueryFilter(QueryFilter):
+    share_agg_filters = True
+    # exclude unused fields of the aggregations from the response
+    trim_response = True
+    # send all the aggregations and overwrite cached results
+    refresh_agg_cache = False
+
+    def __init__(
+            self,
+            name=None,
+            codec=None,
+            agg_cache: t.Optional[LRUCache[str, AggResult]] = None,
+            agg_budget: t.Optional[AggBudget] = None,
+    ):
+        super().__init__(name=name, codec=codec)
+        self._agg_cache = agg_cache
+        self._agg_budget = agg_budget
+        self._shared_aggs: t.Dict[str, t.List[t.Tuple[str, agg.Filter]]] = {}
+        self._cached_aggs: t.Dict[str, AggResult] = {}
+        self._agg_cache_keys: t.Dict[str, str] = {}
+
+    def _find_attr_filter(self, agg_name: str) -> t.Optional[BaseFilter]:
+        for filt in self._filters:
+            if not _is_attr_facet_filter(filt):
+                continue
+            prefix = f'{self._name}.{filt.name}'
+            if (
+                agg_name == prefix
+                or agg_name.startswith(f'{prefix}.')
+                or agg_name.startswith(f'{prefix}:')
+            ):
+                return filt
+        return None
+
+    def _is_attr_agg_name(self, agg_name: str) -> bool:
+        return self._find_attr_filter(agg_name) is not None
+
+    def _apply_agg_budget(
+            self, search_query: SearchQuery, agg_budget: AggBudget
+    ) -> SearchQuery:
+        aggs = search_query.get_context().aggregations
+        attr_aggs = []
+        for agg_name, agg_expr in aggs.items():
+            filt = self._find_attr_filter(agg_name)
+            if filt is not None:
+                attr_aggs.append((
+                    agg_name,
+                    agg_expr,
+                    filt.name,
+                    _parse_attr_id_from_agg_name(agg_name),
+                ))
+        if not attr_aggs:
+            return search_query
+        allocated_aggs = agg_budget.allocate(attr_aggs)
+        new_aggs = {}
+        for agg_name, agg_expr in aggs.items():
+            if not self._is_attr_agg_name(agg_name):
+                new_aggs[agg_name] = agg_expr
+            elif agg_name in allocated_aggs:
+                new_aggs[agg_name] = allocated_aggs[agg_name]
+        return search_query.aggs(None).aggs(new_aggs)
+
+    def _get_agg_cache_key(
+            self, search_query: SearchQuery, agg_expr: agg.AggExpression
+    ) -> str:
+        # filter aggregations already contain their own post filters
+        return search_query_key(search_query, agg_expr)
+
+    def _memoize_aggs(
+            self, search_query: SearchQuery, agg_cache: LRUCache
+    ) -> SearchQuery:
+        aggs = search_query.get_context().aggregations
+        new_aggs = {}
+        for agg_name, agg_expr in aggs.items():
+            if not self._is_attr_agg_name(agg_name):
+                new_aggs[agg_name] = agg_expr
+                continue
+            cache_key = self._get_agg_cache_key(search_query, agg_expr)
+            cached_agg = None
+            if not self.refresh_agg_cache:
+                cached_agg = agg_cache.get(cache_key)
+            if cached_agg is not None:
+                self._cached_aggs[agg_name] = cached_agg
+            else:
+                self._agg_cache_keys[agg_name] = cache_key
+                new_aggs[agg_name] = agg_expr
+        if not self._cached_aggs:
+            return search_query
+        return search_query.aggs(None).aggs(new_aggs)
+
+    def _share_agg_filters(self, search_query: SearchQuery) -> SearchQuery:
+        aggs = search_query.get_context().aggregations
+
+        groups: t.Dict[str, t.List[t.Tuple[str, agg.Filter]]] = {}
+        for agg_name, agg_expr in aggs.items():
+            if (
+                not isinstance(agg_expr, agg.Filter)
+                or agg_expr.params
+                or not self._is_attr_agg_name(agg_name)
+            ):
+                continue
+            groups.setdefault(expression_key(agg_expr.filter), []) \
+                .append((agg_name, agg_expr))
+
+        shared_groups = {}
+        for group in groups.values():
+            if len(group) < 2:
+                continue
+            sub_agg_names: t.Set[str] = set()
+            for _, agg_expr in group:
+                if sub_agg_names.intersection(agg_expr._aggregations):
+                    break
+                sub_agg_names.update(agg_expr._aggregations)
+            else:
+                shared_groups[group[0][0]] = group
+        if not shared_groups:
+            return search_query
+
+        shared_agg_names = {
+            agg_name
+            for group in shared_groups.values()
+            for agg_name, _ in group
+        }
+        new_aggs = {}
+        for agg_name, agg_expr in aggs.items():
+            shared_group = shared_groups.get(agg_name)
+            if shared_group is not None:
+                shared_agg_name = \
+                    f'{self._name}._shared.{len(self._shared_aggs)}'
+                shared_sub_aggs = {}
+                for _, member_agg in shared_group:
+                    shared_sub_aggs.update(member_agg._aggregations)
+                new_aggs[shared_agg_name] = agg.Filter(
+                    agg_expr.filter, aggs=shared_sub_aggs
+                )
+                self._shared_aggs[shared_agg_name] = shared_group
+            elif agg_name not in shared_agg_names:
+                new_aggs[agg_name] = agg_expr
+
+        return search_query.aggs(None).aggs(new_aggs)
+
+    def _split_shared_aggs(self, result: SearchResult) -> None:
+        for shared_agg_name, group in self._shared_aggs.items():
+            shared_agg = result.aggregations.pop(shared_agg_name, None)
+            if shared_agg is None:
+                continue
+            for agg_name, agg_expr in group:
+                result.aggregations[agg_name] = _FilterAggResultView(
+                    agg_expr,
+                    shared_agg.doc_count,
+                    {
+                        sub_agg_name: shared_agg.get_aggregation(sub_agg_name)
+                        for sub_agg_name in agg_expr._aggregations
+                    },
+                )
+
+    def _trim_response(self, search_query: SearchQuery) -> SearchQuery:
+        filter_path = _split_filter_path(
+            search_query.get_context().search_params.get('filter_path', [])
+        )
+        # including filters define the response of other consumers
+        if any(not p.startswith('-') for p in filter_path):
+            return search_query
+        exclusions = [
+            exclusion
+            for filt in self._filters
+            if _is_attr_facet_filter(filt)
+            for exclusion in filt._filter_path_exclusions()
+        ]
+        if not exclusions:
+            return search_query
+        return search_query.with_search_params(
+            filter_path=','.join(
+                filter_path
+                + [p for p in exclusions if p not in filter_path]
+            )
+        )
+
+    def apply(self, search_query: SearchQuery, params) -> SearchQuery:
+        self._shared_aggs = {}
+        self._cached_aggs = {}
+        self._agg_cache_keys = {}
+        search_query = super().apply(search_query, params)
+        # sizes of the aggregations must be final before caching them
+        if self._agg_budget is not None:
+            search_query = self._apply_agg_budget(
+                search_query, self._agg_budget
+            )
+        if self._agg_cache is not None:
+            search_query = self._memoize_aggs(search_query, self._agg_cache)
+        if self.share_agg_filters:
+            search_query = self._share_agg_filters(search_query)
+        if self.trim_response:
+            search_query = self._trim_response(search_query)
+        return search_query
+
+    def _is_buckets_agg_name(self, agg_name: str) -> bool:
+        for filt in self._filters:
+            if not isinstance(filt, BaseAttrFacetFilter):
+                continue
+            if (
+                agg_name == filt._agg_name
+                or agg_name.startswith(f'{filt._agg_name}:')
+            ):
+                return True
+        return False
+
+    # for transports that deliver a response body in chunks
+    def streaming_parser(self) -> StreamingResponseParser:
+        return StreamingResponseParser(self._is_buckets_agg_name)
+
+    def parse_search_result(
+            self,
+            chunks: t.Iterable[bytes],
+            search_query: SearchQuery,
+            compiler: t.Any,
+    ) -> SearchResult:
+        return parse_search_result(
+            chunks, search_query, compiler, self._is_buckets_agg_name
+        )
+
+    def _restore_cached_aggs(self, result: SearchResult) -> None:
+        if self._agg_cache is not None:
+            for agg_name, cache_key in self._agg_cache_keys.items():
+                agg_result = result.aggregations.get(agg_name)
+                if agg_result is not None:
+                    self._agg_cache.set(cache_key, agg_result)
+        result.aggregations.update(self._cached_aggs)
+
+    def process_result(self, result: SearchResult) -> QueryFilterResult:
+        self._split_shared_aggs(result)
+        self._restore_cached_aggs(result)
+        return super().process_result(result)
+
+    process_results = process_result
@@ -10,9 +10,14 @@ from elasticmagic.ext.queryfilter.queryfilter import BaseFilter
 from elasticmagic.ext.queryfilter.codec import FloatCodec
 from elasticmagic.ext.queryfilter.codec import IntCodec
 
+from .util import attr_key_range_bool
+from .util import attr_key_range_float
+from .util import attr_key_range_int
+from .util import attr_key_range_tagged
 from .util import merge_attr_value_bool
 from .util import merge_attr_value_float
 from .util import merge_attr_value_int
+from .util import merge_attr_value_tagged
 
 
 ParamValues = t.Dict[str, t.List[str]]
@@ -24,6 +29,14 @@ float_codec = FloatCodec()
 int_codec = IntCodec()
 
 
+def parse_bool(v: str) -> bool:
+    if v == 'true' or v == 'True':
+        return True
+    if v == 'false' or v == 'False':
+        return False
+    raise ValueError(f'Cannot parse boolean value: {v}')
+
+
 class BaseAttrSimpleFilter(ABC, BaseFilter, t.Generic[T]):
     def __init__(self, name: str, field: FieldOperators, alias: str = None):
         super().__init__(name, alias=alias)
@@ -47,7 +60,7 @@ class BaseAttrSimpleFilter(ABC, BaseFilter, t.Generic[T]):
         self, search_query: SearchQuery, params: Params
     ) -> SearchQuery:
         for attr_id, w in self._iter_attr_values(params):
-            expr = self._get_filter_expression(attr_id, w)
+            expr = self._get_attr_filter_expression(attr_id, w)
             if not expr:
                 continue
             search_query = self._apply_filter_expression(
@@ -55,6 +68,15 @@ class BaseAttrSimpleFilter(ABC, BaseFilter, t.Generic[T]):
             )
         return search_query
 
+    def _get_attr_filter_expression(
+            self, attr_id: int, values: ParamValues
+    ) -> t.Optional[Expression]:
+        expr = self._get_filter_expression(attr_id, values)
+        exists_expr = self._get_exists_expression(attr_id, values)
+        if exists_expr is not None:
+            expr = Bool.must(exists_expr, expr) if expr else exists_expr
+        return expr
+
     def _apply_filter_expression(
         self, search_query: SearchQuery, expr: Expression, attr_id: int
     ) -> SearchQuery:
@@ -65,6 +87,32 @@ class BaseAttrSimpleFilter(ABC, BaseFilter, t.Generic[T]):
     ) -> t.Optional[Expression]:
         raise NotImplementedError  # pragma: no cover
 
+    def _attr_key_range(self, attr_id: int) -> t.Tuple[int, int]:
+        raise NotImplementedError  # pragma: no cover
+
+    @staticmethod
+    def _parse_exists(values: ParamValues) -> t.Optional[bool]:
+        exists = None
+        for v in values.get('exists', []):
+            try:
+                exists = parse_bool(v)
+            except ValueError:
+                continue
+        return exists
+
+    def _get_exists_expression(
+            self, attr_id: int, values: ParamValues
+    ) -> t.Optional[Expression]:
+        exists = self._parse_exists(values)
+        if exists is None:
+            return None
+        # all the values of an attribute are inside its packed key range
+        min_key, max_key = self._attr_key_range(attr_id)
+        expr = Range(self.field, gte=min_key, lte=max_key)
+        if exists:
+            return expr
+        return Bool.must_not(expr)
+
     @staticmethod
     def _parse_value(v: str) -> T:
         raise NotImplementedError  # pragma: no cover
@@ -80,33 +128,155 @@ class BaseAttrSimpleFilter(ABC, BaseFilter, t.Generic[T]):
         return w
 
 
+def _split_contiguous_runs(
+        values: t.List[int], min_run_len: int
+) -> t.Tuple[t.List[t.Tuple[int, int]], t.List[int]]:
+    runs = []
+    run_values = set()
+    sorted_values = sorted(set(values))
+    start = 0
+    for ix in range(1, len(sorted_values) + 1):
+        if (
+            ix < len(sorted_values)
+            and sorted_values[ix] == sorted_values[ix - 1] + 1
+        ):
+            continue
+        if ix - start >= min_run_len:
+            runs.append((sorted_values[start], sorted_values[ix - 1]))
+            run_values.update(sorted_values[start:ix])
+        start = ix
+    if not runs:
+        return [], values
+    return runs, [v for v in dict.fromkeys(values) if v not in run_values]
+
+
+INT_MIN_VALUE = -(1 << 31)
+INT_MAX_VALUE = (1 << 31) - 1
+
+
 class AttrIntSimpleFilter(BaseAttrSimpleFilter[int]):
+    # contiguous values are queried with a single range clause
+    min_range_run_len = 3
+
     @staticmethod
     def _parse_value(v: str) -> int:
         return int_codec.decode(v, es_type=types.Integer)
 
+    def _attr_key_range(self, attr_id: int) -> t.Tuple[int, int]:
+        return attr_key_range_int(attr_id)
+
+    @staticmethod
+    def _merge_attr_value(attr_id: int, value: int) -> int:
+        return merge_attr_value_int(attr_id, value)
+
+    @classmethod
+    def _parse_range_values(cls, values: ParamValues, op: str) -> t.List[int]:
+        return cls._parse_values(values, op)
+
+    @classmethod
+    def _parse_range(
+            cls, values: ParamValues
+    ) -> t.Optional[t.Tuple[int, int]]:
+        gte_values = cls._parse_range_values(values, 'gte')
+        lte_values = cls._parse_range_values(values, 'lte')
+        if not gte_values and not lte_values:
+            return None
+        return (
+            gte_values[-1] if gte_values else INT_MIN_VALUE,
+            lte_values[-1] if lte_values else INT_MAX_VALUE,
+        )
+
+    def _get_range_clauses(
+            self, attr_id: int, gte: int, lte: int
+    ) -> t.List[Expression]:
+        if gte > lte:
+            # nothing can match
+            return [
+                Range(
+                    self.field,
+                    gte=self._merge_attr_value(attr_id, 1),
+                    lte=self._merge_attr_value(attr_id, 0),
+                )
+            ]
+        # negative values are packed after the positive ones
+        clauses = []
+        if gte < 0:
+            clauses.append(
+                Range(
+                    self.field,
+                    gte=self._merge_attr_value(attr_id, gte),
+                    lte=self._merge_attr_value(attr_id, min(lte, -1)),
+                )
+            )
+        if lte >= 0:
+            clauses.append(
+                Range(
+                    self.field,
+                    gte=self._merge_attr_value(attr_id, max(gte, 0)),
+                    lte=self._merge_attr_value(attr_id, lte),
+                )
+            )
+        return clauses
+
     def _get_filter_expression(
         self, attr_id: int, values
     ) -> t.Optional[Expression]:
         w = [
-            merge_attr_value_int(attr_id, v)
+            self._merge_attr_value(attr_id, v)
             for v in self._parse_values(values, 'exact')
         ]
-        if not w:
+        clauses: t.List[Expression] = []
+        value_range = self._parse_range(values)
+        if value_range is not None:
+            clauses.extend(self._get_range_clauses(attr_id, *value_range))
+        if not w and not clauses:
             return None
+        runs, w = _split_contiguous_runs(w, self.min_range_run_len)
+        clauses.extend(
+            Range(self.field, gte=from_, lte=to) for from_, to in runs
+        )
         if len(w) == 1:
-            return Term(self.field, w[0])
-        return Terms(self.field, w)
+            clauses.append(Term(self.field, w[0]))
+        elif w:
+            clauses.append(Terms(self.field, w))
+        if len(clauses) == 1:
+            return clauses[0]
+        return Bool.should(*clauses)
+
+
+# Int and bool attributes are stored in a single field with a type tag,
+# bool values are passed as true or false
+class AttrTaggedSimpleFilter(AttrIntSimpleFilter):
+    @staticmethod
+    def _parse_value(v: str) -> int:
+        try:
+            return parse_bool(v)
+        except ValueError:
+            return int_codec.decode(v, es_type=types.Integer)
+
+    @classmethod
+    def _parse_range_values(cls, values: ParamValues, op: str) -> t.List[int]:
+        # ranges are applied only to int values
+        return [
+            v for v in cls._parse_values(values, op)
+            if not isinstance(v, bool)
+        ]
+
+    def _attr_key_range(self, attr_id: int) -> t.Tuple[int, int]:
+        return attr_key_range_tagged(attr_id)
+
+    @staticmethod
+    def _merge_attr_value(attr_id: int, value: int) -> int:
+        return merge_attr_value_tagged(attr_id, value)
 
 
 class AttrBoolSimpleFilter(BaseAttrSimpleFilter[bool]):
     @staticmethod
     def _parse_value(v: str) -> bool:
-        if v == 'true' or v == 'True':
-            return True
-        if v == 'false' or v == 'False':
-            return False
-        raise ValueError(f'Cannot parse boolean value: {v}')
+        return parse_bool(v)
+
+    def _attr_key_range(self, attr_id: int) -> t.Tuple[int, int]:
+        return attr_key_range_bool(attr_id)
 
     def _get_filter_expression(
             self, attr_id: int, values: ParamValues
@@ -143,6 +313,9 @@ class AttrRangeSimpleFilter(BaseAttrSimpleFilter[float]):
     def _parse_value(v: str) -> float:
         return float_codec.decode(v)
 
+    def _attr_key_range(self, attr_id: int) -> t.Tuple[int, int]:
+        return attr_key_range_float(attr_id)
+
     @classmethod
     def _parse_last_value(
             cls, values: ParamValues, op: str
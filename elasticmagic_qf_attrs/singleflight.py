@@ -0,0 +1,135 @@
+import asyncio
+import json
+import threading
+import typing as t
+
+from elasticmagic import Bool
+from elasticmagic.ext.queryfilter import QueryFilter
+from elasticmagic.ext.queryfilter.queryfilter import QueryFilterResult
+
+from .cache import expression_key
+
+
+R = t.TypeVar('R')
+
+
+# Identifies a search request by everything that influences aggregations:
+# post filters are applied by the filter aggregations themselves
+def agg_fingerprint(search_query: t.Any) -> str:
+    ctx = search_query.get_context()
+    aggs = ctx.aggregations
+    agg_names = sorted(aggs)
+    return json.dumps(
+        [
+            ctx.index.get_name() if ctx.index is not None else None,
+            dict(ctx.search_params.items()),
+            agg_names,
+            expression_key(
+                ctx.q,
+                Bool.must(*ctx.filters),
+                *(aggs[agg_name] for agg_name in agg_names)
+            ),
+        ],
+        sort_keys=True,
+        default=str,
+    )
+
+
+async def _await(awaitable: t.Awaitable[R]) -> R:
+    return await awaitable
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: t.Any = None
+        self.error: t.Optional[BaseException] = None
+
+
+# Concurrent calls with the same key wait for the first one and share
+# its result
+class SingleFlight:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: t.Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: t.Callable[[], R]) -> R:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if call is None:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+def _retrieve_exception(task: asyncio.Future) -> None:
+    # prevents warnings when all the callers were cancelled
+    if not task.cancelled():
+        task.exception()
+
+
+class AsyncSingleFlight:
+    def __init__(self) -> None:
+        self._futures: t.Dict[str, asyncio.Future] = {}
+
+    def _forget(self, key: str, task: asyncio.Future) -> None:
+        if self._futures.get(key) is task:
+            del self._futures[key]
+
+    async def do(self, key: str, fn: t.Callable[[], t.Awaitable[R]]) -> R:
+        task = self._futures.get(key)
+        if task is None:
+            # the shared call runs in its own task, so cancelling any of
+            # the callers, including the first one, does not cancel it
+            task = asyncio.get_running_loop().create_task(
+                _await(fn())
+            )
+            self._futures[key] = task
+            task.add_done_callback(_retrieve_exception)
+            task.add_done_callback(lambda _: self._forget(key, task))
+        return await asyncio.shield(task)
+
+
+# Only aggregations are requested, so search hits should be fetched
+# separately. Every caller must have its own query filter instance.
+def search_facets(
+        qf: QueryFilter,
+        search_query: t.Any,
+        params: t.Any,
+        single_flight: SingleFlight,
+) -> QueryFilterResult:
+    search_query = qf.apply(search_query, params).limit(0)
+    return single_flight.do(
+        agg_fingerprint(search_query),
+        lambda: qf.process_result(search_query.get_result()),
+    )
+
+
+async def search_facets_async(
+        qf: QueryFilter,
+        search_query: t.Any,
+        params: t.Any,
+        single_flight: AsyncSingleFlight,
+) -> QueryFilterResult:
+    search_query = qf.apply(search_query, params).limit(0)
+
+    async def _search() -> QueryFilterResult:
+        return qf.process_result(await search_query.get_result())
+
+    return await single_flight.do(agg_fingerprint(search_query), _search)
@@ -0,0 +1,256 @@
+from array import array
+import codecs
+import json
+import re
+import typing as t
+
+from elasticmagic import SearchQuery
+from elasticmagic.result import SearchResult
+
+
+_TOKEN_RE = re.compile(
+    r'''
+    [ \t\n\r]*
+    (?:
+        (?P<punct>[{}\[\],:])
+        | "(?P<str>(?:[^"\\]|\\.)*)"
+        | (?P<num>-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?)
+        | (?P<lit>true|false|null)
+    )
+    ''',
+    re.VERBOSE
+)
+
+# Terms buckets are matched with a single regex in a common case
+_BUCKET_PATTERN = (
+    r'[ \t\n\r]*\{[ \t\n\r]*'
+    r'"key"[ \t\n\r]*:[ \t\n\r]*(-?[0-9]+)[ \t\n\r]*,[ \t\n\r]*'
+    r'"doc_count"[ \t\n\r]*:[ \t\n\r]*([0-9]+)[ \t\n\r]*\}'
+)
+_FIRST_BUCKET_RE = re.compile(_BUCKET_PATTERN)
+_NEXT_BUCKET_RE = re.compile(r'[ \t\n\r]*,' + _BUCKET_PATTERN)
+
+_LITERALS = {'true': True, 'false': False, 'null': None}
+
+_VALUE_DELIMITERS = frozenset(' \t\n\r,]}')
+
+BucketsAggPredicate = t.Callable[[str], bool]
+
+
+class ColumnarBuckets:
+    def __init__(self) -> None:
+        self.keys: t.MutableSequence[t.Any] = array('q')
+        self.counts: t.MutableSequence[int] = array('q')
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def __iter__(self) -> t.Iterator[t.Dict[str, t.Any]]:
+        for key, doc_count in zip(self.keys, self.counts):
+            yield {'key': key, 'doc_count': doc_count}
+
+    def append_bucket(self, key: t.Any, doc_count: int) -> None:
+        try:
+            self.keys.append(key)
+        except (TypeError, OverflowError):
+            # not an integer key, fallback to a list
+            self.keys = list(self.keys)
+            self.keys.append(key)
+        self.counts.append(doc_count)
+
+
+# Tokens expected by a container
+_EXPECT_KEY = 0
+_EXPECT_COLON = 1
+_EXPECT_VALUE = 2
+_EXPECT_COMMA = 3
+
+
+class _Frame:
+    __slots__ = ('container', 'name', 'key', 'is_dict', 'expect', 'empty')
+
+    def __init__(self, container: t.Any, name: t.Optional[str]):
+        self.container = container
+        self.name = name
+        self.key: t.Optional[str] = None
+        self.is_dict = isinstance(container, dict)
+        self.expect = _EXPECT_KEY if self.is_dict else _EXPECT_VALUE
+        self.empty = True
+
+
+# Incrementally decodes a search response. Buckets of the terms aggregations
+# recognized by the predicate are stored into compact columnar arrays instead
+# of a list of dictionaries.
+class StreamingResponseParser:
+    def __init__(self, is_buckets_agg: BucketsAggPredicate):
+        self._is_buckets_agg = is_buckets_agg
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        # parsed part of the buffer is dropped only when a new chunk comes
+        self._pos = 0
+        self._stack: t.List[_Frame] = []
+        self._result: t.Any = None
+        self._done = False
+
+    def _append(self, text: str) -> None:
+        # usually only an incomplete token is left so the chunk is not
+        # copied together with the whole response
+        if self._pos == len(self._buf):
+            self._buf = text
+        else:
+            self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+
+    def feed(self, chunk: bytes) -> None:
+        self._append(self._decoder.decode(chunk))
+        self._parse(final=False)
+
+    def close(self) -> t.Any:
+        self._append(self._decoder.decode(b'', final=True))
+        self._parse(final=True)
+        if self._buf[self._pos:].strip() or self._stack or not self._done:
+            raise ValueError('Incomplete JSON response')
+        return self._result
+
+    def _parse(self, final: bool) -> None:
+        buf = self._buf
+        buf_len = len(buf)
+        pos = self._pos
+        match = _TOKEN_RE.match
+        match_next_bucket = _NEXT_BUCKET_RE.match
+        while pos < buf_len:
+            if self._stack:
+                frame = self._stack[-1]
+                buckets = frame.container
+                if isinstance(buckets, ColumnarBuckets):
+                    if frame.expect == _EXPECT_VALUE:
+                        m = _FIRST_BUCKET_RE.match(buf, pos)
+                    else:
+                        m = match_next_bucket(buf, pos)
+                    while m is not None:
+                        buckets.append_bucket(int(m.group(1)), int(m.group(2)))
+                        frame.expect = _EXPECT_COMMA
+                        frame.empty = False
+                        pos = m.end()
+                        m = match_next_bucket(buf, pos)
+            m = match(buf, pos)
+            if m is None:
+                break
+            punct = m.group('punct')
+            if punct is None and m.group('str') is None and not final:
+                # a number or a literal can continue in the next chunk
+                end = m.end()
+                if end == buf_len or buf[end] not in _VALUE_DELIMITERS:
+                    break
+            pos = m.end()
+            if punct is not None:
+                self._on_punct(punct)
+                continue
+            s = m.group('str')
+            if s is not None:
+                if '\\' in s:
+                    s = json.loads(f'"{s}"')
+                top = self._stack[-1] if self._stack else None
+                if top is not None and top.expect == _EXPECT_KEY:
+                    top.key = s
+                    top.expect = _EXPECT_COLON
+                else:
+                    self._on_value(s)
+                continue
+            num = m.group('num')
+            if num is not None:
+                if '.' in num or 'e' in num or 'E' in num:
+                    self._on_value(float(num))
+                else:
+                    self._on_value(int(num))
+                continue
+            self._on_value(_LITERALS[m.group('lit')])
+        self._pos = pos
+
+    def _current_name(self) -> t.Optional[str]:
+        if not self._stack:
+            return None
+        return self._stack[-1].key
+
+    def _check_value_expected(self) -> None:
+        if not self._stack:
+            if self._done:
+                raise ValueError('Extra data after JSON response')
+        elif self._stack[-1].expect != _EXPECT_VALUE:
+            raise ValueError('Unexpected value')
+
+    def _on_punct(self, punct: str) -> None:
+        if punct == '{':
+            self._check_value_expected()
+            self._stack.append(_Frame({}, self._current_name()))
+        elif punct == '[':
+            self._check_value_expected()
+            container: t.Any = []
+            if self._stack:
+                parent = self._stack[-1]
+                if (
+                    parent.key == 'buckets'
+                    and parent.name is not None
+                    and self._is_buckets_agg(parent.name)
+                ):
+                    container = ColumnarBuckets()
+            self._stack.append(_Frame(container, self._current_name()))
+        elif punct == '}' or punct == ']':
+            if not self._stack:
+                raise ValueError(f'Unexpected {punct!r}')
+            frame = self._stack[-1]
+            can_close = frame.expect == _EXPECT_COMMA or (
+                frame.empty
+                and frame.expect == (
+                    _EXPECT_KEY if frame.is_dict else _EXPECT_VALUE
+                )
+            )
+            if frame.is_dict != (punct == '}') or not can_close:
+                raise ValueError(f'Unexpected {punct!r}')
+            self._stack.pop()
+            self._on_value(frame.container)
+        elif punct == ',':
+            if not self._stack or self._stack[-1].expect != _EXPECT_COMMA:
+                raise ValueError("Unexpected ','")
+            frame = self._stack[-1]
+            frame.expect = _EXPECT_KEY if frame.is_dict else _EXPECT_VALUE
+        elif punct == ':':
+            if not self._stack or self._stack[-1].expect != _EXPECT_COLON:
+                raise ValueError("Unexpected ':'")
+            self._stack[-1].expect = _EXPECT_VALUE
+
+    def _on_value(self, value: t.Any) -> None:
+        self._check_value_expected()
+        if not self._stack:
+            self._result = value
+            self._done = True
+            return
+        frame = self._stack[-1]
+        frame.expect = _EXPECT_COMMA
+        frame.empty = False
+        container = frame.container
+        if isinstance(container, dict):
+            container[frame.key] = value
+        elif isinstance(container, ColumnarBuckets):
+            container.append_bucket(value.get('key'), value['doc_count'])
+        else:
+            container.append(value)
+
+
+def parse_response(
+        chunks: t.Iterable[bytes], is_buckets_agg: BucketsAggPredicate
+) -> t.Any:
+    parser = StreamingResponseParser(is_buckets_agg)
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+
+def parse_search_result(
+        chunks: t.Iterable[bytes],
+        search_query: SearchQuery,
+        compiler: t.Any,
+        is_buckets_agg: BucketsAggPredicate,
+) -> SearchResult:
+    raw_result = parse_response(chunks, is_buckets_agg)
+    return compiler.compiled_query(search_query).process_result(raw_result)
@@ -10,6 +10,10 @@ def split_attr_value_int(merged_attr: int) -> typing.Tuple[int, int]:
     return merged_attr >> 32, merged_attr & 0xffff_ffff
 
 
+def attr_key_range_int(attr_id: int) -> typing.Tuple[int, int]:
+    return attr_id << 32, (attr_id << 32) | 0xffff_ffff
+
+
 def merge_attr_value_bool(attr_id: int, value: bool) -> int:
     return (attr_id << 1) | value
 
@@ -18,5 +22,41 @@ def split_attr_value_bool(merged_attr: int) -> typing.Tuple[int, bool]:
     return merged_attr >> 1, bool(merged_attr & 1)
 
 
+def attr_key_range_bool(attr_id: int) -> typing.Tuple[int, int]:
+    return attr_id << 1, (attr_id << 1) | 1
+
+
 def merge_attr_value_float(attr_id: int, value: float) -> int:
     return (attr_id << 32) | struct.unpack('=I', struct.pack('=f', value))[0]
+
+
+def attr_key_range_float(attr_id: int) -> typing.Tuple[int, int]:
+    return attr_id << 32, (attr_id << 32) | 0xffff_ffff
+
+
+# Int and bool attributes can share a single field. A type tag is stored
+# between an attribute id and a value, so all the values of an attribute
+# still form a contiguous key range
+ATTR_TYPE_TAG_INT = 0
+ATTR_TYPE_TAG_BOOL = 1
+
+
+def merge_attr_value_tagged(
+        attr_id: int, value: typing.Union[int, bool]
+) -> int:
+    if isinstance(value, bool):
+        return (attr_id << 33) | (ATTR_TYPE_TAG_BOOL << 32) | value
+    return (attr_id << 33) | (value & 0xffff_ffff)
+
+
+def split_attr_value_tagged(
+        merged_attr: int
+) -> typing.Tuple[int, typing.Union[int, bool]]:
+    value = merged_attr & 0xffff_ffff
+    if (merged_attr >> 32) & 1 == ATTR_TYPE_TAG_BOOL:
+        return merged_attr >> 33, bool(value)
+    return merged_attr >> 33, value
+
+
+def attr_key_range_tagged(attr_id: int) -> typing.Tuple[int, int]:
+    return attr_id << 33, (attr_id << 33) | 0x1_ffff_ffff
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import typing as t
+
+from elasticmagic.ext.queryfilter.queryfilter import QueryFilterResult
+
+from .queryfilter import AttrQueryFilter
+
+
+logger = logging.getLogger(__name__)
+
+WarmUpResult = t.Union[QueryFilterResult, BaseException]
+ErrorHandler = t.Callable[[t.Any, BaseException], None]
+
+
+# Executes a query filter for a list of base queries, for example category
+# listings, to populate the aggregations cache before users come. Every
+# query gets its own query filter instance because query filters keep
+# the state between applying and processing a result.
+class FacetCacheWarmer:
+    def __init__(
+            self,
+            qf_factory: t.Callable[[], AttrQueryFilter],
+            search_queries: t.Iterable[t.Any],
+            params: t.Any = None,
+            concurrency: int = 4,
+            on_error: t.Optional[ErrorHandler] = None,
+    ):
+        if concurrency < 1:
+            raise ValueError('concurrency must be positive')
+        if qf_factory()._agg_cache is None:
+            raise ValueError('query filter must have an aggregations cache')
+        self._qf_factory = qf_factory
+        self._search_queries = list(search_queries)
+        self._params = params if params is not None else {}
+        self._concurrency = concurrency
+        self._on_error = on_error
+
+    def _handle_error(self, search_query: t.Any, error: BaseException) -> None:
+        if self._on_error is not None:
+            self._on_error(search_query, error)
+        else:
+            logger.error('Failed to warm up facets cache', exc_info=error)
+
+    async def _warm_up_query(
+            self, semaphore: asyncio.Semaphore, search_query: t.Any
+    ) -> QueryFilterResult:
+        async with semaphore:
+            qf = self._qf_factory()
+            # cached entries must be refreshed before they expire
+            qf.refresh_agg_cache = True
+            search_query = qf.apply(search_query, self._params)
+            return qf.process_result(await search_query.get_result())
+
+    async def warm_up(self) -> t.List[WarmUpResult]:
+        semaphore = asyncio.Semaphore(self._concurrency)
+        return await asyncio.gather(
+            *(
+                self._warm_up_query(semaphore, sq)
+                for sq in self._search_queries
+            ),
+            return_exceptions=True,
+        )
+
+    # Interval should be less than the cache ttl. Errors are passed to
+    # the on_error callback or logged.
+    async def run(self, interval: float) -> None:
+        while True:
+            results = await self.warm_up()
+            for search_query, result in zip(self._search_queries, results):
+                if isinstance(result, BaseException):
+                    self._handle_error(search_query, result)
+            await asyncio.sleep(interval)
@@ -1,5 +1,11 @@
+import asyncio
+
+from elasticmagic import agg
+from elasticmagic import Script
 from elasticmagic.compiler import Compiler_6_0
 
+from elasticmagic_qf_attrs.facet import ATTR_VALUES_SCRIPT
+
 import pytest
 
 
@@ -10,6 +16,61 @@ def assert_search_query(sq, expected, compiler):
     assert sq.to_dict(compiler) == expected.to_dict(compiler)
 
 
+def attr_values_agg(field, min_key, max_key, size=100):
+    return agg.Terms(
+        script=Script(
+            ATTR_VALUES_SCRIPT,
+            lang='painless',
+            params={
+                'field': field,
+                'key_ranges': [min_key, max_key],
+            }
+        ),
+        value_type='long',
+        size=size,
+    )
+
+
+class Timer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeIndex:
+    def __init__(self, raw_result, delay=0, name='test'):
+        self.raw_result = raw_result
+        self.delay = delay
+        self.name = name
+        self.search_queries = []
+        self.active_searches = 0
+        self.max_active_searches = 0
+
+    def get_name(self):
+        return self.name
+
+    async def get_compiler(self):
+        return Compiler_6_0
+
+    async def search(self, search_query):
+        self.search_queries.append(search_query)
+        self.active_searches += 1
+        self.max_active_searches = max(
+            self.max_active_searches, self.active_searches
+        )
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active_searches -= 1
+        raw_result = self.raw_result
+        if isinstance(raw_result, Exception):
+            raise raw_result
+        return Compiler_6_0.compiled_query(search_query) \
+            .process_result(raw_result)
+
+
 @pytest.fixture
 def compiler():
     return Compiler_6_0
@@ -0,0 +1,176 @@
+from elasticmagic import agg
+from elasticmagic import Field, Term
+from elasticmagic import SearchQuery
+from elasticmagic.ext.queryfilter import FacetFilter
+from elasticmagic.result import SearchResult
+
+from elasticmagic_qf_attrs import AttrQueryFilter
+from elasticmagic_qf_attrs.budget import AggBudget
+from elasticmagic_qf_attrs.budget import count_agg_buckets
+from elasticmagic_qf_attrs.facet import AttrIntFacetFilter
+from elasticmagic_qf_attrs.facet import AttrRangeFacetFilter
+
+
+def test_count_agg_buckets():
+    assert count_agg_buckets(agg.Terms(Field('a'), size=100)) == 100
+    assert count_agg_buckets(agg.Terms(Field('a'))) == 10
+    assert count_agg_buckets(agg.Max(Field('a'))) == 0
+    assert count_agg_buckets(
+        agg.Filter(
+            Term('a', 1),
+            aggs={
+                'terms': agg.Terms(
+                    Field('a'), size=5,
+                    aggs={'max': agg.Max(Field('b'))},
+                ),
+                'range': agg.Range(
+                    Field('b'), ranges=[{'to': 1}, {'from': 1}]
+                ),
+            }
+        )
+    ) == 8
+    assert count_agg_buckets(
+        agg.Terms(
+            Field('a'), size=5,
+            aggs={'terms': agg.Terms(Field('b'), size=2)},
+        )
+    ) == 15
+
+
+def test_agg_budget():
+    def terms_agg(size):
+        return agg.Filter(
+            Term('a', 1), aggs={'terms': agg.Terms(Field('a'), size=size)}
+        )
+
+    aggs = [
+        ('selected:1', terms_agg(100), 'attr', 1),
+        ('main', terms_agg(1000), 'attr', None),
+        ('other:2', terms_agg(100), 'other_attr', 2),
+        ('other', terms_agg(1000), 'other_attr', None),
+    ]
+
+    assert AggBudget().allocate(aggs) == {
+        agg_name: agg_expr for agg_name, agg_expr, _, _ in aggs
+    }
+
+    allocated_aggs = AggBudget(max_aggs=3).allocate(aggs)
+    assert list(allocated_aggs) == ['selected:1', 'main', 'other']
+
+    allocated_aggs = AggBudget(
+        max_aggs=3, priorities={'other_attr': 1}
+    ).allocate(aggs)
+    assert list(allocated_aggs) == ['main', 'other:2', 'other']
+
+    # main aggregations are more important than per attribute ones
+    allocated_aggs = AggBudget(max_buckets=1500).allocate(aggs)
+    assert list(allocated_aggs) == ['main', 'other']
+    assert allocated_aggs['main'] is aggs[1][1]
+    assert count_agg_buckets(allocated_aggs['other']) == 499
+    assert allocated_aggs['other']._aggregations['terms'] \
+        .params['size'] == 498
+    # original aggregation is not changed
+    assert aggs[3][1]._aggregations['terms'].params['size'] == 1000
+
+
+def test_attr_query_filter__agg_budget(compiler):
+    qf = AttrQueryFilter(agg_budget=AggBudget(max_buckets=5000))
+    qf.add_filter(FacetFilter('brand', Field('brand')))
+    qf.add_filter(
+        AttrIntFacetFilter('attr_int', Field('attr.int'), alias='a')
+    )
+    sq = qf.apply(SearchQuery(), {'a18': '1', 'a19': '2'})
+    aggs = sq.get_context().aggregations
+    assert list(aggs) == ['qf.brand.filter', 'qf.attr_int.filter']
+    assert sq.to_dict(compiler)['aggregations']['qf.attr_int.filter'][
+        'aggregations'
+    ]['qf.attr_int'] == {'terms': {'field': 'attr.int', 'size': 4999}}
+
+    qf_res = qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.brand.filter': {
+                    'doc_count': 1,
+                    'qf.brand': {'buckets': [{'key': 1, 'doc_count': 1}]},
+                },
+                'qf.attr_int.filter': {
+                    'doc_count': 1,
+                    'qf.attr_int': {
+                        'buckets': [
+                            {'key': 0x12_00000001, 'doc_count': 1},
+                            {'key': 0x13_00000002, 'doc_count': 1},
+                            {'key': 0x14_00000003, 'doc_count': 1},
+                        ]
+                    },
+                },
+            }
+        },
+        aggregations=aggs
+    ))
+    # buckets of the selected attributes are narrowed by their own filters
+    assert list(qf_res.attr_int.facets) == [20]
+    assert qf_res.attr_int.get_facet(20).all_values[0].count == 1
+
+
+def test_attr_query_filter__agg_budget_dropped_selected_attr():
+    qf = AttrQueryFilter(agg_budget=AggBudget(max_aggs=1))
+    qf.add_filter(
+        AttrIntFacetFilter('attr_int', Field('attr.int'), alias='a')
+    )
+    sq = qf.apply(SearchQuery(), {'a5': '1'})
+    aggs = sq.get_context().aggregations
+    assert list(aggs) == ['qf.attr_int.filter']
+
+    qf_res = qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_int.filter': {
+                    'doc_count': 3,
+                    'qf.attr_int': {
+                        'buckets': [
+                            {'key': 0x5_00000001, 'doc_count': 3},
+                            {'key': 0x6_00000001, 'doc_count': 2},
+                        ]
+                    },
+                },
+            }
+        },
+        aggregations=aggs
+    ))
+    assert list(qf_res.attr_int.facets) == [6]
+    assert qf_res.attr_int.get_facet(5) is None
+
+
+def test_attr_query_filter__agg_budget_range(compiler):
+    qf = AttrQueryFilter(agg_budget=AggBudget(max_aggs=1))
+    qf.add_filter(
+        AttrRangeFacetFilter(
+            'attr_range', Field('attr.float'), alias='a',
+            compute_min_max=True,
+        )
+    )
+    sq = qf.apply(SearchQuery(), {'a8__gte': '1'})
+    aggs = sq.get_context().aggregations
+    assert list(aggs) == ['qf.attr_range.filter']
+
+    qf_res = qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_range.filter': {
+                    'doc_count': 3,
+                    'qf.attr_range': {
+                        'buckets': [
+                            {'key': '8', 'doc_count': 2},
+                            {'key': '9', 'doc_count': 3},
+                        ]
+                    },
+                },
+            }
+        },
+        aggregations=aggs
+    ))
+    assert list(qf_res.attr_range.facets) == [9]
+    assert qf_res.attr_range.get_facet(9).count == 3
+
+    qf_res = qf.process_result(SearchResult({}, aggregations=aggs))
+    assert list(qf_res.attr_range.facets) == []
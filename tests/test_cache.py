@@ -0,0 +1,32 @@
+from elasticmagic_qf_attrs.cache import LRUCache
+
+from .conftest import Timer
+
+
+def test_lru_cache__eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+    cache.delete('a')
+    assert cache.get('a') is None
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lru_cache__ttl():
+    timer = Timer()
+    cache = LRUCache(ttl=10, timer=timer)
+    cache.set('a', 1)
+    timer.now = 9.9
+    assert cache.get('a') == 1
+    timer.now = 10.0
+    assert cache.get('a') is None
+    assert cache.get('a', 0) == 0
+    assert len(cache) == 0
@@ -9,6 +9,8 @@ from elasticmagic_qf_attrs.simple import AttrRangeSimpleFilter
 
 import pytest
 
+from .conftest import attr_values_agg
+
 
 @pytest.fixture
 def qf():
@@ -72,18 +74,24 @@ def test_combined_facet_filters(qf, compiler):
                 Bool.must(
                     Term('attr.bool', 0b11),
                     Term('attr.int', 0x144_0000dead),
+                    Range('attr.int', gte=0x12_00000000, lte=0x12_ffffffff),
                 ),
                 aggs={
-                    'qf.attr_int:18': agg.Terms(Field('attr.int'), size=100),
+                    'qf.attr_int:18': attr_values_agg(
+                        'attr.int', 0x12_00000000, 0x12_ffffffff
+                    ),
                 }
             ),
             'qf.attr_int.filter:324': agg.Filter(
                 Bool.must(
                     Term('attr.bool', 0b11),
                     Term('attr.int', 0x12_0000e2e4),
+                    Range('attr.int', gte=0x144_00000000, lte=0x144_ffffffff),
                 ),
                 aggs={
-                    'qf.attr_int:324': agg.Terms(Field('attr.int'), size=100),
+                    'qf.attr_int:324': attr_values_agg(
+                        'attr.int', 0x144_00000000, 0x144_ffffffff
+                    ),
                 }
             )
         })
@@ -1,22 +1,28 @@
 from elasticmagic import agg
-from elasticmagic import Bool, Field, Range, Script, Term, Terms
+from elasticmagic import Bool, Field, MatchAll, Range, Script, Term, Terms
 from elasticmagic import SearchQuery
 from elasticmagic.ext.queryfilter import QueryFilter
 from elasticmagic.result import SearchResult
 
+from elasticmagic_qf_attrs.cache import LRUCache
 from elasticmagic_qf_attrs.facet import (
     AttrBoolFacetFilter,
     RANGE_ATTR_MINMAX_COMBINE_SCRIPT,
 )
 from elasticmagic_qf_attrs.facet import AttrRangeFacetFilter
 from elasticmagic_qf_attrs.facet import AttrIntFacetFilter
+from elasticmagic_qf_attrs.facet import AttrTaggedFacetFilter
+from elasticmagic_qf_attrs.facet import DiversifiedSampler
 from elasticmagic_qf_attrs.facet import RANGE_ATTR_SCRIPT
+from elasticmagic_qf_attrs.facet import RawTermsAggResult
 from elasticmagic_qf_attrs.facet import RANGE_ATTR_MINMAX_MAP_SCRIPT
 from elasticmagic_qf_attrs.facet import RANGE_ATTR_MINMAX_REDUCE_SCRIPT
 
 import pytest
 
 from .conftest import assert_search_query
+from .conftest import FakeIndex
+from .conftest import attr_values_agg
 
 
 @pytest.fixture
@@ -182,7 +188,14 @@ def test_attr_int_facet_filter__single_selected_value(int_qf, compiler):
                     'qf.attr_int': agg.Terms(Field('attr.int'), size=10_000),
                 }
             ),
-            'qf.attr_int:18': agg.Terms(Field('attr.int'), size=100),
+            'qf.attr_int.filter:18': agg.Filter(
+                Range('attr.int', gte=0x12_00000000, lte=0x12_ffffffff),
+                aggs={
+                    'qf.attr_int:18': attr_values_agg(
+                        'attr.int', 0x12_00000000, 0x12_ffffffff
+                    ),
+                }
+            ),
         })
         .post_filter(Term('attr.int', 0x12_0000e2e4))
         .to_dict(compiler=compiler)
@@ -209,17 +222,20 @@ def test_attr_int_facet_filter__single_selected_value(int_qf, compiler):
                         ]
                     }
                 },
-                'qf.attr_int:18': {
-                    'buckets': [
-                        {
-                            'key': 0x12_0000e2e4,
-                            'doc_count': 99
-                        },
-                        {
-                            'key': 0x12_0000e7e5,
-                            'doc_count': 88
-                        },
-                    ]
+                'qf.attr_int.filter:18': {
+                    'doc_count': 187,
+                    'qf.attr_int:18': {
+                        'buckets': [
+                            {
+                                'key': 0x12_0000e2e4,
+                                'doc_count': 99
+                            },
+                            {
+                                'key': 0x12_0000e7e5,
+                                'doc_count': 88
+                            },
+                        ]
+                    }
                 }
             }
         },
@@ -258,6 +274,74 @@ def test_attr_int_facet_filter__single_selected_value(int_qf, compiler):
     assert facet.all_values[1].selected is False
 
 
+def test_attr_int_facet_filter__selected_range(int_qf, compiler):
+    params = {'a18__gte': '2010', 'a18__lte': '2020'}
+    sq = int_qf.apply(SearchQuery(), params)
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .aggs({
+            'qf.attr_int.filter': agg.Filter(
+                Range('attr.int', gte=0x12_000007da, lte=0x12_000007e4),
+                aggs={
+                    'qf.attr_int': agg.Terms(Field('attr.int'), size=10_000),
+                }
+            ),
+            'qf.attr_int.filter:18': agg.Filter(
+                Range('attr.int', gte=0x12_00000000, lte=0x12_ffffffff),
+                aggs={
+                    'qf.attr_int:18': attr_values_agg(
+                        'attr.int', 0x12_00000000, 0x12_ffffffff
+                    ),
+                }
+            ),
+        })
+        .post_filter(
+            Range('attr.int', gte=0x12_000007da, lte=0x12_000007e4)
+        )
+        .to_dict(compiler=compiler)
+    )
+    qf_res = int_qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_int.filter': {
+                    'doc_count': 20,
+                    'qf.attr_int': {
+                        'buckets': [
+                            {
+                                'key': 0x12_000007dc,
+                                'doc_count': 20
+                            },
+                        ]
+                    }
+                },
+                'qf.attr_int.filter:18': {
+                    'doc_count': 30,
+                    'qf.attr_int:18': {
+                        'buckets': [
+                            {
+                                'key': 0x12_000007dc,
+                                'doc_count': 20
+                            },
+                            {
+                                'key': 0x12_000007cf,
+                                'doc_count': 10
+                            },
+                        ]
+                    }
+                }
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    facet = qf_res.attr_int.get_facet(18)
+    assert len(facet.all_values) == 2
+    assert len(facet.selected_values) == 1
+    assert facet.selected_values[0].value == 2012
+    assert facet.selected_values[0].count_text == '20'
+    assert facet.values[0].value == 1999
+    assert facet.values[0].count_text == '+10'
+
+
 def test_attr_int_facet_filter__multiple_selected_values(int_qf, compiler):
     sq = int_qf.apply(
         SearchQuery(),
@@ -276,15 +360,25 @@ def test_attr_int_facet_filter__multiple_selected_values(int_qf, compiler):
                 }
             ),
             'qf.attr_int.filter:18': agg.Filter(
-                Terms('attr.int', [0x144_0000dead, 0x144_0000beef]),
+                Bool.must(
+                    Terms('attr.int', [0x144_0000dead, 0x144_0000beef]),
+                    Range('attr.int', gte=0x12_00000000, lte=0x12_ffffffff),
+                ),
                 aggs={
-                    'qf.attr_int:18': agg.Terms(Field('attr.int'), size=100),
+                    'qf.attr_int:18': attr_values_agg(
+                        'attr.int', 0x12_00000000, 0x12_ffffffff
+                    ),
                 }
             ),
             'qf.attr_int.filter:324': agg.Filter(
-                Term('attr.int', 0x12_0000e2e4),
+                Bool.must(
+                    Term('attr.int', 0x12_0000e2e4),
+                    Range('attr.int', gte=0x144_00000000, lte=0x144_ffffffff),
+                ),
                 aggs={
-                    'qf.attr_int:324': agg.Terms(Field('attr.int'), size=100),
+                    'qf.attr_int:324': attr_values_agg(
+                        'attr.int', 0x144_00000000, 0x144_ffffffff
+                    ),
                 }
             )
         })
@@ -959,14 +1053,9 @@ def test_attr_range_facet_filter__compute_min_max(
                 },
                 'qf.attr_range.min_max': {
                     'value': {
-                        '8': [
-                            10.20,
-                            400.50,
-                        ],
-                        '439': [
-                            5.15,
-                            300.25,
-                        ],
+                        'attr_ids': [439, 8],
+                        'min': [5.15, 10.20],
+                        'max': [300.25, 400.50],
                     },
                 }
             }
@@ -987,3 +1076,987 @@ def test_attr_range_facet_filter__compute_min_max(
     assert f.selected is False
     assert f.min == 5.15
     assert f.max == 300.25
+
+
+def test_attr_int_facet_filter__facet_attrs(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrIntFacetFilter(
+            'attr_int', Field('attr.int'), alias='a',
+            attrs_getter=lambda params: [18] if 'cat' in params else None,
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {})
+    assert_search_query(
+        sq,
+        SearchQuery().aggs({
+            'qf.attr_int': agg.Terms(Field('attr.int'), size=10_000)
+        }),
+        compiler
+    )
+
+    # other attributes are dropped on the shards
+    sq = qf.apply(SearchQuery(), {'cat': '1'})
+    assert_search_query(
+        sq,
+        SearchQuery().aggs({
+            'qf.attr_int': attr_values_agg(
+                'attr.int', 0x12_00000000, 0x12_ffffffff, size=10_000
+            )
+        }),
+        compiler
+    )
+    qf_res = qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_int': {
+                    'buckets': [
+                        {
+                            'key': 0x12_00000001,
+                            'doc_count': 123,
+                        },
+                        {
+                            'key': 0x144_0000dead,
+                            'doc_count': 99
+                        },
+                    ]
+                }
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    assert list(qf_res.attr_int.facets) == [18]
+    facet = qf_res.attr_int.get_facet(18)
+    assert len(facet.all_values) == 1
+    assert facet.all_values[0].value == 1
+    assert facet.all_values[0].count == 123
+    assert qf_res.attr_int.get_facet(324) is None
+
+
+def test_attr_int_facet_filter__no_facet_attrs(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrIntFacetFilter(
+            'attr_int', Field('attr.int'), alias='a',
+            attrs_getter=lambda params: [],
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {})
+    assert_search_query(sq, SearchQuery(), compiler)
+    qf_res = qf.process_result(SearchResult(
+        {}, aggregations=sq.get_context().aggregations
+    ))
+    assert list(qf_res.attr_int.facets) == []
+
+    # selected attributes still have their own aggregations
+    sq = qf.apply(SearchQuery(), {'a18': '1'})
+    assert list(sq.get_context().aggregations) == ['qf.attr_int.filter:18']
+
+
+def test_attr_int_facet_filter__facet_attrs_key_ranges(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrIntFacetFilter(
+            'attr_int', Field('attr.int'), alias='a',
+            attrs_getter=lambda params: [324, 19, 18, 2],
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {})
+    terms_agg = sq.get_context().aggregations['qf.attr_int']
+    # adjacent attributes are merged into a single key range
+    assert terms_agg.params['script'].script_params['key_ranges'] == [
+        0x2_00000000, 0x2_ffffffff,
+        0x12_00000000, 0x13_ffffffff,
+        0x144_00000000, 0x144_ffffffff,
+    ]
+
+
+def test_attr_int_facet_filter__facet_attrs_include_values(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrIntFacetFilter(
+            'attr_int', Field('attr.int'), alias='a',
+            attrs_values_getter=lambda attr_ids: {
+                18: [0xe2e4, 0xe7e5], 324: [0xdead]
+            },
+            attrs_getter=lambda params: [324, 18],
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {})
+    assert_search_query(
+        sq,
+        SearchQuery().aggs({
+            'qf.attr_int': agg.Terms(
+                Field('attr.int'),
+                size=10_000,
+                include=[0x12_0000e2e4, 0x12_0000e7e5, 0x144_0000dead],
+            )
+        }),
+        compiler
+    )
+
+
+def test_attr_bool_facet_filter__facet_attrs(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrBoolFacetFilter(
+            'attr_bool', Field('attr.bool'), alias='a',
+            attrs_getter=lambda params: [2],
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {})
+    assert_search_query(
+        sq,
+        SearchQuery().aggs({
+            'qf.attr_bool': agg.Terms(
+                Field('attr.bool'), size=100, include=[0b100, 0b101]
+            )
+        }),
+        compiler
+    )
+    qf_res = qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_bool': {
+                    'buckets': [
+                        {
+                            'key': 0b101,
+                            'doc_count': 1
+                        }
+                    ]
+                }
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    assert list(qf_res.attr_bool.facets) == [2]
+
+
+def test_attr_range_facet_filter__facet_attrs(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrRangeFacetFilter(
+            'attr_range', Field('attr.float'), alias='a',
+            attrs_getter=lambda params: {439, 8},
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {})
+    assert_search_query(
+        sq,
+        SearchQuery().aggs({
+            'qf.attr_range': agg.Terms(
+                script=Script(
+                    RANGE_ATTR_SCRIPT,
+                    lang='painless',
+                    params={
+                        'field': 'attr.float',
+                    }
+                ),
+                size=100,
+                include=[8, 439],
+            ),
+        }),
+        compiler
+    )
+    qf_res = qf.process_results(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_range': {
+                    'buckets': [
+                        {
+                            'key': '8',
+                            'doc_count': 84
+                        },
+                        {
+                            'key': '12',
+                            'doc_count': 28
+                        }
+                    ]
+                }
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    assert list(qf_res.attr_range.facets) == [8]
+
+
+def test_attr_range_facet_filter__no_facet_attrs(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrRangeFacetFilter(
+            'attr_range', Field('attr.float'), alias='a',
+            attrs_getter=lambda params: [],
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {})
+    assert_search_query(sq, SearchQuery(), compiler)
+    qf_res = qf.process_results(SearchResult(
+        {}, aggregations=sq.get_context().aggregations
+    ))
+    assert list(qf_res.attr_range.facets) == []
+
+    sq = qf.apply(SearchQuery(), {'a8__gte': '1'})
+    assert list(sq.get_context().aggregations) == ['qf.attr_range:8']
+
+
+def test_attr_range_facet_filter__histogram(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrRangeFacetFilter(
+            'attr_range', Field('attr.float'), alias='a',
+            histogram_bounds_getter=lambda params: {
+                8: [4.0, -2.0, 2.0],
+                99: [-4.0, -2.0, -0.0],
+                1 << 21: [0.0, 1.0],
+            },
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {'a8__gte': 2.71})
+    assert_search_query(
+        sq,
+        SearchQuery()
+        .aggs({
+            'qf.attr_range.filter': agg.Filter(
+                Range('attr.float', gte=0x8_402d70a4, lte=0x8_7f800000),
+                aggs={
+                    'qf.attr_range': agg.Terms(
+                        script=Script(
+                            RANGE_ATTR_SCRIPT,
+                            lang='painless',
+                            params={
+                                'field': 'attr.float',
+                            }
+                        ),
+                        size=100
+                    ),
+                    'qf.attr_range.histogram': agg.Range(
+                        Field('attr.float'),
+                        ranges=[
+                            {
+                                'key': '99:0',
+                                'from': 0x63_c0000001,
+                                'to': 0x63_c0800001,
+                            },
+                            {
+                                'key': '99:1',
+                                'from': 0x63_80000001,
+                                'to': 0x63_c0000001,
+                            },
+                        ]
+                    ),
+                }
+            ),
+            'qf.attr_range:8': agg.Filter(
+                Range('attr.float', gte=0x8_00000000, lte=0x8_ffffffff),
+                aggs={
+                    'qf.attr_range.histogram': agg.Range(
+                        Field('attr.float'),
+                        ranges=[
+                            {
+                                'key': '8:0',
+                                'from': 0x8_80000000,
+                                'to': 0x8_c0000001,
+                            },
+                            {
+                                'key': '8:0',
+                                'from': 0x8_00000000,
+                                'to': 0x8_40000000,
+                            },
+                            {
+                                'key': '8:1',
+                                'from': 0x8_40000000,
+                                'to': 0x8_40800000,
+                            },
+                        ]
+                    ),
+                }
+            )
+        })
+        .post_filter(Range('attr.float', gte=0x8_402d70a4, lte=0x8_7f800000)),
+        compiler
+    )
+
+    qf_res = qf.process_results(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_range.filter': {
+                    'doc_count': 32,
+                    'qf.attr_range': {
+                        'buckets': [
+                            {
+                                'key': 8,
+                                'doc_count': 32
+                            },
+                            {
+                                'key': 99,
+                                'doc_count': 18
+                            },
+                            {
+                                'key': 439,
+                                'doc_count': 7
+                            }
+                        ]
+                    },
+                    'qf.attr_range.histogram': {
+                        'buckets': [
+                            {
+                                'key': '99:0',
+                                'doc_count': 11
+                            },
+                            {
+                                'key': '99:1',
+                                'doc_count': 0
+                            },
+                        ]
+                    }
+                },
+                'qf.attr_range:8': {
+                    'doc_count': 84,
+                    'qf.attr_range.histogram': {
+                        'buckets': [
+                            {
+                                'key': '8:0',
+                                'doc_count': 10
+                            },
+                            {
+                                'key': '8:0',
+                                'doc_count': 20
+                            },
+                            {
+                                'key': '8:1',
+                                'doc_count': 50
+                            },
+                        ]
+                    }
+                }
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    f = qf_res.attr_range.get_facet(8)
+    assert f.count == 84
+    assert f.selected is True
+    assert f.histogram == [(-2.0, 2.0, 30), (2.0, 4.0, 50)]
+    f = qf_res.attr_range.get_facet(99)
+    assert f.count == 18
+    assert f.selected is False
+    assert f.histogram == [(-4.0, -2.0, 11), (-2.0, 0.0, 0)]
+    f = qf_res.attr_range.get_facet(439)
+    assert f.count == 7
+    assert f.histogram is None
+
+
+@pytest.mark.parametrize('zero', [0.0, -0.0])
+def test_attr_range_facet_filter__histogram_zero_bound(zero):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrRangeFacetFilter(
+            'attr_range', Field('attr.float'), alias='a',
+            histogram_bounds_getter=lambda params: {
+                8: [-1.0, zero, 1.0],
+            },
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {})
+    histogram_agg = sq.get_context().aggregations['qf.attr_range.histogram']
+    assert histogram_agg.params['ranges'] == [
+        {
+            'key': '8:0',
+            'from': 0x8_80000001,
+            'to': 0x8_bf800001,
+        },
+        {
+            'key': '8:1',
+            'from': 0x8_80000000,
+            'to': 0x8_80000001,
+        },
+        {
+            'key': '8:1',
+            'from': 0x8_00000000,
+            'to': 0x8_3f800000,
+        },
+    ]
+
+
+def test_attr_range_facet_filter__quantiles(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrRangeFacetFilter(
+            'attr_range', Field('attr.float'), alias='a',
+            compute_min_max=True,
+            histogram_bounds_getter=lambda params: {
+                8: [0.0, 10.0, 20.0, float('inf')],
+                439: [0.0, 1.0],
+            },
+            quantiles=[0.05, 0.5, 0.95],
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {})
+    qf_res = qf.process_results(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_range': {
+                    'buckets': [
+                        {
+                            'key': '8',
+                            'doc_count': 100
+                        },
+                        {
+                            'key': '439',
+                            'doc_count': 28
+                        },
+                        {
+                            'key': '500',
+                            'doc_count': 3
+                        }
+                    ]
+                },
+                'qf.attr_range.histogram': {
+                    'buckets': [
+                        {
+                            'key': '8:0',
+                            'doc_count': 10
+                        },
+                        {
+                            'key': '8:1',
+                            'doc_count': 80
+                        },
+                        {
+                            'key': '8:2',
+                            'doc_count': 10
+                        },
+                        {
+                            'key': '439:0',
+                            'doc_count': 0
+                        },
+                    ]
+                },
+                'qf.attr_range.min_max': {
+                    'value': {
+                        'attr_ids': [8, 500],
+                        'min': [1.0, 2.0],
+                        'max': [30.0, 3.0],
+                    },
+                }
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    f = qf_res.attr_range.get_facet(8)
+    assert f.min == 1.0
+    assert f.max == 30.0
+    assert f.quantiles == {0.05: 5.5, 0.5: 15.0, 0.95: 25.0}
+    f = qf_res.attr_range.get_facet(439)
+    assert f.histogram == [(0.0, 1.0, 0)]
+    assert f.quantiles == {}
+    f = qf_res.attr_range.get_facet(500)
+    assert f.histogram is None
+    assert f.quantiles is None
+
+
+def test_attr_range_facet_filter__min_max_cache(compiler):
+    cache = LRUCache()
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrRangeFacetFilter(
+            'attr_range', Field('attr.float'), alias='a',
+            compute_min_max=True,
+            min_max_cache=cache,
+        )
+    )
+
+    terms_agg = agg.Terms(
+        script=Script(
+            RANGE_ATTR_SCRIPT,
+            lang='painless',
+            params={
+                'field': 'attr.float',
+            },
+        ),
+        size=100,
+    )
+    min_max_agg = agg.ScriptedMetric(
+        map_script=RANGE_ATTR_MINMAX_MAP_SCRIPT,
+        reduce_script=RANGE_ATTR_MINMAX_REDUCE_SCRIPT,
+        combine_script=RANGE_ATTR_MINMAX_COMBINE_SCRIPT,
+        params={
+            'field': 'attr.float',
+        },
+    )
+    raw_result = {
+        'aggregations': {
+            'qf.attr_range': {
+                'buckets': [
+                    {
+                        'key': '8',
+                        'doc_count': 84
+                    },
+                ]
+            },
+            'qf.attr_range.min_max': {
+                'value': {
+                    'attr_ids': [8],
+                    'min': [10.20],
+                    'max': [400.50],
+                },
+            }
+        }
+    }
+
+    sq = qf.apply(SearchQuery().filter(Term('category', 1)), {})
+    assert_search_query(
+        sq,
+        SearchQuery()
+        .filter(Term('category', 1))
+        .aggs({
+            'qf.attr_range': terms_agg,
+            'qf.attr_range.min_max': min_max_agg,
+        }),
+        compiler
+    )
+    qf_res = qf.process_results(SearchResult(
+        raw_result, aggregations=sq.get_context().aggregations
+    ))
+    f = qf_res.attr_range.get_facet(8)
+    assert f.min == 10.20
+    assert f.max == 400.50
+    assert len(cache) == 1
+
+    # selected range attribute does not change min and max values
+    sq = qf.apply(SearchQuery().filter(Term('category', 1)), {'a8__gte': 11})
+    assert 'qf.attr_range.min_max' not in sq.get_context().aggregations
+    raw_result['aggregations'].pop('qf.attr_range.min_max')
+    qf_res = qf.process_results(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_range.filter': raw_result['aggregations'],
+                'qf.attr_range:8': {'doc_count': 84},
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    f = qf_res.attr_range.get_facet(8)
+    assert f.selected is True
+    assert f.min == 10.20
+    assert f.max == 400.50
+    assert len(cache) == 1
+
+    sq = qf.apply(SearchQuery().filter(Term('category', 2)), {})
+    assert 'qf.attr_range.min_max' in sq.get_context().aggregations
+
+    # other indices and search params have their own min and max values
+    sq = qf.apply(
+        SearchQuery(index=FakeIndex({}, name='other'))
+        .filter(Term('category', 1)),
+        {}
+    )
+    assert 'qf.attr_range.min_max' in sq.get_context().aggregations
+    sq = qf.apply(
+        SearchQuery().filter(Term('category', 1))
+        .with_search_params(routing='1'),
+        {}
+    )
+    assert 'qf.attr_range.min_max' in sq.get_context().aggregations
+    sq = qf.apply(SearchQuery().filter(Term('category', 1)), {})
+    assert 'qf.attr_range.min_max' not in sq.get_context().aggregations
+
+
+def test_attr_int_facet_filter__sampler(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrIntFacetFilter(
+            'attr_int', Field('attr.int'), alias='a',
+            sampler_shard_size=1000,
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18': '58084'})
+    assert_search_query(
+        sq,
+        SearchQuery()
+        .aggs({
+            'qf.attr_int.filter': agg.Filter(
+                Term('attr.int', 0x12_0000e2e4),
+                aggs={
+                    'qf.attr_int.sampler': agg.Sampler(
+                        shard_size=1000,
+                        aggs={
+                            'qf.attr_int': agg.Terms(
+                                Field('attr.int'), size=10_000
+                            ),
+                        }
+                    ),
+                }
+            ),
+            'qf.attr_int.filter:18': agg.Filter(
+                Range('attr.int', gte=0x12_00000000, lte=0x12_ffffffff),
+                aggs={
+                    'qf.attr_int.sampler:18': agg.Sampler(
+                        shard_size=1000,
+                        aggs={
+                            'qf.attr_int:18': attr_values_agg(
+                                'attr.int', 0x12_00000000, 0x12_ffffffff
+                            ),
+                        }
+                    ),
+                }
+            ),
+        })
+        .post_filter(Term('attr.int', 0x12_0000e2e4)),
+        compiler
+    )
+    qf_res = qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_int.filter': {
+                    'doc_count': 40_000,
+                    'qf.attr_int.sampler': {
+                        'doc_count': 1000,
+                        'qf.attr_int': {
+                            'buckets': [
+                                {
+                                    'key': 0x12_0000e2e4,
+                                    'doc_count': 1000,
+                                },
+                                {
+                                    'key': 0x144_0000dead,
+                                    'doc_count': 3,
+                                },
+                            ]
+                        }
+                    }
+                },
+                'qf.attr_int.filter:18': {
+                    'doc_count': 800,
+                    'qf.attr_int.sampler:18': {
+                        'doc_count': 800,
+                        'qf.attr_int:18': {
+                            'buckets': [
+                                {
+                                    'key': 0x12_0000e2e4,
+                                    'doc_count': 700,
+                                },
+                                {
+                                    'key': 0x12_0000e7e5,
+                                    'doc_count': 100,
+                                },
+                            ]
+                        }
+                    }
+                },
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    assert qf_res.attr_int.approximate is True
+    facet = qf_res.attr_int.get_facet(18)
+    assert len(facet.all_values) == 2
+    assert facet.all_values[0].value == 0xe2e4
+    assert facet.all_values[0].count == 700
+    assert facet.all_values[0].selected is True
+    assert facet.all_values[1].value == 0xe7e5
+    assert facet.all_values[1].count == 100
+    facet = qf_res.attr_int.get_facet(324)
+    assert len(facet.all_values) == 1
+    assert facet.all_values[0].value == 0xdead
+    assert facet.all_values[0].count == 120
+
+
+def test_attr_bool_facet_filter__diversified_sampler(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrBoolFacetFilter(
+            'attr_bool', Field('attr.bool'), alias='a',
+            sampler_shard_size=500,
+            sampler_diversify_field=Field('brand'),
+        )
+    )
+
+    sq = qf.apply(SearchQuery(), {})
+    assert_search_query(
+        sq,
+        SearchQuery().aggs({
+            'qf.attr_bool.filter': agg.Filter(
+                MatchAll(),
+                aggs={
+                    'qf.attr_bool.sampler': DiversifiedSampler(
+                        shard_size=500,
+                        field=Field('brand'),
+                        aggs={
+                            'qf.attr_bool': agg.Terms(
+                                Field('attr.bool'), size=100
+                            ),
+                        }
+                    ),
+                }
+            ),
+        }),
+        compiler
+    )
+    qf_res = qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_bool.filter': {
+                    'doc_count': 300,
+                    'qf.attr_bool.sampler': {
+                        'doc_count': 300,
+                        'qf.attr_bool': {
+                            'buckets': [
+                                {
+                                    'key': 0b11,
+                                    'doc_count': 200,
+                                },
+                            ]
+                        }
+                    }
+                },
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    assert qf_res.attr_bool.approximate is False
+    facet = qf_res.attr_bool.get_facet(1)
+    assert facet.all_values[0].value is True
+    assert facet.all_values[0].count == 200
+
+
+@pytest.mark.parametrize(
+    'filter_cls, field, buckets',
+    [
+        (
+            AttrIntFacetFilter,
+            'attr.int',
+            [
+                (0x144_0000dead, 123),
+                (0x12_0000e2e4, 119),
+                (0x7_ffffffff, 100),
+                (0x144_0000beef, 1),
+                (0x12_0000e7e5, 1),
+                (0x3_00000001, 1),
+            ],
+        ),
+        (
+            AttrBoolFacetFilter,
+            'attr.bool',
+            [(0b101, 20), (0b11, 10), (0b100, 5), (0b1000, 1)],
+        ),
+        (
+            AttrTaggedFacetFilter,
+            'attr.tagged',
+            [
+                (0x24_0000e2e4, 119),
+                (0x7_00000001, 100),
+                (0x6_00000002, 10),
+                (0x7_00000000, 5),
+                (0x24_0000e7e5, 1),
+            ],
+        ),
+    ]
+)
+@pytest.mark.parametrize('facet_attr_ids', [None, [18, 2, 3, 4, 324]])
+@pytest.mark.parametrize(
+    'vectorized, raw_buckets', [(True, False), (False, True), (True, True)]
+)
+def test_attr_facet_filter__decoding_modes(
+        filter_cls, field, buckets, facet_attr_ids, vectorized, raw_buckets
+):
+    raw_result = {
+        'aggregations': {
+            'qf.attrs': {
+                'buckets': [
+                    {'key': key, 'doc_count': count}
+                    for key, count in buckets
+                ]
+            }
+        }
+    }
+    facet_results = []
+    options_variants = [
+        {}, {'vectorized': vectorized, 'raw_buckets': raw_buckets}
+    ]
+    for options in options_variants:
+        qf = QueryFilter()
+        qf.add_filter(
+            filter_cls(
+                'attrs', Field(field), alias='a',
+                attrs_getter=lambda _: facet_attr_ids,
+                **options
+            )
+        )
+        sq = qf.apply(SearchQuery(), {})
+        search_result = SearchResult(
+            raw_result, aggregations=sq.get_context().aggregations
+        )
+        if options.get('raw_buckets'):
+            main_agg = search_result.get_aggregation('qf.attrs')
+            assert isinstance(main_agg, RawTermsAggResult)
+            assert [(b.key, b.doc_count) for b in main_agg.buckets] == \
+                buckets
+        qf_res = qf.process_result(search_result)
+        facet_results.append(qf_res.attrs)
+
+    facet_result, other_facet_result = facet_results
+    assert list(other_facet_result.facets) == list(facet_result.facets)
+    assert len(facet_result.facets) > 1
+    for attr_id, facet in facet_result.facets.items():
+        other_facet = other_facet_result.get_facet(attr_id)
+        assert [
+            (v.value, type(v.value), v.count, v.selected)
+            for v in other_facet.all_values
+        ] == [
+            (v.value, type(v.value), v.count, v.selected)
+            for v in facet.all_values
+        ]
+
+
+def test_attr_tagged_facet_filter(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrTaggedFacetFilter('attr_tagged', Field('attr.tagged'), alias='a')
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18': '58084', 'a3': 'true'})
+    expected_post_filters = [
+        Term(Field('attr.tagged'), 0x24_0000e2e4),
+        Term(Field('attr.tagged'), 0x7_00000001),
+    ]
+    assert sq.to_dict(compiler=compiler)['post_filter'] == (
+        Bool.must(*expected_post_filters).to_dict(compiler=compiler)
+    )
+    aggs = sq.to_dict(compiler=compiler)['aggregations']
+    assert aggs['qf.attr_tagged.filter:18']['filter'] == Bool.must(
+        expected_post_filters[1],
+        Range(Field('attr.tagged'), gte=0x24_00000000, lte=0x25_ffffffff),
+    ).to_dict(compiler=compiler)
+    assert aggs['qf.attr_tagged.filter:3']['filter'] == Bool.must(
+        expected_post_filters[0],
+        Range(Field('attr.tagged'), gte=0x6_00000000, lte=0x7_ffffffff),
+    ).to_dict(compiler=compiler)
+
+    qf_res = qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_tagged.filter': {
+                    'doc_count': 100,
+                    'qf.attr_tagged': {
+                        'buckets': [
+                            {'key': 0x24_0000e2e4, 'doc_count': 100},
+                            {'key': 0x7_00000001, 'doc_count': 100},
+                        ]
+                    }
+                },
+                'qf.attr_tagged.filter:18': {
+                    'doc_count': 300,
+                    'qf.attr_tagged:18': {
+                        'buckets': [
+                            {'key': 0x24_0000e7e5, 'doc_count': 200},
+                            {'key': 0x24_0000e2e4, 'doc_count': 100},
+                        ]
+                    }
+                },
+                'qf.attr_tagged.filter:3': {
+                    'doc_count': 150,
+                    'qf.attr_tagged:3': {
+                        'buckets': [
+                            {'key': 0x7_00000001, 'doc_count': 100},
+                            {'key': 0x7_00000000, 'doc_count': 50},
+                        ]
+                    }
+                },
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    facet = qf_res.attr_tagged.get_facet(18)
+    assert [(v.value, v.count, v.selected) for v in facet.all_values] == [
+        (59365, 200, False), (58084, 100, True)
+    ]
+    facet = qf_res.attr_tagged.get_facet(3)
+    assert [(v.value, v.count, v.selected) for v in facet.all_values] == [
+        (True, 100, True), (False, 50, False)
+    ]
+    assert facet.all_values[0].value is True
+
+
+def test_attr_tagged_facet_filter__mixed_values():
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrTaggedFacetFilter('attr_tagged', Field('attr.tagged'), alias='a')
+    )
+    sq = qf.apply(SearchQuery(), {'a5': 'true'})
+    qf_res = qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_tagged.filter:5': {
+                    'doc_count': 15,
+                    'qf.attr_tagged:5': {
+                        'buckets': [
+                            {'key': 0xb_00000001, 'doc_count': 10},
+                            {'key': 0xa_00000001, 'doc_count': 5},
+                        ]
+                    },
+                },
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    facet = qf_res.attr_tagged.get_facet(5)
+    assert [
+        (type(v.value), v.value, v.selected) for v in facet.all_values
+    ] == [(bool, True, True), (int, 1, False)]
+    assert facet.get_value(True).count == 10
+    assert facet.get_value(1).count == 5
+
+    merged = qf_res.attr_tagged.merge(qf_res.attr_tagged)
+    facet = merged.get_facet(5)
+    assert [
+        (type(v.value), v.count, v.selected) for v in facet.all_values
+    ] == [(bool, 20, True), (int, 10, False)]
+
+
+@pytest.mark.parametrize(
+    'params, expected_selected',
+    [
+        ({'a5__gte': '0', 'a5__lte': '3'}, [False, True, False, False]),
+        ({'a5': 'true', 'a5__gte': '10'}, [True, False, False, True]),
+    ]
+)
+def test_attr_tagged_facet_filter__range_selected_values(
+        params, expected_selected
+):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrTaggedFacetFilter('attr_tagged', Field('attr.tagged'), alias='a')
+    )
+    sq = qf.apply(SearchQuery(), params)
+    qf_res = qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.attr_tagged.filter:5': {
+                    'doc_count': 30,
+                    'qf.attr_tagged:5': {
+                        'buckets': [
+                            {'key': 0xb_00000001, 'doc_count': 10},
+                            {'key': 0xa_00000001, 'doc_count': 8},
+                            {'key': 0xb_00000000, 'doc_count': 7},
+                            {'key': 0xa_0000000c, 'doc_count': 5},
+                        ]
+                    },
+                },
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    facet = qf_res.attr_tagged.get_facet(5)
+    assert [v.value for v in facet.all_values] == [True, 1, False, 12]
+    assert [v.selected for v in facet.all_values] == expected_selected
@@ -0,0 +1,280 @@
+from elasticmagic_qf_attrs import facet_result as facet_result_module
+from elasticmagic_qf_attrs.facet_result import AttrFacetFilterResult
+from elasticmagic_qf_attrs.facet_result import AttrFacetValue
+from elasticmagic_qf_attrs.facet_result import AttrRangeFacet
+from elasticmagic_qf_attrs.facet_result import AttrRangeFacetFilterResult
+
+import pytest
+
+
+def test_attr_facet_filter_result__lazy_facets():
+    facet_result = AttrFacetFilterResult[int]('attr_int', 'a')
+    facet_result.add_attr_bucket(18, 1, 10, True, True)
+    facet_result.add_attr_buckets(
+        324, [7, 8], [5, 4], [False, False], [False, False]
+    )
+    facet_result.add_attr_bucket(18, 2, 3, False, True)
+
+    assert list(facet_result.facets) == [18, 324]
+    assert len(facet_result.facets) == 2
+    assert 324 in facet_result.facets
+    assert 1 not in facet_result.facets
+    assert facet_result._facets == {}
+
+    facet = facet_result.get_facet(18)
+    assert list(facet_result._facets) == [18]
+    assert facet is facet_result.facets[18]
+    assert [v.value for v in facet.all_values] == [1, 2]
+    assert [v.value for v in facet.selected_values] == [1]
+    assert facet.get_value(2).count_text == '+3'
+
+    facet_result.add_attr_bucket(18, 5, 1, False, True)
+    facet_result.add_attr_value(18, AttrFacetValue(6, 1, False, True))
+    assert [v.value for v in facet.all_values] == [1, 2, 5, 6]
+
+    facet = facet_result.get_facet(324)
+    assert [(v.value, v.count) for v in facet.all_values] == [(7, 5), (8, 4)]
+
+    assert facet_result.get_facet(1) is None
+
+
+def test_attr_facet_filter_result__concurrent_materialization(monkeypatch):
+    facet_result = AttrFacetFilterResult('attr_int', 'a')
+    facet_result.add_attr_bucket(1, 2, 10, False, False)
+    facet_result.add_attr_bucket(1, 3, 5, False, False)
+
+    attr_facet_cls = facet_result_module.AttrFacet
+    interleaved = []
+
+    # another thread materializes the same facet while the first one
+    # is building it
+    def make_facet(attr_id):
+        if not interleaved:
+            interleaved.append(None)
+            interleaved[0] = facet_result._materialize_facet(attr_id)
+        return attr_facet_cls(attr_id)
+
+    monkeypatch.setattr(facet_result_module, 'AttrFacet', make_facet)
+    facet = facet_result.get_facet(1)
+    assert facet is interleaved[0]
+    assert [(v.value, v.count) for v in facet.all_values] == [(2, 10), (3, 5)]
+
+
+def test_attr_facet_filter_result__add_attr_value():
+    facet_result = AttrFacetFilterResult[bool]('attr_bool', 'b')
+    facet_result.add_attr_value(1, AttrFacetValue(True, 10, False, False))
+    facet_result.add_attr_bucket(1, False, 3, False, False)
+
+    assert list(facet_result.facets) == [1]
+    facet = facet_result.get_facet(1)
+    assert [v.value for v in facet.all_values] == [True, False]
+
+
+def test_attr_facet_filter_result__to_bytes():
+    facet_result = AttrFacetFilterResult[int]('attr_int', 'a')
+    facet_result.add_attr_bucket(18, 1, 10, True, True)
+    facet_result.add_attr_bucket(18, 0xffff_ffff, 3, False, True)
+    facet_result.add_attr_buckets(
+        324, [7, 8], [5, 4], [False, False], [False, False]
+    )
+    facet_result.add_attr_bucket(5, 1, 1, False, False)
+    facet_result.get_facet(324)
+
+    data = facet_result.to_bytes()
+    assert len(data) % 8 == 0
+
+    restored = AttrFacetFilterResult.from_bytes(bytearray(data))
+    assert restored.name == 'attr_int'
+    assert restored.alias == 'a'
+    assert restored.approximate is False
+    assert list(restored.facets) == [18, 324, 5]
+    assert restored._facets == {}
+    assert isinstance(restored._attrs_buckets[18]._values, memoryview)
+
+    facet = restored.get_facet(18)
+    assert [
+        (v.value, v.count, v.selected, v.count_text)
+        for v in facet.all_values
+    ] == [(1, 10, True, '10'), (0xffff_ffff, 3, False, '+3')]
+    facet = restored.get_facet(324)
+    assert [(v.value, v.count) for v in facet.all_values] == [(7, 5), (8, 4)]
+    assert restored._facets.keys() == {18, 324}
+
+    restored.add_attr_bucket(5, 2, 1, False, False)
+    facet = restored.get_facet(5)
+    assert [(v.value, v.count) for v in facet.all_values] == [(1, 1), (2, 1)]
+
+
+def test_attr_facet_filter_result__to_bytes_bool():
+    facet_result = AttrFacetFilterResult[bool]('attr_bool', 'b')
+    facet_result.approximate = True
+    facet_result.add_attr_bucket(1, True, 10, False, False)
+    facet_result.add_attr_bucket(1, False, 3, False, False)
+
+    restored = AttrFacetFilterResult.from_bytes(facet_result.to_bytes())
+    assert restored.approximate is True
+    facet = restored.get_facet(1)
+    assert [(v.value, v.count) for v in facet.all_values] == [
+        (True, 10), (False, 3)
+    ]
+    assert facet.all_values[0].value is True
+
+
+def test_attr_facet_filter_result__to_bytes_mixed():
+    facet_result = AttrFacetFilterResult('attr_tagged', 'a')
+    facet_result.add_attr_bucket(1, True, 10, True, False)
+    facet_result.add_attr_bucket(1, False, 3, False, False)
+    facet_result.add_attr_bucket(2, 1, 7, False, False)
+    facet_result.add_attr_bucket(2, 0, 2, False, False)
+
+    restored = AttrFacetFilterResult.from_bytes(facet_result.to_bytes())
+    facet = restored.get_facet(1)
+    assert [(v.value, v.count, v.selected) for v in facet.all_values] == [
+        (True, 10, True), (False, 3, False)
+    ]
+    assert facet.all_values[0].value is True
+    assert facet.all_values[1].value is False
+    facet = restored.get_facet(2)
+    assert [(v.value, v.count) for v in facet.all_values] == [(1, 7), (0, 2)]
+    assert facet.all_values[0].value is not True
+
+
+def test_attr_facet_filter_result__from_bytes_invalid():
+    data = AttrFacetFilterResult[int]('attr_int', 'a').to_bytes()
+    with pytest.raises(ValueError):
+        AttrFacetFilterResult.from_bytes(b'XXXX' + data[4:])
+    with pytest.raises(ValueError):
+        AttrFacetFilterResult.from_bytes(data[:-8])
+    with pytest.raises(ValueError):
+        AttrRangeFacetFilterResult.from_bytes(data)
+
+
+def test_attr_range_facet_filter_result__to_bytes():
+    facet_result = AttrRangeFacetFilterResult('attr_range', 'r')
+    facet_result.add_facet(AttrRangeFacet(8, 84, False))
+    facet_result.add_facet(
+        AttrRangeFacet(
+            439, 28, True, min_=-1.5, max_=100.0,
+            histogram=[(-1.5, 0.0, 10), (0.0, 100.0, 18)],
+            quantiles={0.5: 1.25, 0.9: 80.0},
+        )
+    )
+    facet_result.add_facet(AttrRangeFacet(2, 1, False, min_=0.0))
+
+    restored = AttrRangeFacetFilterResult.from_bytes(facet_result.to_bytes())
+    assert restored.name == 'attr_range'
+    assert restored.alias == 'r'
+    assert list(restored.facets) == [8, 439, 2]
+    assert restored._facets == {}
+
+    facet = restored.get_facet(439)
+    assert facet.attr_id == 439
+    assert facet.count == 28
+    assert facet.selected is True
+    assert facet.min == -1.5
+    assert facet.max == 100.0
+    assert facet.histogram == [(-1.5, 0.0, 10), (0.0, 100.0, 18)]
+    assert facet.quantiles == {0.5: 1.25, 0.9: 80.0}
+    assert list(restored._facets) == [439]
+
+    facet = restored.get_facet(8)
+    assert facet.count == 84
+    assert facet.selected is False
+    assert facet.min is None
+    assert facet.max is None
+    assert facet.histogram is None
+    assert facet.quantiles is None
+
+    facet = restored.get_facet(2)
+    assert facet.min == 0.0
+    assert facet.max is None
+
+    assert restored.get_facet(1) is None
+
+
+def test_attr_facet_filter_result__merge():
+    first = AttrFacetFilterResult[int]('attr_int', 'a')
+    first.add_attr_buckets(
+        18, [1, 2], [10, 3], [True, False], [True, True]
+    )
+    first.add_attr_bucket(324, 7, 5, False, False)
+    second = AttrFacetFilterResult[int]('attr_int', 'a', approximate=True)
+    second.add_attr_buckets(
+        18, [2, 3], [9, 1], [False, False], [True, True]
+    )
+    second.add_attr_bucket(12, 1, 2, False, False)
+    # materialized facets are merged too
+    assert second.get_facet(12).all_values[0].count == 2
+
+    merged = first.merge(second)
+    assert merged.name == 'attr_int'
+    assert merged.alias == 'a'
+    assert merged.approximate is True
+    assert list(merged.facets) == [18, 324, 12]
+
+    facet = merged.get_facet(18)
+    assert [(v.value, v.count) for v in facet.all_values] == [
+        (2, 12), (1, 10), (3, 1)
+    ]
+    assert [v.value for v in facet.selected_values] == [1]
+    assert facet.get_value(2).count_text == '+12'
+    assert [
+        (v.value, v.count) for v in merged.get_facet(324).all_values
+    ] == [(7, 5)]
+    assert [
+        (v.value, v.count) for v in merged.get_facet(12).all_values
+    ] == [(1, 2)]
+
+    # merged inputs are not changed
+    assert [v.count for v in first.get_facet(18).all_values] == [10, 3]
+    assert first.merge().approximate is False
+
+
+def test_attr_range_facet_filter_result__merge():
+    first = AttrRangeFacetFilterResult('attr_range', 'r')
+    first.add_facet(
+        AttrRangeFacet(
+            439, 10, False, min_=1.0, max_=50.0,
+            histogram=[(0.0, 10.0, 4), (10.0, 100.0, 6)],
+            quantiles={0.5: 10.0},
+        )
+    )
+    first.add_facet(AttrRangeFacet(8, 3, False, min_=2.0, max_=3.0))
+    second = AttrRangeFacetFilterResult('attr_range', 'r')
+    second.add_facet(
+        AttrRangeFacet(
+            439, 10, True, min_=0.5, max_=90.0,
+            histogram=[(0.0, 10.0, 6), (10.0, 100.0, 4)],
+            quantiles={0.5: 8.0},
+        )
+    )
+    second.add_facet(
+        AttrRangeFacet(
+            8, 2, False, min_=2.5, max_=4.0,
+            histogram=[(0.0, 5.0, 2)], quantiles={0.5: 3.0},
+        )
+    )
+    second.add_facet(AttrRangeFacet(2, 1, False))
+    second = AttrRangeFacetFilterResult.from_bytes(second.to_bytes())
+
+    merged = first.merge(second)
+    assert list(merged.facets) == [439, 8, 2]
+
+    facet = merged.get_facet(439)
+    assert facet.count == 20
+    assert facet.selected is True
+    assert facet.min == 0.5
+    assert facet.max == 90.0
+    assert facet.histogram == [(0.0, 10.0, 10), (10.0, 100.0, 10)]
+    assert facet.quantiles == {0.5: 10.0}
+
+    facet = merged.get_facet(8)
+    assert facet.count == 5
+    assert facet.min == 2.0
+    assert facet.max == 4.0
+    assert facet.histogram is None
+    assert facet.quantiles is None
+
+    facet = merged.get_facet(2)
+    assert facet.count == 1
+    assert facet.min is None
@@ -0,0 +1,144 @@
+from elasticmagic import Field
+from elasticmagic.compiler import Compiler_6_0
+from elasticmagic.ext.asyncio.search import AsyncSearchQuery
+from elasticmagic.ext.queryfilter import FacetFilter
+
+from elasticmagic_qf_attrs import AttrQueryFilter
+from elasticmagic_qf_attrs.cache import LRUCache
+from elasticmagic_qf_attrs.facet import AttrIntFacetFilter
+from elasticmagic_qf_attrs.facet_result import AttrFacetFilterResult
+from elasticmagic_qf_attrs.fanout import merge_query_filter_results
+from elasticmagic_qf_attrs.fanout import search_and_merge
+
+import pytest
+
+from .conftest import FakeIndex
+
+
+def raw_result(brand_buckets, attr_buckets):
+    return {
+        'aggregations': {
+            'qf.brand': {'buckets': brand_buckets},
+            'qf.attr_int': {'buckets': attr_buckets},
+        }
+    }
+
+
+def sent_agg_names(search_query):
+    return list(search_query.get_context().aggregations)
+
+
+def make_qf(agg_cache=None):
+    qf = AttrQueryFilter(agg_cache=agg_cache)
+    qf.add_filter(FacetFilter('brand', Field('brand')))
+    qf.add_filter(
+        AttrIntFacetFilter('attr_int', Field('attr.int'), alias='a')
+    )
+    return qf
+
+
+@pytest.fixture
+def qf():
+    yield make_qf()
+
+
+@pytest.mark.asyncio
+async def test_search_and_merge(qf):
+    indices = [
+        FakeIndex(
+            raw_result(
+                [{'key': 1, 'doc_count': 7}],
+                [
+                    {'key': 0x12_0000e2e4, 'doc_count': 4},
+                    {'key': 0x12_0000e2e5, 'doc_count': 1},
+                ]
+            ),
+            delay=0.01,
+        ),
+        FakeIndex(
+            raw_result(
+                [{'key': 2, 'doc_count': 3}],
+                [
+                    {'key': 0x12_0000e2e5, 'doc_count': 5},
+                    {'key': 0x13_00000001, 'doc_count': 2},
+                ]
+            ),
+            delay=0,
+        ),
+    ]
+
+    qf_res = await search_and_merge(
+        make_qf, [AsyncSearchQuery(index=index) for index in indices], {}
+    )
+    for index in indices:
+        assert len(index.search_queries) == 1
+
+    # the fastest response comes first
+    assert [v.value for v in qf_res.brand.all_values] == [2]
+    assert isinstance(qf_res.attr_int, AttrFacetFilterResult)
+    assert list(qf_res.attr_int.facets) == [18, 19]
+    assert [
+        (v.value, v.count) for v in qf_res.attr_int.get_facet(18).all_values
+    ] == [(0xe2e5, 6), (0xe2e4, 4)]
+    assert qf_res.attr_int.get_facet(19).all_values[0].count == 2
+
+
+@pytest.mark.asyncio
+async def test_search_and_merge__agg_cache():
+    agg_cache = LRUCache()
+    index_a = FakeIndex(
+        raw_result([], [{'key': 0x12_0000e2e4, 'doc_count': 4}]),
+        delay=0.01,
+        name='a',
+    )
+    index_b = FakeIndex(
+        raw_result([], [{'key': 0x12_0000e2e4, 'doc_count': 5}]),
+        name='b',
+    )
+
+    def qf_factory():
+        return make_qf(agg_cache=agg_cache)
+
+    await search_and_merge(
+        qf_factory, [AsyncSearchQuery(index=index_b)], {}
+    )
+    qf_res = await search_and_merge(
+        qf_factory,
+        [
+            AsyncSearchQuery(index=index_a),
+            AsyncSearchQuery(index=index_b),
+        ],
+        {},
+    )
+    assert [
+        (v.value, v.count) for v in qf_res.attr_int.get_facet(18).all_values
+    ] == [(0xe2e4, 9)]
+    assert sent_agg_names(index_b.search_queries[-1]) == ['qf.brand']
+
+    # results of both indices are cached
+    qf_res = await search_and_merge(
+        qf_factory,
+        [
+            AsyncSearchQuery(index=index_a),
+            AsyncSearchQuery(index=index_b),
+        ],
+        {},
+    )
+    assert qf_res.attr_int.get_facet(18).all_values[0].count == 9
+    assert sent_agg_names(index_a.search_queries[-1]) == ['qf.brand']
+
+
+@pytest.mark.asyncio
+async def test_search_and_merge__no_search_queries():
+    with pytest.raises(ValueError):
+        await search_and_merge(make_qf, [], {})
+
+
+def test_merge_query_filter_results(qf):
+    qf_res = merge_query_filter_results([
+        qf.process_result(
+            Compiler_6_0.compiled_query(qf.apply(AsyncSearchQuery(), {}))
+            .process_result(raw_result([], []))
+        )
+    ])
+    assert list(qf_res.filters) == ['brand', 'attr_int']
@@ -0,0 +1,79 @@
+from elasticmagic import Field
+from elasticmagic.ext.queryfilter import FacetFilter
+from elasticmagic.ext.queryfilter import QueryFilter
+
+from elasticmagic_qf_attrs.facet import AttrBoolFacetFilter
+from elasticmagic_qf_attrs.facet import AttrIntFacetFilter
+from elasticmagic_qf_attrs.facet import AttrRangeFacetFilter
+from elasticmagic_qf_attrs.mapping import attr_fields_mapping
+from elasticmagic_qf_attrs.mapping import validate_attr_fields_mapping
+from elasticmagic_qf_attrs.simple import AttrIntSimpleFilter
+
+import pytest
+
+
+@pytest.fixture
+def qf():
+    qf = QueryFilter()
+    qf.add_filter(FacetFilter('brand', Field('brand')))
+    qf.add_filter(
+        AttrBoolFacetFilter('attr_bool', Field('attr.bool'), alias='a')
+    )
+    qf.add_filter(
+        AttrIntFacetFilter('attr_int', Field('attr.int'), alias='a')
+    )
+    qf.add_filter(
+        AttrRangeFacetFilter('attr_range', Field('attr.float'), alias='a')
+    )
+    qf.add_filter(
+        AttrIntSimpleFilter('attr_hidden', Field('attr_hidden'), alias='h')
+    )
+    yield qf
+
+
+def test_attr_fields_mapping(qf):
+    assert attr_fields_mapping(qf) == {
+        'properties': {
+            'attr': {
+                'properties': {
+                    'bool': {'type': 'long'},
+                    'int': {'type': 'long'},
+                    'float': {'type': 'long'},
+                },
+            },
+            'attr_hidden': {'type': 'long', 'doc_values': False},
+        },
+    }
+
+
+def test_validate_attr_fields_mapping(qf):
+    mapping = attr_fields_mapping(qf)
+    assert validate_attr_fields_mapping(qf, mapping) == []
+    assert validate_attr_fields_mapping(qf, mapping, {}) == []
+    assert validate_attr_fields_mapping(
+        qf, mapping, {'index': {'requests': {'cache': {'enable': 'true'}}}}
+    ) == []
+    assert validate_attr_fields_mapping(
+        qf, mapping, {'index': {'requests': {'cache': {'enable': False}}}}
+    ) == ['index.requests.cache.enable: cache is disabled']
+
+    mapping['properties']['attr']['properties'].pop('bool')
+    mapping['properties']['attr']['properties']['int'] = {
+        'type': 'integer', 'doc_values': False
+    }
+    mapping['properties']['attr']['properties']['float']['index'] = False
+    assert validate_attr_fields_mapping(
+        qf, mapping, {'index.requests.cache.enable': 'false'}
+    ) == [
+        'attr.bool: field is missing, used by attr_bool',
+        'attr.int: expected long type but was integer',
+        'attr.int: doc values are required for facets of attr_int',
+        'attr.float: field must be indexed for filtering by attr_range',
+        'index.requests.cache.enable: cache is disabled',
+    ]
+    assert validate_attr_fields_mapping(qf, {}) == [
+        'attr.bool: field is missing, used by attr_bool',
+        'attr.int: field is missing, used by attr_int',
+        'attr.float: field is missing, used by attr_range',
+        'attr_hidden: field is missing, used by attr_hidden',
+    ]
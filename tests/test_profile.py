@@ -0,0 +1,101 @@
+from elasticmagic import Field
+from elasticmagic import SearchQuery
+from elasticmagic.ext.queryfilter import FacetFilter
+
+from elasticmagic_qf_attrs import AttrQueryFilter
+from elasticmagic_qf_attrs.facet import AttrIntFacetFilter
+from elasticmagic_qf_attrs.facet import AttrRangeFacetFilter
+from elasticmagic_qf_attrs.profile import parse_aggs_profile
+from elasticmagic_qf_attrs.profile import profile_search_body
+
+import pytest
+
+
+@pytest.fixture
+def qf():
+    qf = AttrQueryFilter()
+    qf.add_filter(FacetFilter('brand', Field('brand')))
+    qf.add_filter(
+        AttrIntFacetFilter('attr_int', Field('attr.int'), alias='a')
+    )
+    qf.add_filter(
+        AttrRangeFacetFilter('attr_range', Field('attr.float'), alias='a')
+    )
+    yield qf
+
+
+def agg_profile(name, time_in_nanos, children=(), type='FilterAggregator'):
+    return {
+        'type': type,
+        'description': name,
+        'time_in_nanos': time_in_nanos,
+        'breakdown': {},
+        'children': list(children),
+    }
+
+
+def test_profile_search_body(qf, compiler):
+    sq = qf.apply(SearchQuery(), {})
+    body = profile_search_body(sq, compiler)
+    assert body['profile'] is True
+    assert set(body['aggregations']) == {
+        'qf.brand', 'qf.attr_int', 'qf.attr_range'
+    }
+    assert profile_search_body(SearchQuery(), compiler) == {'profile': True}
+
+
+def test_parse_aggs_profile(qf):
+    raw_result = {
+        'profile': {
+            'shards': [
+                {
+                    'aggregations': [
+                        agg_profile('qf.brand', 10),
+                        agg_profile('qf._shared.0', 100, [
+                            agg_profile('qf.attr_int', 60),
+                            agg_profile('qf.attr_range', 30),
+                        ]),
+                        agg_profile('qf.attr_int.filter:18', 50, [
+                            agg_profile('qf.attr_int:18', 40),
+                        ]),
+                        agg_profile('qf.attr_range:8', 25, [
+                            agg_profile('qf.attr_range:8', 5),
+                            agg_profile('qf.attr_range.histogram', 15),
+                        ]),
+                    ],
+                },
+                {
+                    'aggregations': [
+                        agg_profile('qf.attr_int.filter:18', 20, [
+                            agg_profile('qf.attr_int:18', 15),
+                        ]),
+                        agg_profile('unknown', 3),
+                    ],
+                },
+            ]
+        }
+    }
+    qf_profile = parse_aggs_profile(qf, raw_result)
+
+    assert qf_profile.other_time_in_nanos == 13
+    assert qf_profile.get_filter('brand').time_in_nanos == 10
+    assert qf_profile.get_filter('brand').attrs == {None: 10}
+
+    int_profile = qf_profile.get_filter('attr_int')
+    assert int_profile.time_in_nanos == 130
+    assert int_profile.attrs == {None: 60, 18: 70}
+
+    range_profile = qf_profile.get_filter('attr_range')
+    assert range_profile.time_in_nanos == 55
+    assert range_profile.attrs == {None: 30, 8: 25}
+
+    assert qf_profile.get_filter('unknown') is None
+    assert len(qf_profile.aggs) == 12
+    histogram_profile = qf_profile.aggs[8]
+    assert histogram_profile.agg_name == 'qf.attr_range.histogram'
+    assert histogram_profile.filter_name == 'attr_range'
+    assert histogram_profile.attr_id == 8
+    assert histogram_profile.time_in_nanos == 15
+    assert histogram_profile.self_time_in_nanos == 15
+
+    assert parse_aggs_profile(qf, {}).filters == {}
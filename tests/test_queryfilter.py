@@ -0,0 +1,296 @@
+from elasticmagic import agg
+from elasticmagic import Bool, Field, Range, Script, Term
+from elasticmagic import SearchQuery
+from elasticmagic.ext.queryfilter import FacetFilter
+from elasticmagic.result import SearchResult
+
+from elasticmagic_qf_attrs import AttrQueryFilter
+from elasticmagic_qf_attrs.cache import LRUCache
+from elasticmagic_qf_attrs.facet import AttrBoolFacetFilter
+from elasticmagic_qf_attrs.facet import AttrIntFacetFilter
+from elasticmagic_qf_attrs.facet import AttrRangeFacetFilter
+from elasticmagic_qf_attrs.facet import RANGE_ATTR_SCRIPT
+
+import pytest
+
+from .conftest import assert_search_query
+from .conftest import attr_values_agg
+
+
+@pytest.fixture
+def qf():
+    qf = AttrQueryFilter()
+    qf.add_filter(FacetFilter('brand', Field('brand')))
+    qf.add_filter(
+        AttrBoolFacetFilter('attr_bool', Field('attr.bool'), alias='a')
+    )
+    qf.add_filter(
+        AttrIntFacetFilter('attr_int', Field('attr.int'), alias='a')
+    )
+    qf.add_filter(
+        AttrRangeFacetFilter('attr_range', Field('attr.float'), alias='a')
+    )
+    yield qf
+
+
+def range_attrs_agg():
+    return agg.Terms(
+        script=Script(
+            RANGE_ATTR_SCRIPT,
+            lang='painless',
+            params={'field': 'attr.float'}
+        ),
+        size=100
+    )
+
+
+def test_attr_query_filter__empty_params(qf, compiler):
+    sq = qf.apply(SearchQuery(), {})
+    assert_search_query(
+        sq,
+        SearchQuery().aggs({
+            'qf.brand': agg.Terms(Field('brand')),
+            'qf.attr_bool': agg.Terms(Field('attr.bool'), size=100),
+            'qf.attr_int': agg.Terms(Field('attr.int'), size=10_000),
+            'qf.attr_range': range_attrs_agg(),
+        }),
+        compiler
+    )
+
+
+def test_attr_query_filter__shared_filter_aggs(qf, compiler):
+    sq = qf.apply(SearchQuery(), {'brand': '1'})
+    assert_search_query(
+        sq,
+        SearchQuery()
+        .aggs({
+            'qf.brand': agg.Terms(Field('brand')),
+            'qf._shared.0': agg.Filter(
+                Term('brand', '1'),
+                aggs={
+                    'qf.attr_bool': agg.Terms(Field('attr.bool'), size=100),
+                    'qf.attr_int': agg.Terms(Field('attr.int'), size=10_000),
+                    'qf.attr_range': range_attrs_agg(),
+                }
+            ),
+        })
+        .post_filter(Term('brand', '1')),
+        compiler
+    )
+
+    qf_res = qf.process_result(SearchResult(
+        {
+            'aggregations': {
+                'qf.brand': {
+                    'buckets': [
+                        {'key': 1, 'doc_count': 12},
+                        {'key': 2, 'doc_count': 7},
+                    ]
+                },
+                'qf._shared.0': {
+                    'doc_count': 12,
+                    'qf.attr_bool': {
+                        'buckets': [
+                            {'key': 0b11, 'doc_count': 5},
+                        ]
+                    },
+                    'qf.attr_int': {
+                        'buckets': [
+                            {'key': 0x12_0000e2e4, 'doc_count': 4},
+                        ]
+                    },
+                    'qf.attr_range': {
+                        'buckets': [
+                            {'key': '8', 'doc_count': 3},
+                        ]
+                    },
+                }
+            }
+        },
+        aggregations=sq.get_context().aggregations
+    ))
+    assert qf_res.brand.all_values[0].count == 12
+    facet = qf_res.attr_bool.get_facet(1)
+    assert facet.all_values[0].value is True
+    assert facet.all_values[0].count == 5
+    facet = qf_res.attr_int.get_facet(18)
+    assert facet.all_values[0].value == 0xe2e4
+    assert facet.all_values[0].count == 4
+    facet = qf_res.attr_range.get_facet(8)
+    assert facet.count == 3
+
+
+def test_attr_query_filter__shared_and_separate_filter_aggs(qf, compiler):
+    sq = qf.apply(SearchQuery(), {'a1': 'true', 'a18': '58084'})
+    assert_search_query(
+        sq,
+        SearchQuery()
+        .aggs({
+            'qf.brand.filter': agg.Filter(
+                Bool.must(
+                    Term('attr.bool', 0b11),
+                    Term('attr.int', 0x12_0000e2e4),
+                ),
+                aggs={'qf.brand': agg.Terms(Field('brand'))}
+            ),
+            'qf._shared.0': agg.Filter(
+                Bool.must(
+                    Term('attr.bool', 0b11),
+                    Term('attr.int', 0x12_0000e2e4),
+                ),
+                aggs={
+                    'qf.attr_bool': agg.Terms(Field('attr.bool'), size=100),
+                    'qf.attr_int': agg.Terms(Field('attr.int'), size=10_000),
+                    'qf.attr_range': range_attrs_agg(),
+                }
+            ),
+            'qf.attr_bool.filter:1': agg.Filter(
+                Term('attr.int', 0x12_0000e2e4),
+                aggs={
+                    'qf.attr_bool:1': agg.Terms(
+                        Field('attr.bool'), size=2, include=[0b10, 0b11]
+                    ),
+                }
+            ),
+            'qf.attr_int.filter:18': agg.Filter(
+                Bool.must(
+                    Term('attr.bool', 0b11),
+                    Range('attr.int', gte=0x12_00000000, lte=0x12_ffffffff),
+                ),
+                aggs={
+                    'qf.attr_int:18': attr_values_agg(
+                        'attr.int', 0x12_00000000, 0x12_ffffffff
+                    ),
+                }
+            ),
+        })
+        .post_filter(Term('attr.bool', 0b11))
+        .post_filter(Term('attr.int', 0x12_0000e2e4)),
+        compiler
+    )
+
+
+def test_attr_query_filter__trim_response(qf, compiler):
+    sq = qf.apply(SearchQuery(), {})
+    assert sq.get_context().search_params['filter_path'].split(',') == [
+        '-aggregations.**.qf*attr_bool.doc_count_error_upper_bound',
+        '-aggregations.**.qf*attr_bool.sum_other_doc_count',
+        '-aggregations.**.qf*attr_bool:*.doc_count_error_upper_bound',
+        '-aggregations.**.qf*attr_bool:*.sum_other_doc_count',
+        '-aggregations.**.qf*attr_int.doc_count_error_upper_bound',
+        '-aggregations.**.qf*attr_int.sum_other_doc_count',
+        '-aggregations.**.qf*attr_int:*.doc_count_error_upper_bound',
+        '-aggregations.**.qf*attr_int:*.sum_other_doc_count',
+        '-aggregations.**.qf*attr_range.doc_count_error_upper_bound',
+        '-aggregations.**.qf*attr_range.sum_other_doc_count',
+    ]
+
+    sq = qf.apply(
+        SearchQuery().with_search_params(filter_path='-took'), {}
+    )
+    filter_path = sq.get_context().search_params['filter_path'].split(',')
+    assert len(filter_path) == 11
+    assert filter_path[0] == '-took'
+
+    sq = qf.apply(
+        SearchQuery().with_search_params(filter_path='hits.hits._id'), {}
+    )
+    assert sq.get_context().search_params['filter_path'] == 'hits.hits._id'
+
+    qf.trim_response = False
+    sq = qf.apply(SearchQuery(), {})
+    assert 'filter_path' not in sq.get_context().search_params
+
+
+def test_attr_query_filter__agg_cache(compiler):
+    qf = AttrQueryFilter(agg_cache=LRUCache())
+    qf.add_filter(FacetFilter('brand', Field('brand')))
+    qf.add_filter(
+        AttrIntFacetFilter('attr_int', Field('attr.int'), alias='a')
+    )
+
+    def process(sq, raw_aggs):
+        return qf.process_result(SearchResult(
+            {'aggregations': raw_aggs},
+            aggregations=sq.get_context().aggregations
+        ))
+
+    sq = qf.apply(SearchQuery(), {'a18': '1'})
+    assert set(sq.get_context().aggregations) == {
+        'qf.brand.filter', 'qf.attr_int.filter', 'qf.attr_int.filter:18'
+    }
+    qf_res = process(sq, {
+        'qf.brand.filter': {
+            'doc_count': 4,
+            'qf.brand': {'buckets': [{'key': 1, 'doc_count': 4}]},
+        },
+        'qf.attr_int.filter': {
+            'doc_count': 4,
+            'qf.attr_int': {
+                'buckets': [{'key': 0x13_00000002, 'doc_count': 4}]
+            },
+        },
+        'qf.attr_int.filter:18': {
+            'doc_count': 10,
+            'qf.attr_int:18': {
+                'buckets': [
+                    {'key': 0x12_00000001, 'doc_count': 4},
+                    {'key': 0x12_00000002, 'doc_count': 6},
+                ]
+            },
+        },
+    })
+    assert qf_res.attr_int.get_facet(18).all_values[1].count == 6
+
+    # post filter of the 18th attribute is not used by its own aggregation
+    sq = qf.apply(SearchQuery(), {'a18': ['1', '2']})
+    assert set(sq.get_context().aggregations) == {
+        'qf.brand.filter', 'qf.attr_int.filter'
+    }
+    qf_res = process(sq, {
+        'qf.brand.filter': {
+            'doc_count': 10,
+            'qf.brand': {'buckets': [{'key': 1, 'doc_count': 10}]},
+        },
+        'qf.attr_int.filter': {
+            'doc_count': 10,
+            'qf.attr_int': {
+                'buckets': [{'key': 0x13_00000002, 'doc_count': 7}]
+            },
+        },
+    })
+    assert [
+        (v.value, v.count, v.selected)
+        for v in qf_res.attr_int.get_facet(18).all_values
+    ] == [(1, 4, True), (2, 6, True)]
+    assert qf_res.attr_int.get_facet(19).all_values[0].count == 7
+
+    # repeated request does not need attribute aggregations at all
+    sq = qf.apply(SearchQuery(), {'a18': '1'})
+    assert set(sq.get_context().aggregations) == {'qf.brand.filter'}
+    qf_res = process(sq, {
+        'qf.brand.filter': {
+            'doc_count': 4,
+            'qf.brand': {'buckets': [{'key': 1, 'doc_count': 4}]},
+        },
+    })
+    assert qf_res.brand.all_values[0].count == 4
+    assert [
+        (v.value, v.count, v.selected)
+        for v in qf_res.attr_int.get_facet(18).all_values
+    ] == [(1, 4, True), (2, 6, False)]
+    assert qf_res.attr_int.get_facet(19).all_values[0].count == 4
+
+    # other query
+    sq = qf.apply(SearchQuery(Field('name').match('test')), {'a18': '1'})
+    assert len(sq.get_context().aggregations) == 3
+
+    # search params change aggregation results
+    sq = qf.apply(
+        SearchQuery().with_search_params(routing='1'), {'a18': '1'}
+    )
+    assert len(sq.get_context().aggregations) == 3
+    sq = qf.apply(
+        SearchQuery().with_search_params(terminate_after=100), {'a18': '1'}
+    )
+    assert len(sq.get_context().aggregations) == 3
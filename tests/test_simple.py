@@ -5,6 +5,7 @@ from elasticmagic.ext.queryfilter import QueryFilter
 from elasticmagic_qf_attrs import AttrBoolSimpleFilter
 from elasticmagic_qf_attrs import AttrRangeSimpleFilter
 from elasticmagic_qf_attrs import AttrIntSimpleFilter
+from elasticmagic_qf_attrs import AttrTaggedSimpleFilter
 
 
 def test_attr_int_simple_filter(compiler):
@@ -54,6 +55,157 @@ def test_attr_int_simple_filter(compiler):
     assert sq.to_dict(compiler=compiler) == {}
 
 
+def test_attr_int_simple_filter__contiguous_values(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrIntSimpleFilter('attr_int', Field('attr.int'), alias='a')
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18': ['40', '38', '39', '41']})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(Range('attr.int', gte=0x12_00000026, lte=0x12_00000029))
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18': ['38', '39']})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(Terms('attr.int', [0x12_00000026, 0x12_00000027]))
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(
+        SearchQuery(),
+        {'a18': ['100', '38', '39', '40', '7', '38', '50', '51', '52', '53']}
+    )
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(
+            Bool.should(
+                Range('attr.int', gte=0x12_00000026, lte=0x12_00000028),
+                Range('attr.int', gte=0x12_00000032, lte=0x12_00000035),
+                Terms('attr.int', [0x12_00000064, 0x12_00000007]),
+            )
+        )
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18': ['5', '38', '39', '40']})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(
+            Bool.should(
+                Range('attr.int', gte=0x12_00000026, lte=0x12_00000028),
+                Term('attr.int', 0x12_00000005),
+            )
+        )
+        .to_dict(compiler=compiler)
+    )
+
+
+def test_attr_int_simple_filter__range(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrIntSimpleFilter('attr_int', Field('attr.int'), alias='a')
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18__gte': '2010', 'a18__lte': '2020'})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(Range('attr.int', gte=0x12_000007da, lte=0x12_000007e4))
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18__gte': '2010'})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(Range('attr.int', gte=0x12_000007da, lte=0x12_7fffffff))
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18__lte': '-2'})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(Range('attr.int', gte=0x12_80000000, lte=0x12_fffffffe))
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18__gte': '-2', 'a18__lte': '8'})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(
+            Bool.should(
+                Range('attr.int', gte=0x12_fffffffe, lte=0x12_ffffffff),
+                Range('attr.int', gte=0x12_00000000, lte=0x12_00000008),
+            )
+        )
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18__gte': '8', 'a18__lte': '-2'})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(Range('attr.int', gte=0x12_00000001, lte=0x12_00000000))
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18__gte': '2010', 'a18': '1999'})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(
+            Bool.should(
+                Range('attr.int', gte=0x12_000007da, lte=0x12_7fffffff),
+                Term('attr.int', 0x12_000007cf),
+            )
+        )
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18__gte': 'abc'})
+    assert sq.to_dict(compiler=compiler) == {}
+
+
+def test_attr_simple_filters__exists(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrIntSimpleFilter('attr_int', Field('attr.int'), alias='a')
+    )
+    qf.add_filter(
+        AttrBoolSimpleFilter('attr_bool', Field('attr.bool'), alias='b')
+    )
+    qf.add_filter(
+        AttrRangeSimpleFilter('attr_range', Field('attr.float'), alias='r')
+    )
+
+    sq = qf.apply(
+        SearchQuery(),
+        {'a18__exists': 'true', 'b1__exists': 'false', 'r8__exists': 'True'}
+    )
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(Range('attr.int', gte=0x12_00000000, lte=0x12_ffffffff))
+        .filter(Bool.must_not(Range('attr.bool', gte=0b10, lte=0b11)))
+        .filter(Range('attr.float', gte=0x8_00000000, lte=0x8_ffffffff))
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18__exists': 'true', 'a18': '1'})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(
+            Bool.must(
+                Range('attr.int', gte=0x12_00000000, lte=0x12_ffffffff),
+                Term('attr.int', 0x12_00000001),
+            )
+        )
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a18__exists': 'yes'})
+    assert sq.to_dict(compiler=compiler) == {}
+
+
 def test_attr_int_simple_filter_no_alias(compiler):
     qf = QueryFilter()
     qf.add_filter(
@@ -219,3 +371,44 @@ def test_attr_bool_simple_filter(compiler):
 
     sq = qf.apply(SearchQuery(), {'a1': 'TRUE'})
     assert sq.to_dict(compiler=compiler) == {}
+
+
+def test_attr_tagged_simple_filter(compiler):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrTaggedSimpleFilter('attr_tagged', Field('attr.tagged'), alias='a')
+    )
+
+    sq = qf.apply(SearchQuery(), {'a1': 'true', 'a2': ['12', '-1']})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(Term('attr.tagged', 0x3_00000001))
+        .filter(Terms('attr.tagged', [0x4_0000000c, 0x4_ffffffff]))
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a1': 'false', 'a2__gte': '10'})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(Term('attr.tagged', 0x3_00000000))
+        .filter(Range('attr.tagged', gte=0x4_0000000a, lte=0x4_7fffffff))
+        .to_dict(compiler=compiler)
+    )
+
+    sq = qf.apply(SearchQuery(), {'a3__exists': 'true'})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(Range('attr.tagged', gte=0x6_00000000, lte=0x7_ffffffff))
+        .to_dict(compiler=compiler)
+    )
+
+    # bool values are not range bounds
+    sq = qf.apply(SearchQuery(), {'a1__gte': 'true'})
+    assert sq.to_dict(compiler=compiler) == {}
+
+    sq = qf.apply(SearchQuery(), {'a1__gte': ['5', 'true']})
+    assert sq.to_dict(compiler=compiler) == (
+        SearchQuery()
+        .filter(Range('attr.tagged', gte=0x2_00000005, lte=0x2_7fffffff))
+        .to_dict(compiler=compiler)
+    )
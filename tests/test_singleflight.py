@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+
+from elasticmagic import Field
+from elasticmagic import SearchQuery
+from elasticmagic.compiler import Compiler_6_0
+from elasticmagic.ext.asyncio.search import AsyncSearchQuery
+
+from elasticmagic_qf_attrs import AttrQueryFilter
+from elasticmagic_qf_attrs.facet import AttrIntFacetFilter
+from elasticmagic_qf_attrs.singleflight import agg_fingerprint
+from elasticmagic_qf_attrs.singleflight import AsyncSingleFlight
+from elasticmagic_qf_attrs.singleflight import search_facets
+from elasticmagic_qf_attrs.singleflight import search_facets_async
+from elasticmagic_qf_attrs.singleflight import SingleFlight
+
+import pytest
+
+from .conftest import FakeIndex
+
+
+RAW_RESULT = {
+    'aggregations': {
+        'qf.attr_int': {
+            'buckets': [{'key': 0x12_0000e2e4, 'doc_count': 4}]
+        },
+    }
+}
+
+
+class SyncFakeIndex:
+    def __init__(self, raw_result, release):
+        self.raw_result = raw_result
+        self.release = release
+        self.search_queries = []
+
+    def get_name(self):
+        return 'test'
+
+    def get_compiler(self):
+        return Compiler_6_0
+
+    def search(self, search_query):
+        self.search_queries.append(search_query)
+        self.release.wait()
+        return Compiler_6_0.compiled_query(search_query) \
+            .process_result(self.raw_result)
+
+
+def make_qf():
+    qf = AttrQueryFilter()
+    qf.add_filter(
+        AttrIntFacetFilter('attr_int', Field('attr.int'), alias='a')
+    )
+    return qf
+
+
+def test_agg_fingerprint():
+    qf = make_qf()
+    sq = SearchQuery(Field('name').match('phone'))
+    fingerprint = agg_fingerprint(qf.apply(sq, {'a18': '1'}))
+    assert agg_fingerprint(qf.apply(sq, {'a18': '1'})) == fingerprint
+    assert agg_fingerprint(qf.apply(sq.limit(10), {'a18': '1'})) == \
+        fingerprint
+    assert agg_fingerprint(qf.apply(sq, {'a18': '2'})) != fingerprint
+    assert agg_fingerprint(qf.apply(SearchQuery(), {'a18': '1'})) != \
+        fingerprint
+
+
+def test_single_flight():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait()
+        return object()
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(single_flight.do('key', fn))
+        )
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert all(res is results[0] for res in results)
+    assert single_flight._calls == {}
+
+    with pytest.raises(ZeroDivisionError):
+        single_flight.do('key', lambda: 1 / 0)
+    assert single_flight.do('key', lambda: 2) == 2
+
+
+@pytest.mark.asyncio
+async def test_async_single_flight():
+    single_flight = AsyncSingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return object()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ZeroDivisionError()
+
+    results = await asyncio.gather(
+        *(single_flight.do('key', fn) for _ in range(5))
+    )
+    errors = await asyncio.gather(
+        *(single_flight.do('key', fail) for _ in range(2)),
+        return_exceptions=True,
+    )
+    assert len(calls) == 1
+    assert all(res is results[0] for res in results)
+    assert all(isinstance(e, ZeroDivisionError) for e in errors)
+    assert single_flight._futures == {}
+
+
+@pytest.mark.asyncio
+async def test_async_single_flight__leader_cancelled():
+    single_flight = AsyncSingleFlight()
+    result = object()
+
+    async def fn():
+        await asyncio.sleep(0.02)
+        return result
+
+    leader = asyncio.ensure_future(single_flight.do('key', fn))
+    await asyncio.sleep(0)
+    followers = [
+        asyncio.ensure_future(single_flight.do('key', fn))
+        for _ in range(2)
+    ]
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert await asyncio.gather(*followers) == [result, result]
+    assert single_flight._futures == {}
+
+
+def test_search_facets():
+    release = threading.Event()
+    index = SyncFakeIndex(RAW_RESULT, release)
+    single_flight = SingleFlight()
+    results = []
+
+    def search():
+        results.append(
+            search_facets(
+                make_qf(), SearchQuery(index=index), {}, single_flight
+            )
+        )
+
+    threads = [threading.Thread(target=search) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(index.search_queries) == 1
+    assert index.search_queries[0].get_context().limit == 0
+    assert all(res is results[0] for res in results)
+    assert results[0].attr_int.get_facet(18).all_values[0].count == 4
+
+
+@pytest.mark.asyncio
+async def test_search_facets_async():
+    index = FakeIndex(RAW_RESULT, delay=0.01)
+    single_flight = AsyncSingleFlight()
+
+    results = await asyncio.gather(
+        *(
+            search_facets_async(
+                make_qf(), AsyncSearchQuery(index=index), {},
+                single_flight,
+            )
+            for _ in range(3)
+        ),
+        search_facets_async(
+            make_qf(), AsyncSearchQuery(index=index), {'a18': '1'},
+            single_flight,
+        ),
+    )
+    assert len(index.search_queries) == 2
+    assert results[0] is results[1] is results[2]
+    assert results[3] is not results[0]
+    assert results[0].attr_int.get_facet(18).all_values[0].count == 4
@@ -0,0 +1,182 @@
+import json
+
+from elasticmagic import Field
+from elasticmagic import SearchQuery
+from elasticmagic.compiler import Compiler_7_0
+
+from elasticmagic_qf_attrs import AttrQueryFilter
+from elasticmagic_qf_attrs.facet import AttrBoolFacetFilter
+from elasticmagic_qf_attrs.facet import AttrIntFacetFilter
+from elasticmagic_qf_attrs.facet import RawTermsAggResult
+from elasticmagic_qf_attrs.stream import ColumnarBuckets
+from elasticmagic_qf_attrs.stream import parse_response
+
+import pytest
+
+
+RAW_RESPONSE = {
+    'took': 12,
+    'timed_out': False,
+    'hits': {
+        'total': {'value': 3, 'relation': 'eq'},
+        'max_score': None,
+        'hits': [
+            {
+                '_id': '1',
+                '_score': 1.5e-3,
+                '_source': {'name': 'Café \"Тест\"'},
+            },
+        ],
+    },
+    'aggregations': {
+        'qf.attr_int': {
+            'doc_count_error_upper_bound': 0,
+            'sum_other_doc_count': 0,
+            'buckets': [
+                {'key': 0x12_0000e2e4, 'doc_count': 2},
+                {'key': 0x144_0000dead, 'doc_count': 1},
+            ]
+        },
+        'qf.attr_int.filter:18': {
+            'doc_count': 3,
+            'qf.attr_int:18': {
+                'buckets': [
+                    {'key': 0x12_0000e2e4, 'doc_count': 2},
+                    {'key': 0x12_0000e7e5, 'doc_count': 1},
+                ]
+            }
+        },
+        'qf.attr_bool': {
+            'buckets': [
+                {'key': 0b11, 'doc_count': 3},
+            ]
+        },
+        'other': {
+            'buckets': [
+                {'key': 'x', 'doc_count': -1, 'sub': [True, None, -2.5]},
+            ]
+        },
+    }
+}
+
+
+def iter_chunks(data, chunk_size):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1 << 20])
+def test_parse_response(chunk_size):
+    data = json.dumps(RAW_RESPONSE, ensure_ascii=False).encode('utf-8')
+    raw = parse_response(
+        iter_chunks(data, chunk_size),
+        lambda agg_name: agg_name.startswith('qf.attr_int')
+    )
+
+    aggs = raw.pop('aggregations')
+    expected_aggs = RAW_RESPONSE['aggregations']
+    assert raw == {k: v for k, v in RAW_RESPONSE.items() if k in raw}
+    assert aggs['other'] == expected_aggs['other']
+    assert aggs['qf.attr_bool'] == expected_aggs['qf.attr_bool']
+    buckets = aggs['qf.attr_int']['buckets']
+    assert isinstance(buckets, ColumnarBuckets)
+    assert list(buckets) == expected_aggs['qf.attr_int']['buckets']
+    buckets = aggs['qf.attr_int.filter:18']['qf.attr_int:18']['buckets']
+    assert isinstance(buckets, ColumnarBuckets)
+    assert list(buckets.keys) == [0x12_0000e2e4, 0x12_0000e7e5]
+    assert list(buckets.counts) == [2, 1]
+
+
+def test_parse_response__not_integer_keys():
+    raw = parse_response(
+        [b'{"a": {"buckets": [{"key": 1, "doc_count": 1}, ',
+         b'{"key": "2", "doc_count": 2}]}}'],
+        lambda agg_name: True
+    )
+    assert list(raw['a']['buckets']) == [
+        {'key': 1, 'doc_count': 1}, {'key': '2', 'doc_count': 2}
+    ]
+
+
+def test_parse_response__incomplete():
+    with pytest.raises(ValueError):
+        parse_response([b'{"took": 1'], lambda agg_name: True)
+    with pytest.raises(ValueError):
+        parse_response([b'{"took": 1} {'], lambda agg_name: True)
+
+
+@pytest.mark.parametrize('body', [
+    b'[1 2]',
+    b'{"a" 1}',
+    b'{1: 2}',
+    b'{"a": 1 "b": 2}',
+    b'{"a": 1,}',
+    b'[1,]',
+    b'[,1]',
+    b'[1,,2]',
+    b'{"a":: 1}',
+    b'{"a": 1}}',
+    b'{"a": 1]',
+    b'[1}',
+    b']',
+    b'{"a"}',
+    b'{"a": 1} 2',
+    b'{"buckets": [{"key": 1, "doc_count": 1} {"key": 2, "doc_count": 2}]}',
+    b'{"buckets": [, {"key": 1, "doc_count": 1}]}',
+    b'{"buckets": [{"key": 1, "doc_count": 1},]}',
+])
+@pytest.mark.parametrize('chunk_size', [1, 1 << 20])
+def test_parse_response__malformed(body, chunk_size):
+    with pytest.raises(ValueError):
+        parse_response(iter_chunks(body, chunk_size), lambda agg_name: True)
+
+
+def test_attr_query_filter__parse_search_result():
+    qf = AttrQueryFilter()
+    qf.add_filter(
+        AttrIntFacetFilter(
+            'attr_int', Field('attr.int'), alias='a', raw_buckets=True
+        )
+    )
+    qf.add_filter(
+        AttrBoolFacetFilter('attr_bool', Field('attr.bool'), alias='a')
+    )
+    sq = qf.apply(SearchQuery(), {'a18': '58084'})
+    raw_response = {
+        'hits': {'total': {'value': 3}, 'hits': []},
+        'aggregations': {
+            'qf._shared.0': {
+                'doc_count': 3,
+                'qf.attr_int': RAW_RESPONSE['aggregations']['qf.attr_int'],
+                'qf.attr_bool': RAW_RESPONSE['aggregations']['qf.attr_bool'],
+            },
+            'qf.attr_int.filter:18':
+                RAW_RESPONSE['aggregations']['qf.attr_int.filter:18'],
+        },
+    }
+    data = json.dumps(raw_response).encode('utf-8')
+
+    result = qf.parse_search_result(
+        iter_chunks(data, 16), sq, Compiler_7_0
+    )
+    assert result.total == 3
+
+    parser = qf.streaming_parser()
+    for chunk in iter_chunks(data, 7):
+        parser.feed(chunk)
+    assert Compiler_7_0.compiled_query(sq) \
+        .process_result(parser.close()).total == 3
+    main_agg = result.get_aggregation('qf._shared.0') \
+        .get_aggregation('qf.attr_int')
+    assert isinstance(main_agg, RawTermsAggResult)
+    assert isinstance(main_agg.raw_buckets, ColumnarBuckets)
+
+    qf_res = qf.process_result(result)
+    facet = qf_res.attr_int.get_facet(18)
+    assert [(v.value, v.count, v.selected) for v in facet.all_values] == [
+        (0xe2e4, 2, True), (0xe7e5, 1, False)
+    ]
+    facet = qf_res.attr_int.get_facet(324)
+    assert [(v.value, v.count) for v in facet.all_values] == [(0xdead, 1)]
+    facet = qf_res.attr_bool.get_facet(1)
+    assert [(v.value, v.count) for v in facet.all_values] == [(True, 3)]
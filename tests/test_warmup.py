@@ -0,0 +1,117 @@
+import asyncio
+
+from elasticmagic import Field
+from elasticmagic.ext.asyncio.search import AsyncSearchQuery
+
+from elasticmagic_qf_attrs import AttrQueryFilter
+from elasticmagic_qf_attrs.cache import LRUCache
+from elasticmagic_qf_attrs.facet import AttrIntFacetFilter
+from elasticmagic_qf_attrs.warmup import FacetCacheWarmer
+
+import pytest
+
+from .conftest import FakeIndex
+from .conftest import Timer
+
+
+RAW_RESULT = {
+    'aggregations': {
+        'qf.attr_int': {
+            'buckets': [{'key': 0x12_0000e2e4, 'doc_count': 4}]
+        },
+    }
+}
+
+
+@pytest.mark.asyncio
+async def test_facet_cache_warmer():
+    timer = Timer()
+    agg_cache = LRUCache(ttl=60, timer=timer)
+
+    def qf_factory():
+        qf = AttrQueryFilter(agg_cache=agg_cache)
+        qf.add_filter(
+            AttrIntFacetFilter('attr_int', Field('attr.int'), alias='a')
+        )
+        return qf
+
+    index = FakeIndex(RAW_RESULT, delay=0.01)
+    categories = [1, 2, 3, 4, 5]
+    warmer = FacetCacheWarmer(
+        qf_factory,
+        [
+            AsyncSearchQuery(index=index).filter(Field('category') == c)
+            for c in categories
+        ],
+        concurrency=2,
+    )
+
+    results = await warmer.warm_up()
+    assert len(results) == 5
+    assert results[0].attr_int.get_facet(18).all_values[0].count == 4
+    assert len(index.search_queries) == 5
+    assert index.max_active_searches == 2
+    assert len(agg_cache) == 5
+
+    qf = qf_factory()
+    sq = qf.apply(
+        AsyncSearchQuery(index=index).filter(Field('category') == 3), {}
+    )
+    assert sq.get_context().aggregations == {}
+
+    # cached entries are refreshed
+    timer.now = 50.0
+    await warmer.warm_up()
+    assert len(index.search_queries) == 10
+    timer.now = 100.0
+    sq = qf.apply(
+        AsyncSearchQuery(index=index).filter(Field('category') == 3), {}
+    )
+    assert sq.get_context().aggregations == {}
+
+
+def make_qf(agg_cache=None):
+    qf = AttrQueryFilter(agg_cache=agg_cache)
+    qf.add_filter(
+        AttrIntFacetFilter('attr_int', Field('attr.int'), alias='a')
+    )
+    return qf
+
+
+@pytest.mark.asyncio
+async def test_facet_cache_warmer__errors():
+    agg_cache = LRUCache()
+    error = ConnectionError()
+    failed_sq = AsyncSearchQuery(index=FakeIndex(error))
+    errors = []
+    warmer = FacetCacheWarmer(
+        lambda: make_qf(agg_cache),
+        [failed_sq, AsyncSearchQuery(index=FakeIndex(RAW_RESULT))],
+        on_error=lambda sq, e: errors.append((sq, e)),
+    )
+    results = await warmer.warm_up()
+    assert results[0] is error
+    assert results[1].attr_int.get_facet(18).all_values[0].count == 4
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(warmer.run(interval=10), timeout=0.05)
+    assert errors == [(failed_sq, error)]
+
+    with pytest.raises(ValueError):
+        FacetCacheWarmer(lambda: make_qf(agg_cache), [], concurrency=0)
+    # nothing to warm up without a cache
+    with pytest.raises(ValueError):
+        FacetCacheWarmer(make_qf, [])
+
+
+@pytest.mark.asyncio
+async def test_facet_cache_warmer__log_errors(caplog):
+    error = ConnectionError()
+    warmer = FacetCacheWarmer(
+        lambda: make_qf(LRUCache()),
+        [AsyncSearchQuery(index=FakeIndex(error))],
+    )
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(warmer.run(interval=10), timeout=0.05)
+    assert caplog.records[0].exc_info[1] is error
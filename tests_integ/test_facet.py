@@ -1,10 +1,12 @@
 import pytest
 
+from elasticmagic import agg
 from elasticmagic.ext.queryfilter import QueryFilter
 
 from elasticmagic_qf_attrs import AttrBoolFacetFilter
 from elasticmagic_qf_attrs import AttrRangeFacetFilter
 from elasticmagic_qf_attrs import AttrIntFacetFilter
+from elasticmagic_qf_attrs import AttrQueryFilter
 
 from .attrs import Battery
 from .attrs import Country
@@ -20,6 +22,12 @@ class AttrsQueryFilter(QueryFilter):
     ranges = AttrRangeFacetFilter(ProductDoc.attrs_range, alias='a')
 
 
+class TrimmedAttrsQueryFilter(AttrQueryFilter):
+    attrs = AttrIntFacetFilter(ProductDoc.attrs, alias='a')
+    bools = AttrBoolFacetFilter(ProductDoc.attrs_bool, alias='a')
+    ranges = AttrRangeFacetFilter(ProductDoc.attrs_range, alias='a')
+
+
 class AttrsQueryFilterComputeMinMax(QueryFilter):
     attrs = AttrIntFacetFilter(ProductDoc.attrs, alias='a')
     bools = AttrBoolFacetFilter(ProductDoc.attrs_bool, alias='a')
@@ -423,3 +431,92 @@ async def test_facet__selected_range_facet_compute_min_max(
     assert battery_facet.selected is False
     assert battery_facet.min == 4000
     assert battery_facet.max == 4200
+
+
+@pytest.mark.asyncio
+async def test_facets__attrs_getter(es_index, products):
+    qf = QueryFilter()
+    qf.add_filter(
+        AttrIntFacetFilter(
+            'attrs', ProductDoc.attrs, alias='a',
+            attrs_getter=lambda params: [Country.attr_id],
+        )
+    )
+
+    sq = qf.apply(
+        es_index.search_query(),
+        {f'a{Manufacturer.attr_id}': f'{Manufacturer.Values.huawei}'}
+    )
+
+    res = await sq.get_result()
+    assert res.total == 2
+
+    qf_res = qf.process_result(res)
+
+    assert list(qf_res.attrs.facets) == [
+        Manufacturer.attr_id, Country.attr_id
+    ]
+    manufacturer_facet = qf_res.attrs.get_facet(Manufacturer.attr_id)
+    assert len(manufacturer_facet.all_values) == 4
+    country_facet = qf_res.attrs.get_facet(Country.attr_id)
+    assert len(country_facet.all_values) == 1
+    china = country_facet.get_value(Country.Values.china)
+    assert china.count == 2
+
+
+@pytest.mark.asyncio
+async def test_facets__trim_response(es_index, products):
+    qf = TrimmedAttrsQueryFilter()
+
+    sq = (
+        es_index.search_query()
+        .aggs(
+            all_attrs=agg.Terms(ProductDoc.attrs, size=1),
+            waterproof=agg.Filter(
+                ProductDoc.attrs_bool == Waterproof.yes(),
+                aggs={'attrs': agg.Terms(ProductDoc.attrs, size=1)},
+            ),
+        )
+    )
+    sq = qf.apply(
+        sq, {f'a{Manufacturer.attr_id}': f'{Manufacturer.Values.huawei}'}
+    )
+    assert sq.get_context().search_params['filter_path']
+
+    res = await sq.get_result()
+    assert res.total == 2
+
+    # unused fields are excluded only from the facet aggregations
+    raw_aggs = res.raw['aggregations']
+    facet_aggs = [
+        raw_aggs['qf._shared.0']['qf.attrs'],
+        raw_aggs['qf._shared.0']['qf.bools'],
+        raw_aggs[f'qf.attrs.filter:{Manufacturer.attr_id}']
+        [f'qf.attrs:{Manufacturer.attr_id}'],
+    ]
+    for facet_agg in facet_aggs:
+        assert 'buckets' in facet_agg
+        assert 'sum_other_doc_count' not in facet_agg
+    assert 'sum_other_doc_count' in raw_aggs['all_attrs']
+    assert 'sum_other_doc_count' in raw_aggs['waterproof']['attrs']
+
+    all_attrs = res.get_aggregation('all_attrs')
+    assert len(all_attrs.buckets) == 1
+    waterproof = res.get_aggregation('waterproof')
+    assert waterproof.doc_count == 1
+    assert len(waterproof.get_aggregation('attrs').buckets) == 1
+
+    qf_res = qf.process_result(res)
+
+    manufacturer_facet = qf_res.attrs.get_facet(Manufacturer.attr_id)
+    assert len(manufacturer_facet.all_values) == 4
+    huawei = manufacturer_facet.get_value(Manufacturer.Values.huawei)
+    assert huawei.count == 2
+    assert huawei.selected is True
+    country_facet = qf_res.attrs.get_facet(Country.attr_id)
+    china = country_facet.get_value(Country.Values.china)
+    assert china.count == 2
+    waterproof_facet = qf_res.bools.get_facet(Waterproof.attr_id)
+    assert waterproof_facet.get_value(True).count == 1
+    display_facet = qf_res.ranges.get_facet(Display.attr_id)
+    assert display_facet.count == 2